@@ -28,34 +28,139 @@ import pyaudio
 import sys
 import time
 import json
-import paho.mqtt.client as paho
 import getopt
 import base64
+import threading
 
 sys.path.append('../SensorDrivers')
 
+import SensorAudioCodec
 import SensorJSON
+import SensorMQTTClient
+
+# the number of audio blocks that can wait to be sent before the oldest is dropped
+
+MEDIA_QUEUE_LENGTH = 50
+
+# the number of audio blocks (of 50mS each) in the capture ring
+
+AUDIO_RING_BLOCKS = 64
+
+# the most blocks that are combined into one message when the sender is behind
+
+AUDIO_MAX_COALESCE = 10
+
+# how often (in seconds) the audio counters are reported
+
+STATS_INTERVAL = 10.0
 
 '''
 ------------------------------------------------------------
     pyaudio callbacks
 '''
+
+# The capture ring. The callback copies each block into the next free buffer and
+# the sender thread takes them from there. There is one writer (the callback) and
+# one reader (the sender) and each only changes its own index so no lock is needed.
+# Buffers between ringReadIndex and ringWriteIndex belong to the sender.
+
+ringBuffers = []
+ringTimes = []
+ringWriteIndex = 0
+ringReadIndex = 0
+ringEvent = threading.Event()
+
+# counters
+ringOverflowCount = 0                       # blocks lost because the ring was full
+inputOverflowCount = 0                      # input overflows reported by PortAudio
+inputUnderflowCount = 0                     # input underflows reported by PortAudio
+
 def callback(samples, frame_count, time_info, status):
+    ''' runs in PortAudio's real time thread so only copies the block into the ring '''
+    global ringWriteIndex, ringOverflowCount, inputOverflowCount, inputUnderflowCount
+
+    if (status & pyaudio.paInputOverflow):
+        inputOverflowCount += 1
+    if (status & pyaudio.paInputUnderflow):
+        inputUnderflowCount += 1
+
+    if ((ringWriteIndex - ringReadIndex) >= AUDIO_RING_BLOCKS):
+        # the sender is too far behind
+        ringOverflowCount += 1
+    else:
+        slot = ringWriteIndex % AUDIO_RING_BLOCKS
+        # this reuses the buffer's storage when the block is the usual size
+        ringBuffers[slot][:] = samples
+        ringTimes[slot] = time.time()
+        ringWriteIndex += 1
+        ringEvent.set()
+
+    return (None, pyaudio.paContinue)
+
+'''
+------------------------------------------------------------
+    Sender thread
+'''
+
+mustExit = False
+sentBlockCount = 0
+sentMessageCount = 0
+
+def senderLoop():
+    ''' takes blocks from the ring and publishes them. If more than one block is
+    waiting they are sent together in one message. '''
+    global ringReadIndex, sentBlockCount, sentMessageCount
+
+    while not mustExit:
+        ringEvent.wait(0.1)
+        ringEvent.clear()
 
-    binSamples = base64.b64encode(str(samples))
+        while (ringWriteIndex > ringReadIndex):
+            count = min(ringWriteIndex - ringReadIndex, AUDIO_MAX_COALESCE)
+            slots = [(ringReadIndex + block) % AUDIO_RING_BLOCKS for block in range(0, count)]
+            timestamp = ringTimes[slots[0]]
+            samples = b''.join([bytes(ringBuffers[slot]) for slot in slots])
+
+            # the buffers can be reused now that they have been copied
+            ringReadIndex += count
+
+            sendAudio(timestamp, samples)
+            sentBlockCount += count
+            sentMessageCount += 1
+
+def sendAudio(timestamp, samples):
+    ''' encode and publish a message '''
+    data, state = audioEncoder.encode(samples)
+    binSamples = base64.b64encode(data)
 
     sensorDict = {}
-    sensorDict[SensorJSON.TIMESTAMP] = time.time()
+    sensorDict[SensorJSON.TIMESTAMP] = timestamp
     sensorDict[SensorJSON.DEVICEID] = deviceID
     sensorDict[SensorJSON.TOPIC] = audioTopic
     sensorDict[SensorJSON.AUDIO_DATA] = binSamples
     sensorDict[SensorJSON.AUDIO_CHANNELS] = audioChannels
     sensorDict[SensorJSON.AUDIO_RATE] = audioRate
     sensorDict[SensorJSON.AUDIO_SAMPTYPE] = 'int16'
-    sensorDict[SensorJSON.AUDIO_FORMAT] = 'pcm'
+    sensorDict[SensorJSON.AUDIO_FORMAT] = audioFormat
+    if (state != None):
+        sensorDict[SensorJSON.AUDIO_CODEC_STATE] = state
 
-    MQTTClient.publish(audioTopic, json.dumps(sensorDict))        
-    return (None, pyaudio.paContinue)
+    MQTTClient.publish(audioTopic, json.dumps(sensorDict))
+
+def reportStats():
+    ''' prints the audio counters every STATS_INTERVAL seconds '''
+    global statsTime
+
+    now = time.time()
+    if ((now - statsTime) < STATS_INTERVAL):
+        return
+    statsTime = now
+
+    print('Sent %d blocks in %d messages, overflows %d (ring %d, input %d), underflows %d, MQTT dropped %d' %
+            (sentBlockCount, sentMessageCount, ringOverflowCount + inputOverflowCount,
+            ringOverflowCount, inputOverflowCount, inputUnderflowCount,
+            MQTTClient.getTopicDroppedCount(audioTopic)))
+    sys.stdout.flush()
 
 
 '''
@@ -79,19 +184,22 @@ clientID = 'rtaudiomqttclient'
 audioIndex = 0
 audioRate = 16000
 audioChannels = 1
+audioFormat = 'pcm'
 
 # process command line args
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "b:c:d:h:r:s:y")
+    opts, args = getopt.getopt(sys.argv[1:], "b:c:d:f:h:r:s:y")
 except:
-    print ('RTAudioMQTT.py -b <brokerAddr> -c <clientID> -d <deviceID> -h <channels>')
+    print ('RTAudioMQTT.py -b <brokerAddr> -c <clientID> -d <deviceID> -f <format> -h <channels>')
     print ('  -r <rate> -s <secret> -y')
+    print ('  -f = audio coding: pcm, ulaw (2:1), adpcm (4:1) or opus (needs opuslib)')
     print ('  -y = daemon mode')
     print ('\nDefaults:')
     print ('  -b localhost (hostname or IP address)')
     print ('  -c rtaudiomqttclient')
     print ('  -d rtaudio')
+    print ('  -f pcm')
     print ('  -h 1')
     print ('  -r 16000')
     print ('  -s rtaudio')
@@ -106,6 +214,8 @@ for opt, arg in opts:
         clientID = arg
     if opt == '-d':
         deviceID = arg
+    if opt == '-f':
+        audioFormat = arg
     if opt == '-h':
         audioChannels = int(arg)
     if opt == '-j':
@@ -115,45 +225,59 @@ for opt, arg in opts:
     if opt == '-s':
         deviceSecret = arg
         
-        
+if not SensorAudioCodec.isFormatAvailable(audioFormat, audioRate):
+    print ('Audio format %s is not available at %dHz' % (audioFormat, audioRate))
+    sys.exit(2)
+
+audioEncoder = SensorAudioCodec.SensorAudioEncoder(audioFormat, audioRate, audioChannels)
+
 # start up the audio device
 
 audioDevice = pyaudio.PyAudio()
 audioBlockSize = audioRate / 20
+
+# allocate the capture ring before the callback can run
+for slot in range(0, AUDIO_RING_BLOCKS):
+    ringBuffers.append(bytearray(audioBlockSize * audioChannels * 2))
+    ringTimes.append(0)
+
 audioStream = audioDevice.open(stream_callback = callback, format=pyaudio.paInt16, channels = audioChannels, 
                         rate=audioRate, input=True, output=False, frames_per_buffer=audioBlockSize)
 
 audioTopic = deviceID + '/audio'
 
-MQTTClient = paho.Client(clientID, protocol=paho.MQTTv31)
-MQTTClient.on_connect = onConnect
+MQTTClient = SensorMQTTClient.SensorMQTTClient(clientID, deviceID, deviceSecret, brokerAddress,
+                        maxQueueLength=MEDIA_QUEUE_LENGTH)
+MQTTClient.onConnect = onConnect
 
-MQTTClient.username_pw_set(deviceID, deviceSecret)
+# connect in the background. The client reconnects by itself if the connection is lost.
 
-# try to connect
-
-while True:
-    try:
-        MQTTClient.connect(brokerAddress)
-        break
-    except:
-        print ("waiting to connect to broker",brokerAddress)
-        time.sleep(1)
-
-MQTTClient.loop_start()
+MQTTClient.start()
 
 print("RTAudioMQTT starting...")
 sys.stdout.flush()
 
+senderThread = threading.Thread(target=senderLoop)
+senderThread.daemon = True
+senderThread.start()
+
+statsTime = time.time()
+
 audioStream.start_stream()
-        
-while audioStream.is_active():
-    time.sleep(0.1) 
+
+try:
+    while audioStream.is_active():
+        time.sleep(0.1) 
+        reportStats()
+except:
+    pass
 
 # Exiting so clean everything up.   
         
 audioStream.stop_stream()
 audioStream.close()
 audioDevice.terminate()
-MQTTClient.loop_stop()
+mustExit = True
+senderThread.join()
+MQTTClient.stop()
 print("Exiting")
@@ -27,7 +27,6 @@
 import sys
 import time
 import json
-import paho.mqtt.client as paho
 import getopt
 import base64
 import subprocess
@@ -35,6 +34,7 @@ import subprocess
 sys.path.append('../SensorDrivers')
 
 import SensorJSON
+import SensorMQTTClient
 
 sayString = ""
 sayIt = False
@@ -102,23 +102,13 @@ for opt, arg in opts:
         
 ttsCompleteTopic = deviceID + '/ttscomplete'
 
-MQTTClient = paho.Client(clientID, protocol=paho.MQTTv31)
-MQTTClient.on_connect = onConnect
-MQTTClient.on_message = onMessage
+MQTTClient = SensorMQTTClient.SensorMQTTClient(clientID, deviceID, deviceSecret, brokerAddress)
+MQTTClient.onConnect = onConnect
+MQTTClient.onMessage = onMessage
 
-MQTTClient.username_pw_set(deviceID, deviceSecret)
+# connect in the background. The client reconnects by itself if the connection is lost.
 
-# try to connect
-
-while True:
-    try:
-        MQTTClient.connect(brokerAddress)
-        break
-    except:
-        print ("waiting to connect to broker",brokerAddress)
-        time.sleep(1)
-
-MQTTClient.loop_start()
+MQTTClient.start()
 
 print("RTDecodedSpeechMQTT starting...")
 sys.stdout.flush()
@@ -146,5 +136,5 @@ except:
 
 # Exiting so clean everything up.   
         
-MQTTClient.loop_stop()
+MQTTClient.stop()
 print("Exiting")
@@ -0,0 +1,322 @@
+#!/usr/bin/python
+"""
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015-2016, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import sys
+import time
+import json
+import getopt
+import base64
+import threading
+
+sys.path.append('../SensorDrivers')
+
+import SensorJSON
+import SensorMQTTClient
+import SensorBinary
+import SensorMediaStore
+
+# how often (in seconds) the main loop hands waiting frames to the writers. The
+# writers decide for themselves when there is enough to be worth writing.
+
+RECORDER_POLL_INTERVAL = 0.25
+
+# how often (in seconds) old segments are deleted
+
+RETENTION_INTERVAL = 60.0
+
+# the default retention limits
+
+RETENTION_MAX_MB = 1024                     # total size of all recordings (0 = no limit)
+RETENTION_MAX_HOURS = 0                     # age of the oldest recording (0 = no limit)
+
+# how often (in seconds) the recording counters are reported
+
+STATS_INTERVAL = 10.0
+
+'''
+------------------------------------------------------------
+    MQTT callbacks
+'''
+
+def onConnect(client, userdata, code):
+    for topic in videoTopics + messageTopics:
+        MQTTClient.subscribe(topic, 0)
+    print('Connected: ' + str(code))
+    sys.stdout.flush()
+
+def onSubscribe(client, data, mid, grantedQos):
+    print('Subscribed: ' + str(mid))
+    sys.stdout.flush()
+
+def onMessage(client, userdata, message):
+    ''' queues the frame or message with the topic's writer. Nothing is written
+    to disk here. '''
+    global skippedCount
+
+    for topic in videoTopics:
+        if SensorMQTTClient.topicMatches(topic, message.topic):
+            recordFrame(message)
+            return
+
+    # anything else is recorded as it is with its arrival time
+    skippedCount += getWriter(message.topic, SensorMediaStore.MESSAGE_DATA_SUFFIX).append(
+                time.time(), 0, 0, 0, message.payload)
+
+def recordFrame(message):
+    ''' queues the JPEG frame from a video message '''
+    global skippedCount
+
+    if message.topic.endswith('/status'):
+        return
+
+    try:
+        if SensorBinary.isMediaEnvelope(message.payload):
+            jsonObj = SensorBinary.unpackVideo(message.payload)
+            frame = jsonObj[SensorJSON.VIDEO_DATA]
+        else:
+            jsonObj = json.loads(message.payload)
+            frame = base64.b64decode(jsonObj[SensorJSON.VIDEO_DATA])
+        timestamp = float(jsonObj[SensorJSON.TIMESTAMP])
+        width = int(jsonObj[SensorJSON.VIDEO_WIDTH])
+        height = int(jsonObj[SensorJSON.VIDEO_HEIGHT])
+        rate = int(jsonObj.get(SensorJSON.VIDEO_RATE, 0))
+        videoFormat = jsonObj.get(SensorJSON.VIDEO_FORMAT, 'mjpeg')
+    except:
+        skippedCount += 1
+        return
+
+    # only JPEG frames are recorded (legacy records don't all have a format)
+    if (videoFormat != 'mjpeg'):
+        skippedCount += 1
+        return
+
+    # frames dropped because the disk is falling behind count as skipped
+    skippedCount += getWriter(message.topic, SensorMediaStore.VIDEO_DATA_SUFFIX).append(
+                timestamp, width, height, rate, frame)
+
+def getWriter(topic, dataSuffix):
+    ''' returns the topic's writer, creating it the first time the topic is seen '''
+    with writersLock:
+        writer = writers.get(topic)
+        if (writer == None):
+            writer = SensorMediaStore.SensorMediaWriter(
+                        SensorMediaStore.topicDirectory(recordDir, topic), topic,
+                        segmentBytes, dataSuffix)
+            writers[topic] = writer
+            print('Recording ' + topic)
+            sys.stdout.flush()
+    return writer
+
+'''
+------------------------------------------------------------
+    Recording housekeeping - runs on the main thread
+'''
+
+def flushWriters(force=False):
+    with writersLock:
+        currentWriters = list(writers.values())
+    for writer in currentWriters:
+        writer.flush(force)
+
+def applyRetention():
+    ''' deletes the oldest segments every RETENTION_INTERVAL seconds '''
+    global retentionTime
+
+    now = time.time()
+    if ((now - retentionTime) < RETENTION_INTERVAL):
+        return
+    retentionTime = now
+
+    with writersLock:
+        activePaths = set([writer.getPath() for writer in writers.values()])
+    removed = SensorMediaStore.enforceRetention(recordDir, maxAgeHours * 3600, maxMB * 1024 * 1024,
+                activePaths)
+    if (removed > 0):
+        print('Removed %.1fMB of old recordings' % (removed / (1024.0 * 1024.0)))
+        sys.stdout.flush()
+
+def reportStats():
+    ''' prints the recording counters every STATS_INTERVAL seconds '''
+    global statsTime
+
+    now = time.time()
+    if ((now - statsTime) < STATS_INTERVAL):
+        return
+    statsTime = now
+
+    with writersLock:
+        currentWriters = list(writers.items())
+    for topic, writer in currentWriters:
+        print('%s: %d records, %.1fMB in %d segments' % (topic, writer.getFrameCount(),
+                writer.getByteCount() / (1024.0 * 1024.0), writer.getSegmentCount()))
+    if (skippedCount > 0):
+        print('Skipped %d messages' % skippedCount)
+    sys.stdout.flush()
+
+def exportClip():
+    ''' writes the frames of one topic between the clip times to clipPath. The
+    -v topics can be wildcards but must match exactly one recorded camera. '''
+    matches = []
+    for topic, directory in SensorMediaStore.listTopics(recordDir):
+        if not SensorMediaStore.SensorMediaReader(directory).isVideo():
+            continue
+        for videoTopic in videoTopics:
+            if SensorMQTTClient.topicMatches(videoTopic, topic):
+                matches.append((topic, directory))
+                break
+
+    if (len(matches) == 0):
+        print('No video recording of ' + ','.join(videoTopics))
+        return
+    if (len(matches) > 1):
+        print('More than one camera matches %s, use -v to pick one of:' % ','.join(videoTopics))
+        for topic, directory in matches:
+            print('  ' + topic)
+        return
+
+    topic, directory = matches[0]
+    reader = SensorMediaStore.SensorMediaReader(directory)
+    timeRange = reader.getTimeRange()
+    if (timeRange == None):
+        print('No recording of ' + topic)
+        return
+    print('Recording of %s runs from %.3f to %.3f' % (topic, timeRange[0], timeRange[1]))
+    count = SensorMediaStore.exportClip(directory, clipStart, clipEnd, clipPath)
+    print('Exported %d frames to %s' % (count, clipPath))
+
+'''
+------------------------------------------------------------
+    Main code
+'''
+
+deviceID = 'rtmediarecorder'
+brokerAddress = 'localhost'
+deviceSecret = 'rtmediarecorder'
+clientID = 'rtmediarecorderclient'
+videoTopics = ['rtuvccam/video']
+messageTopics = []
+recordDir = 'recordings'
+segmentBytes = SensorMediaStore.STORE_SEGMENT_BYTES
+maxMB = RETENTION_MAX_MB
+maxAgeHours = RETENTION_MAX_HOURS
+clipPath = None
+clipStart = None
+clipEnd = None
+writers = {}
+writersLock = threading.Lock()
+skippedCount = 0
+
+# process command line args
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], "a:b:c:d:e:g:m:o:s:t:v:x:")
+except:
+    print ('RTMediaRecorder.py -a <maxAge> -b <brokerAddr> -c <clientID> -d <deviceID> -e <clipFile>')
+    print ('    -g <segmentSize> -m <maxSize> -o <recordDir> -s <secret> -t <messageTopics>')
+    print ('    -v <videoTopics> -x <start>:<end>')
+    print ('\n  -a = delete recordings older than this many hours (0 = keep)')
+    print ('  -e = export a clip of the camera matching -v to this file instead of recording')
+    print ('  -g = segment size in MB')
+    print ('  -m = total size of all recordings in MB (0 = no limit)')
+    print ('  -t = comma separated topics recorded as raw messages (eg +/sensors,+/audio)')
+    print ('  -v = comma separated video topics. Wildcards (eg +/video) record every camera')
+    print ('  -x = clip start and end times (Unix time) for -e')
+    print ('\nDefaults:')
+    print ('  -a %d' % RETENTION_MAX_HOURS)
+    print ('  -b localhost (hostname or IP address)')
+    print ('  -c rtmediarecorderclient')
+    print ('  -d rtmediarecorder')
+    print ('  -g %d' % (SensorMediaStore.STORE_SEGMENT_BYTES / (1024 * 1024)))
+    print ('  -m %d' % RETENTION_MAX_MB)
+    print ('  -o recordings')
+    print ('  -s rtmediarecorder')
+    print ('  -t none')
+    print ('  -v rtuvccam/video')
+    print ('  -x the whole recording')
+    sys.exit(2)
+
+for opt, arg in opts:
+    if opt == '-a':
+        maxAgeHours = float(arg)
+    if opt == '-b':
+        brokerAddress = arg
+    if opt == '-c':
+        clientID = arg
+    if opt == '-d':
+        deviceID = arg
+    if opt == '-e':
+        clipPath = arg
+    if opt == '-g':
+        segmentBytes = int(arg) * 1024 * 1024
+    if opt == '-m':
+        maxMB = int(arg)
+    if opt == '-o':
+        recordDir = arg
+    if opt == '-s':
+        deviceSecret = arg
+    if opt == '-t':
+        messageTopics = arg.split(',')
+    if opt == '-v':
+        videoTopics = arg.split(',')
+    if opt == '-x':
+        clipStart, clipEnd = [float(value) for value in arg.split(':')]
+
+if (clipPath != None):
+    exportClip()
+    sys.exit(0)
+
+print("RTMediaRecorder starting...")
+sys.stdout.flush()
+
+MQTTClient = SensorMQTTClient.SensorMQTTClient(clientID, deviceID, deviceSecret, brokerAddress)
+MQTTClient.onSubscribe = onSubscribe
+MQTTClient.onConnect = onConnect
+MQTTClient.onMessage = onMessage
+
+statsTime = time.time()
+retentionTime = 0
+
+# connect in the background. The client reconnects by itself if the connection is lost.
+
+MQTTClient.start()
+
+try:
+    while True:
+        flushWriters()
+        applyRetention()
+        reportStats()
+        time.sleep(RECORDER_POLL_INTERVAL)
+except:
+    pass
+
+# Exiting so clean everything up.
+
+MQTTClient.stop()
+with writersLock:
+    for writer in writers.values():
+        writer.close()
+print("Exiting")
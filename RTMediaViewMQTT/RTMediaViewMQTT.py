@@ -27,16 +27,68 @@
 import pygame
 import pyaudio
 import sys
-import paho.mqtt.client as paho
 import cStringIO
 import getopt
 import time
 import json
 import base64
+import math
+import threading
+
+# PIL is optional. If present, mosaic tiles are decoded at a reduced scale.
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 sys.path.append('../SensorDrivers')
 
+import SensorAudioCodec
 import SensorJSON
+import SensorMQTTClient
+import SensorMediaSync
+import SensorDecodePool
+import SensorBinary
+
+# the default target latency in milliseconds. Media is held for this long to
+# smooth out variation in network delay.
+
+MEDIA_TARGET_LATENCY = 200
+
+# the most video frames and audio messages that can be buffered. Video frames are
+# held decoded so the video buffer is kept short (one second at 30fps).
+
+VIDEO_BUFFER_LENGTH = 30
+AUDIO_BUFFER_LENGTH = 1000
+
+# the default number of video decode threads. Frames waiting to be decoded beyond
+# two per thread are skipped.
+
+VIDEO_DECODE_WORKERS = 2
+
+# the default mosaic window size, used when the video topic is a wildcard, and the
+# number of cameras that can have a frame waiting to be decoded
+
+MOSAIC_WIDTH = 1280
+MOSAIC_HEIGHT = 720
+MOSAIC_QUEUE_LENGTH = 64
+
+# a camera's tile is removed if no frames arrive from it for this many seconds
+
+MOSAIC_IDLE_TIMEOUT = 5.0
+
+# video this far (in seconds) ahead of the clock is shown without synchronization
+
+VIDEO_MAX_EARLY = 2.0
+
+# how often the display is serviced
+
+VIDEO_POLL_INTERVAL = 0.005
+
+# how often (in seconds) the playout counters are reported
+
+STATS_INTERVAL = 10.0
 
 '''
 ------------------------------------------------------------
@@ -54,39 +106,253 @@ def onSubscribe(client, data, mid, grantedQos):
     sys.stdout.flush()
 
 def onMessage(client, userdata, message):
-    global firstVideo, screen, firstAudio, audioStream
-    try:
-        jsonObj = json.loads(message.payload)
-
-        if message.topic == videoTopic:
-            try:
-                if firstVideo:
-                    firstVideo = False
-                    size=(int(jsonObj[SensorJSON.VIDEO_WIDTH]), int(jsonObj[SensorJSON.VIDEO_HEIGHT]))
-                    screen = pygame.display.set_mode(size)
-
-                image = base64.b64decode(jsonObj[SensorJSON.VIDEO_DATA])
-                imageFile = cStringIO.StringIO(image)
-                imageSurface = pygame.image.load(imageFile)
-                screen.blit(imageSurface, (0, 0))
-                pygame.display.flip()
-            except:
-                print ("video data error", sys.exc_info()[0],sys.exc_info()[1])
+    ''' hands the message to the decoders. Nothing here waits for decoding,
+    the display or the audio device. '''
+    if message.topic == audioTopic:
+        audioDecoders.enqueue(message.payload)
+    elif mosaicMode:
+        if not message.topic.endswith('/status'):
+            # only the latest frame from each camera waits to be decoded
+            videoDecoders.enqueue((message.topic, message.payload), message.topic)
+    else:
+        videoDecoders.enqueue(message.payload)
 
+'''
+------------------------------------------------------------
+    Decoders - these run on the decode pool threads
+'''
+
+def decodeRecord(payload):
+    ''' returns the record from a binary envelope or a JSON message '''
+    if SensorBinary.isMediaEnvelope(payload):
+        return SensorBinary.unpackVideo(payload), True
+    return json.loads(payload), False
+
+def decodeVideo(payload):
+    ''' decodes a video frame into a surface and queues it for display. Frames
+    older than the one last shown are not decoded at all. '''
+    global videoStaleCount
+
+    jsonObj, binaryMedia = decodeRecord(payload)
+    timestamp = float(jsonObj[SensorJSON.TIMESTAMP])
+    mediaClock.arrived(timestamp)
+
+    # only JPEG frames can be displayed (legacy records don't all have a format)
+    if (jsonObj.get(SensorJSON.VIDEO_FORMAT, 'mjpeg') != 'mjpeg'):
+        return
+
+    if (timestamp <= lastShownTimestamp):
+        videoStaleCount += 1
+        return
+
+    if binaryMedia:
+        image = jsonObj[SensorJSON.VIDEO_DATA]
+    else:
+        image = base64.b64decode(jsonObj[SensorJSON.VIDEO_DATA])
+
+    # pygame releases the GIL while SDL_image decodes so the decoders run in parallel
+    imageSurface = pygame.image.load(cStringIO.StringIO(image), 'frame.jpg')
+    videoBuffer.put(timestamp, imageSurface)
+
+def decodeTile(message):
+    ''' decodes a frame from one camera of the mosaic at the size of its tile '''
+    global videoStaleCount
+
+    topic, payload = message
+    jsonObj, binaryMedia = decodeRecord(payload)
+    if (jsonObj.get(SensorJSON.VIDEO_FORMAT, 'mjpeg') != 'mjpeg'):
+        return
+    timestamp = float(jsonObj[SensorJSON.TIMESTAMP])
+
+    with mosaicLock:
+        # a camera not seen before gets a tile the next time the mosaic is shown
+        lastTimestamp = mosaicTimestamps.setdefault(topic, 0)
+        mosaicLastSeen[topic] = time.time()
+    if (timestamp <= lastTimestamp):
+        videoStaleCount += 1
+        return
+
+    if binaryMedia:
+        image = jsonObj[SensorJSON.VIDEO_DATA]
+    else:
+        image = base64.b64decode(jsonObj[SensorJSON.VIDEO_DATA])
+    imageSurface = decodeScaled(image, mosaicTileSize)
+
+    with mosaicLock:
+        # another thread may have finished a newer frame from the same camera. The
+        # camera's tile may also have been removed as idle meanwhile.
+        if (timestamp > mosaicTimestamps.get(topic, 0)):
+            mosaicTimestamps[topic] = timestamp
+            mosaicLastSeen.setdefault(topic, time.time())
+            mosaicReady[topic] = imageSurface
         else:
-            try:
-                if firstAudio:
-                    global audioStream
-                    firstAudio = False
-                    audioStream = audioDevice.open(format=pyaudio.paInt16, channels=int(jsonObj[SensorJSON.AUDIO_CHANNELS]),
-                        rate=int(jsonObj[SensorJSON.AUDIO_RATE]), output=True)
-                samples = base64.b64decode(jsonObj[SensorJSON.AUDIO_DATA])
-                audioStream.write(samples)
-            except:
-                print ("audio data error", sys.exc_info()[0],sys.exc_info()[1])
+            videoStaleCount += 1
+
+def decodeScaled(image, size):
+    ''' decodes a JPEG into a surface that fits in size. With PIL the JPEG is
+    decoded at a reduced scale (1/2, 1/4 or 1/8) which is much cheaper than
+    decoding at full size and then scaling down. Both PIL and pygame release
+    the GIL while decoding. '''
+    if (Image != None):
+        jpeg = Image.open(cStringIO.StringIO(image))
+        jpeg.draft('RGB', size)
+        jpeg = jpeg.convert('RGB')
+        imageSurface = pygame.image.frombuffer(jpeg.tobytes(), jpeg.size, 'RGB')
+    else:
+        imageSurface = pygame.image.load(cStringIO.StringIO(image), 'frame.jpg')
+    return fitSurface(imageSurface, size)
+
+def fitSurface(imageSurface, size):
+    ''' scales a surface to fit in size, keeping its aspect ratio '''
+    width, height = imageSurface.get_size()
+    scale = min(float(size[0]) / width, float(size[1]) / height)
+    fitted = (max(1, int(width * scale)), max(1, int(height * scale)))
+    if (fitted == (width, height)):
+        return imageSurface
+    return pygame.transform.scale(imageSurface, fitted)
+
+def decodeAudio(payload):
+    ''' decodes audio and queues it for playout. There is only one audio decode
+    thread as some codecs depend on the messages being decoded in order. '''
+    global audioDecoder
+
+    jsonObj, binaryMedia = decodeRecord(payload)
+    timestamp = float(jsonObj[SensorJSON.TIMESTAMP])
+    mediaClock.arrived(timestamp)
+
+    rate = int(jsonObj[SensorJSON.AUDIO_RATE])
+    channels = int(jsonObj[SensorJSON.AUDIO_CHANNELS])
+
+    # a new decoder is needed if the source changes its coding
+    audioFormat = jsonObj.get(SensorJSON.AUDIO_FORMAT, 'pcm')
+    if (audioDecoder == None) or (audioDecoder.format != audioFormat):
+        audioDecoder = SensorAudioCodec.SensorAudioDecoder(audioFormat, rate, channels)
 
+    samples = audioDecoder.decode(base64.b64decode(jsonObj[SensorJSON.AUDIO_DATA]),
+            jsonObj.get(SensorJSON.AUDIO_CODEC_STATE))
+    audioPlayer.put(timestamp, samples, rate, channels)
+
+'''
+------------------------------------------------------------
+    Video playout
+'''
+
+def presentVideo():
+    ''' shows the newest decoded frame that is due by the presentation clock.
+    Frames that were due but have been overtaken are dropped. '''
+    global screen, screenSize, videoShownCount, videoLateCount, videoUnsyncedCount
+    global videoStaleCount, lastShownTimestamp
+
+    clock = mediaClock.now()
+    if (clock == None):
+        return
+
+    frames = videoBuffer.popUntil(clock)
+    if (len(frames) == 0):
+        oldest = videoBuffer.peekTimestamp()
+        if (oldest == None) or ((oldest - clock) < VIDEO_MAX_EARLY):
+            return
+        # the video is so far ahead of the clock that the two sources' clocks
+        # must disagree. Show it as it comes rather than not at all.
+        frames = [videoBuffer.pop()]
+        videoUnsyncedCount += 1
+
+    videoLateCount += len(frames) - 1
+    timestamp, imageSurface = frames[-1]
+    if (timestamp <= lastShownTimestamp):
+        # decoded after a newer frame was shown
+        videoStaleCount += 1
+        return
+    lastShownTimestamp = timestamp
+
+    try:
+        size = imageSurface.get_size()
+        if (screen == None) or (size != screenSize):
+            screen = pygame.display.set_mode(size)
+            screenSize = size
+        screen.blit(imageSurface, (0, 0))
+        pygame.display.flip()
+        videoShownCount += 1
     except:
-        print ("JSON error", sys.exc_info()[0],sys.exc_info()[1])
+        print ("video data error", sys.exc_info()[0],sys.exc_info()[1])
+
+'''
+------------------------------------------------------------
+    Mosaic playout - used when the video topic is a wildcard
+'''
+
+def presentMosaic():
+    ''' draws the tiles that have new frames. Only the changed tiles are
+    updated on the display. '''
+    global screen, mosaicTopics, mosaicColumns, mosaicTileSize, videoShownCount
+
+    now = time.time()
+    with mosaicLock:
+        # cameras that have gone quiet lose their tiles
+        for topic in list(mosaicLastSeen.keys()):
+            if ((now - mosaicLastSeen[topic]) >= MOSAIC_IDLE_TIMEOUT):
+                del mosaicLastSeen[topic]
+                del mosaicTimestamps[topic]
+                mosaicReady.pop(topic, None)
+                mosaicCaptions.pop(topic, None)
+                print('Removed idle camera ' + topic)
+                sys.stdout.flush()
+        topics = sorted(mosaicTimestamps.keys())
+        ready = dict(mosaicReady)
+        mosaicReady.clear()
+
+    if (screen == None):
+        screen = pygame.display.set_mode((mosaicWidth, mosaicHeight))
+
+    if (topics != mosaicTopics):
+        # a camera has come or gone so lay out the grid again
+        mosaicTopics = topics
+        mosaicColumns = max(1, int(math.ceil(math.sqrt(len(topics)))))
+        rows = max(1, int(math.ceil(len(topics) / float(mosaicColumns))))
+        mosaicTileSize = (mosaicWidth // mosaicColumns, mosaicHeight // rows)
+        screen.fill((0, 0, 0))
+        pygame.display.flip()
+
+    tileWidth, tileHeight = mosaicTileSize
+    rects = []
+    for topic, imageSurface in ready.items():
+        index = mosaicTopics.index(topic)
+        tile = pygame.Rect((index % mosaicColumns) * tileWidth, (index // mosaicColumns) * tileHeight,
+                           tileWidth, tileHeight)
+
+        # frames decoded before the layout changed are the wrong size
+        imageSurface = fitSurface(imageSurface, mosaicTileSize)
+
+        screen.fill((0, 0, 0), tile)
+        screen.blit(imageSurface, imageSurface.get_rect(center=tile.center))
+        if topic not in mosaicCaptions:
+            mosaicCaptions[topic] = mosaicFont.render(topic, True, (255, 255, 255), (0, 0, 0))
+        screen.blit(mosaicCaptions[topic], (tile.left + 2, tile.top + 2))
+        rects.append(tile)
+
+    if (len(rects) > 0):
+        pygame.display.update(rects)
+        videoShownCount += len(rects)
+
+def reportStats():
+    ''' prints the playout counters every STATS_INTERVAL seconds '''
+    global statsTime
+
+    now = time.time()
+    if ((now - statsTime) < STATS_INTERVAL):
+        return
+    statsTime = now
+
+    if mediaClock.isAudioDriven():
+        clockSource = 'audio'
+    else:
+        clockSource = 'local'
+    print('Video shown %d, late %d, stale %d, skipped %d, unsynced %d, overflow %d; audio underruns %d, trimmed %d, buffered %dms (target %dms); clock %s' %
+            (videoShownCount, videoLateCount, videoStaleCount, videoDecoders.getSkippedCount(),
+            videoUnsyncedCount, videoBuffer.getDroppedCount(),
+            audioPlayer.getUnderrunCount(), audioPlayer.getTrimmedCount(),
+            audioPlayer.getBufferedTime() * 1000, audioPlayer.getTarget() * 1000, clockSource))
+    sys.stdout.flush()
 
 '''
 ------------------------------------------------------------
@@ -100,21 +366,51 @@ videoTopic = 'rtuvccam/video'
 audioTopic = 'rtaudio/audio'
 clientID = 'rtmediaviewclient'
 
-firstVideo = True
-firstAudio = True
-audioStream = None
+targetLatency = MEDIA_TARGET_LATENCY
+screen = None
+screenSize = None
+audioDecoder = None
+videoShownCount = 0
+videoLateCount = 0
+videoUnsyncedCount = 0
+videoStaleCount = 0
+lastShownTimestamp = 0
+decodeWorkers = VIDEO_DECODE_WORKERS
+mosaicWidth = MOSAIC_WIDTH
+mosaicHeight = MOSAIC_HEIGHT
+
+# mosaic state. mosaicTimestamps has the newest frame decoded for each camera,
+# mosaicLastSeen when a frame last arrived from it and mosaicReady the frames
+# decoded but not yet drawn. These are shared with the decode threads.
+
+mosaicLock = threading.Lock()
+mosaicTimestamps = {}
+mosaicLastSeen = {}
+mosaicReady = {}
+mosaicTopics = []
+mosaicColumns = 1
+mosaicTileSize = (MOSAIC_WIDTH, MOSAIC_HEIGHT)
+mosaicCaptions = {}
 
 # process command line args
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "a:b:c:d:s:v:")
+    opts, args = getopt.getopt(sys.argv[1:], "a:b:c:d:l:m:n:s:v:")
 except:
-    print ('RTMediaViewMQTT.py -a <audioTopic> -b <brokerAddr> -c <clientID> -d <deviceID> -s <secret> -v videoTopic')
+    print ('RTMediaViewMQTT.py -a <audioTopic> -b <brokerAddr> -c <clientID> -d <deviceID>')
+    print ('    -l <latency> -m <width>x<height> -n <decoders> -s <secret> -v videoTopic')
+    print ('\n  -l = target latency in milliseconds')
+    print ('  -m = mosaic window size')
+    print ('  -n = number of video decode threads')
+    print ('  -v = video topic. A wildcard (eg +/video) shows every camera in a mosaic')
     print ('\nDefaults:')
     print ('  -a rtaudio/audio')
     print ('  -b localhost (hostname or IP address)')
     print ('  -c rtmediaviewclient')
     print ('  -d rtmediaview')
+    print ('  -l %d' % MEDIA_TARGET_LATENCY)
+    print ('  -m %dx%d' % (MOSAIC_WIDTH, MOSAIC_HEIGHT))
+    print ('  -n %d' % VIDEO_DECODE_WORKERS)
     print ('  -s rtmediaview')
     print ('  -v rtuvccam/video')
     sys.exit(2)
@@ -128,53 +424,77 @@ for opt, arg in opts:
         clientID = arg
     if opt == '-d':
         deviceID = arg
+    if opt == '-l':
+        targetLatency = int(arg)
+    if opt == '-m':
+        mosaicWidth, mosaicHeight = [int(value) for value in arg.split('x')]
+    if opt == '-n':
+        decodeWorkers = int(arg)
     if opt == '-s':
         deviceSecret = arg
     if opt == '-v':
         videoTopic = arg
 
+mosaicMode = ('+' in videoTopic) or ('#' in videoTopic)
+mosaicTileSize = (mosaicWidth, mosaicHeight)
+
 print("RTMediaViewMQTT starting...")
 sys.stdout.flush()
 
-MQTTClient = paho.Client(clientID, protocol=paho.MQTTv31)
+MQTTClient = SensorMQTTClient.SensorMQTTClient(clientID, deviceID, deviceSecret, brokerAddress)
+MQTTClient.onSubscribe = onSubscribe
+MQTTClient.onConnect = onConnect
+MQTTClient.onMessage = onMessage
+
+pygame.init()
+mosaicFont = pygame.font.Font(None, 18)
+
+audioDevice = pyaudio.PyAudio()
 
-MQTTClient.on_subscribe = onSubscribe
-MQTTClient.on_connect = onConnect
-MQTTClient.on_message = onMessage
+# the presentation clock and the per stream jitter buffers. The audio player drives
+# the clock while audio is playing.
 
-MQTTClient.username_pw_set(deviceID, deviceSecret)
+mediaClock = SensorMediaSync.SensorMediaClock(targetLatency / 1000.0)
+videoBuffer = SensorMediaSync.SensorJitterBuffer(VIDEO_BUFFER_LENGTH)
+audioPlayer = SensorMediaSync.SensorAudioPlayer(audioDevice, mediaClock, targetLatency / 1000.0,
+                        AUDIO_BUFFER_LENGTH)
 
-# try to connect
+# the decoders. Audio has a single thread so that it is decoded in order.
 
-while True:
-    try:
-        MQTTClient.connect(brokerAddress)
-        break
-    except:
-        print ("waiting to connect to broker",brokerAddress)
-        time.sleep(1)
+if mosaicMode:
+    videoDecoders = SensorDecodePool.SensorDecodePool(decodeTile, decodeWorkers, MOSAIC_QUEUE_LENGTH)
+else:
+    videoDecoders = SensorDecodePool.SensorDecodePool(decodeVideo, decodeWorkers, 2 * decodeWorkers)
+audioDecoders = SensorDecodePool.SensorDecodePool(decodeAudio, 1, AUDIO_BUFFER_LENGTH)
+videoDecoders.start()
+audioDecoders.start()
 
-pygame.init()
+statsTime = time.time()
 
-audioDevice = pyaudio.PyAudio()
+# connect in the background. The client reconnects by itself if the connection is lost.
 
-MQTTClient.loop_start()
+MQTTClient.start()
 
 try:
     while True:
-        # could add some extra functionality here if required
-        time.sleep(1)
-        pass
+        # the display is only used from this thread
+        if mosaicMode:
+            presentMosaic()
+        else:
+            presentVideo()
+        reportStats()
+        for event in pygame.event.get():
+            if (event.type == pygame.QUIT):
+                raise KeyboardInterrupt
+        time.sleep(VIDEO_POLL_INTERVAL)
 except:
     pass
 
 # Exiting so clean everything up.
 
-try:
-    audioStream.stop_stream()
-    audioStream.close()
-except:
-    pass
+MQTTClient.stop()
+videoDecoders.stop()
+audioDecoders.stop()
+audioPlayer.close()
 audioDevice.terminate()
-MQTTClient.loop_stop()
 print("Exiting")
@@ -30,18 +30,48 @@ import sys
 import getopt
 import time
 import json
-import paho.mqtt.client as paho
 import base64
+import collections
+import threading
 import picamera
 
 sys.path.append('../SensorDrivers')
 
 import SensorJSON
+import SensorMQTTClient
+import SensorBinary
+import SensorVideoControl
 
 # camera parameters - change as required
 
 CAMERA_INDEX = 0
 
+# the splitter ports used for the streams in order. The camera has four.
+
+CAMERA_SPLITTER_PORTS = (1, 2, 3, 0)
+
+# the default number of frames that can wait to be sent. Once this many are waiting,
+# each new frame replaces the oldest so that the newest frames are always sent.
+
+VIDEO_MAX_QUEUED = 2
+
+# the number of frames per stream that can be with the MQTT client's network code at once
+
+VIDEO_MAX_INFLIGHT = 2
+
+# the number of captured frames per stream that can wait for the publish thread
+
+FRAME_QUEUE_LENGTH = 2
+
+# H.264 frames can't be dropped one at a time so more are allowed to wait. If even this
+# many are waiting, they are all dropped along with the frames up to the next key frame.
+
+H264_FRAME_QUEUE_LENGTH = 60
+
+# how often (in seconds) the delivered frame rate is reported
+
+STATS_INTERVAL = 10.0
+
 '''
 ------------------------------------------------------------
     MQTT callbacks
@@ -51,96 +81,306 @@ def onConnect(client, userdata, code):
     print('Connected: ' + str(code))
     sys.stdout.flush()
 
+'''
+------------------------------------------------------------
+    pi camera streams
+'''
+
+class PiCameraStream():
+    ''' One encoder output. Each stream is recorded on its own splitter port
+    with its own size and format and is published on its own topic. '''
+
+    def __init__(self, name, width, height, format, splitterPort):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.format = format
+        self.splitterPort = splitterPort
+
+        if (name == ''):
+            self.topic = videoTopic
+        else:
+            self.topic = videoTopic + '/' + name
+        self.statusTopic = self.topic + '/status'
+
+        # Latest wins suits MJPEG. Dropping an H.264 frame would corrupt the frames after
+        # it up to the next key frame so they are never replaced.
+        if (format == 'mjpeg'):
+            MQTTClient.setTopicLimit(self.topic, maxQueued)
+
+        # H.264 frames depend on the ones before so the frame rate can't be reduced by
+        # skipping frames. Only MJPEG streams adapt.
+        if (format == 'mjpeg'):
+            levels = SensorVideoControl.VIDEO_CONTROL_LEVELS
+        else:
+            levels = SensorVideoControl.VIDEO_CONTROL_RATE_LEVELS
+        self.control = SensorVideoControl.SensorVideoControl(MQTTClient, self.topic,
+                        self.statusTopic, deviceID, width, height, cameraRate, levels,
+                        adaptive and (format == 'mjpeg'))
+
+        # the circular buffer the encoder writes to and the camera it belongs to
+        self.stream = None
+        self.camera = None
+
+        # set when H.264 frames have been dropped. Nothing more is sent until a key frame.
+        self.waitForKeyFrame = False
+
+        # this is used to track when we have a new frame
+        self.lastFrameKey = (-1, 1)
+
+        # sequence number for published frames
+        self.sequence = 0
+
+        # frames copied out of the circular buffer that are waiting for the publish thread,
+        # as (timestamp, image, width, height, rate). deque append and popleft are atomic
+        # so no lock is required. If the publish thread falls behind, the oldest MJPEG
+        # frames are discarded.
+        self.frameQueue = collections.deque()
+        self.captureDroppedCount = 0
+
+        self.statsTime = time.time()
+        self.statsPublished = 0
+        self.statsDropped = 0
+
+    def startRecording(self, camera):
+        ''' starts the encoder at the current operating point '''
+        self.camera = camera
+        if (self.stream == None):
+            # need enough buffering to overcome any latency
+            self.stream = picamera.PiCameraCircularIO(camera, seconds = 1,
+                            splitter_port = self.splitterPort)
+
+        options = {}
+        if (self.control.getQuality() != None):
+            options['quality'] = self.control.getQuality()
+        size = (self.control.getWidth(), self.control.getHeight())
+        if (size != camera.resolution):
+            options['resize'] = size
+        if (self.format == 'h264'):
+            # a key frame every second so that a dropped frame is soon recovered from
+            options['intra_period'] = cameraRate
+
+        # frame indexes start again with the new recording
+        self.stream.clear()
+        self.lastFrameKey = (-1, 1)
+
+        camera.start_recording(self.stream, format = self.format,
+                        splitter_port = self.splitterPort, **options)
+
+    def stopRecording(self, camera):
+        camera.stop_recording(splitter_port = self.splitterPort)
+
+    def sendFrames(self):
+        ''' checks the circular buffer for new frames and hands copies of them to
+        the publish thread. Only the frames after the last one seen are visited
+        and the lock is only held while they are copied. Returns True if any
+        frames were queued. '''
+        now = time.time()
+        width = self.control.getWidth()
+        height = self.control.getHeight()
+        rate = self.control.getRate()
+        stream = self.stream
+
+        with stream.lock:
+            # walk back from the newest frame to the last one seen
+            newFrames = []
+            for frame in reversed(stream.frames):
+                if (frameKey(frame) <= self.lastFrameKey):
+                    break
+                newFrames.append(frame)
+                if (cameraRate <= 10) and (self.format == 'mjpeg'):
+                    # only the latest frame is needed at low rates
+                    break
+
+            if ((self.format == 'h264') and (len(newFrames) > 0) and (self.lastFrameKey != (-1, 1)) and
+                    (newFrames[-1].index > self.lastFrameKey[0] + 1)):
+                # the frames after the last one seen have been overwritten
+                self.waitForKeyFrame = True
+
+            if (len(newFrames) == 0):
+                return False
+            self.lastFrameKey = frameKey(newFrames[0])
+
+            # copy out the frames to be sent (oldest first), leaving the stream
+            # position where the encoder expects it
+            images = []
+            position = stream.tell()
+            for frame in reversed(newFrames):
+                # skip frames to get the current frame rate
+                if self.control.wantFrame(now):
+                    stream.seek(frame.position)
+                    images.append((stream.read(frame.frame_size), isKeyFrame(frame)))
+            stream.seek(position)
+
+        queued = False
+        for image, keyFrame in images:
+            if (self.format == 'h264'):
+                if (len(self.frameQueue) >= H264_FRAME_QUEUE_LENGTH):
+                    self.dropUntilKeyFrame()
+                if self.waitForKeyFrame:
+                    if not keyFrame:
+                        self.captureDroppedCount += 1
+                        continue
+                    self.waitForKeyFrame = False
+            elif (len(self.frameQueue) >= FRAME_QUEUE_LENGTH):
+                self.frameQueue.popleft()
+                self.captureDroppedCount += 1
+            self.frameQueue.append((now, image, width, height, rate))
+            queued = True
+        return queued
+
+    def dropUntilKeyFrame(self):
+        ''' discards the waiting H.264 frames and the ones after them up to the next
+        key frame, and asks the encoder for a key frame so that isn't long '''
+        while (len(self.frameQueue) > 0):
+            self.frameQueue.popleft()
+            self.captureDroppedCount += 1
+        self.waitForKeyFrame = True
+        if hasattr(self.camera, 'request_key_frame'):
+            # picamera 1.11 and later
+            self.camera.request_key_frame(splitter_port = self.splitterPort)
+
+    def publishFrames(self):
+        ''' called by the publish thread to encode and publish the queued frames '''
+        while (len(self.frameQueue) > 0):
+            self.publishFrame(*self.frameQueue.popleft())
+
+    def publishFrame(self, timestamp, image, width, height, rate):
+        ''' encode and publish a frame '''
+        self.sequence += 1
+
+        if not jsonMode:
+            MQTTClient.publish(self.topic, SensorBinary.packVideo(timestamp,
+                        width, height, rate, self.format, self.sequence, image))
+            return
+
+        binImage = base64.b64encode(image)
+
+        sensorDict = {}
+        sensorDict[SensorJSON.TIMESTAMP] = timestamp
+        sensorDict[SensorJSON.DEVICEID] = deviceID
+        sensorDict[SensorJSON.TOPIC] = self.topic
+        sensorDict[SensorJSON.VIDEO_DATA] = binImage
+        sensorDict[SensorJSON.VIDEO_WIDTH] = width
+        sensorDict[SensorJSON.VIDEO_HEIGHT] = height
+        sensorDict[SensorJSON.VIDEO_RATE] = rate
+        sensorDict[SensorJSON.VIDEO_FORMAT] = self.format
+        sensorDict[SensorJSON.VIDEO_SEQUENCE] = self.sequence
+
+        MQTTClient.publish(self.topic, json.dumps(sensorDict))
+
+    def reportStats(self):
+        ''' prints the frame rate actually delivered and the number of frames dropped
+        every STATS_INTERVAL seconds '''
+        now = time.time()
+        if ((now - self.statsTime) < STATS_INTERVAL):
+            return
+
+        published = MQTTClient.getTopicPublishedCount(self.topic)
+        dropped = MQTTClient.getTopicDroppedCount(self.topic) + self.captureDroppedCount
+        print('%s: sent %.1f fps, dropped %d frames (%d in total)' %
+                (self.topic, (published - self.statsPublished) / (now - self.statsTime),
+                dropped - self.statsDropped, dropped))
+        sys.stdout.flush()
+
+        self.statsTime = now
+        self.statsPublished = published
+        self.statsDropped = dropped
+
+
+def frameKey(frame):
+    ''' returns a key that orders frames. An H.264 SPS header has the same index
+    as the key frame that follows it. '''
+    if (frame.frame_type == picamera.PiVideoFrameType.sps_header):
+        return (frame.index, 0)
+    return (frame.index, 1)
+
+def isKeyFrame(frame):
+    ''' returns True if an H.264 stream can be decoded from this frame on. Key frames
+    follow an SPS header which the decoder needs first. '''
+    return frame.frame_type == picamera.PiVideoFrameType.sps_header
+
+def parseStreams(spec):
+    ''' parses a stream list of the form name:widthxheight[:format],... into a list of
+    (name, width, height, format). Raises ValueError if it is not valid. '''
+    streams = []
+    for item in spec.split(','):
+        fields = item.split(':')
+        if (len(fields) < 2) or (len(fields) > 3):
+            raise ValueError('invalid stream ' + item)
+        width, height = fields[1].split('x')
+        format = 'mjpeg'
+        if (len(fields) == 3):
+            format = fields[2]
+        if format not in ('mjpeg', 'h264'):
+            raise ValueError('unsupported format ' + format)
+        streams.append((fields[0], int(width), int(height), format))
+    if (len(streams) > len(CAMERA_SPLITTER_PORTS)):
+        raise ValueError('too many streams')
+    return streams
 
 '''
 ------------------------------------------------------------
     pi camera functions and main loop
 '''
 
-# this is used to track when we have a new frame
-piCameraLastFrameIndex = -1
+# signals the publish thread that there are frames to send
+frameEvent = threading.Event()
 
 mustExit = False;
 
-def piCameraSendFrameHelper(stream, frame):
-    ''' do the actual frame processing '''
-    global piCameraLastFrameIndex
-    
-    # record index of new frame
-    piCameraLastFrameIndex = frame.index
-
-    # get the frame data and display it
-    stream.seek(frame.position)
-    image = stream.read(frame.frame_size)
-    binImage = base64.b64encode(image)
-
-    sensorDict = {}
-    sensorDict[SensorJSON.TIMESTAMP] = time.time()
-    sensorDict[SensorJSON.DEVICEID] = deviceID
-    sensorDict[SensorJSON.TOPIC] = videoTopic
-    sensorDict[SensorJSON.VIDEO_DATA] = binImage
-    sensorDict[SensorJSON.VIDEO_WIDTH] = cameraWidth
-    sensorDict[SensorJSON.VIDEO_HEIGHT] = cameraHeight
-    sensorDict[SensorJSON.VIDEO_RATE] = cameraRate
-    sensorDict[SensorJSON.VIDEO_FORMAT] = 'mjpeg'
-
-    MQTTClient.publish(videoTopic, json.dumps(sensorDict))
-
-
-def piCameraSendFrame(stream):
-    ''' sendFrame checks the circular buffer to see if there is a new frame
-    and publish it '''
-
-    global piCameraLastFrameIndex
-
-    with stream.lock:
-        if (cameraRate > 10):
-            for frame in stream.frames:
-                if (frame.index > piCameraLastFrameIndex):
-                    piCameraSendFrameHelper(stream, frame)
-        else:
-            # skip to last frame in iteration
-            frame = None
-            for frame in stream.frames:
-                pass
- 
-            if (frame is None):
-                return
-         
-            # check to see if this is new
-            if (frame.index == piCameraLastFrameIndex):
-                return
-            piCameraSendFrameHelper(stream, frame)
-        
- 
+def piCameraPublishLoop():
+    ''' the publish thread. This does the encoding and publishing so that the
+    capture loop never waits for it. '''
+
+    while not mustExit:
+        frameEvent.wait(0.1)
+        frameEvent.clear()
+        for stream in piCameraStreams:
+            stream.publishFrames()
+
+
 def piCameraLoop():
     ''' This is the main loop. '''
 
     global mustExit
 
-    # Activate the video stream
+    # Activate the video streams
 
     with picamera.PiCamera(CAMERA_INDEX) as camera:
-        camera.resolution = (cameraWidth, cameraHeight)
+        # the camera runs at the largest size needed. The encoders resize for
+        # the smaller streams.
+        camera.resolution = (max([stream.width for stream in piCameraStreams]),
+                             max([stream.height for stream in piCameraStreams]))
         camera.framerate = (cameraRate, 1)
 
-        # need enough buffering to overcome any latency
-        stream = picamera.PiCameraCircularIO(camera, seconds = 1)
-
-        # start recoding in mjpeg mode
-        camera.start_recording(stream, format = 'mjpeg')
+        # start recording on every splitter port
+        for stream in piCameraStreams:
+            stream.startRecording(camera)
 
         try:
             while(True):
                 # process any new frames
                 camera.wait_recording(0)
-                piCameraSendFrame(stream)
+                for stream in piCameraStreams:
+                    if stream.sendFrames():
+                        frameEvent.set()
+                    stream.reportStats()
+
+                    # the quality and size can only be changed by restarting the encoder
+                    if stream.control.update():
+                        stream.stopRecording(camera)
+                        stream.startRecording(camera)
                 
                 #give other things a chance
                 time.sleep(0.01)
   
         finally:
-            camera.stop_recording()
+            for stream in piCameraStreams:
+                try:
+                    stream.stopRecording(camera)
+                except:
+                    pass
             mustExit = True
 
 '''
@@ -155,25 +395,43 @@ clientID = 'rtpicamclient'
 cameraWidth = 1280
 cameraHeight = 720
 cameraRate = 30
+jsonMode = True
+adaptive = True
+maxQueued = VIDEO_MAX_QUEUED
+streamSpec = None
 
 # process command line args
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "b:c:d:h:r:s:w:")
+    opts, args = getopt.getopt(sys.argv[1:], "ab:c:d:f:h:k:r:s:v:w:")
+    for opt, arg in opts:
+        if opt == '-v':
+            streamSpec = parseStreams(arg)
 except:
-    print ('RTPiCamMQTT.py -b <brokerAddr> -c <clientID> -d <deviceID> -h <frame_height>')
-    print ('      -r <frame_rate> -s <secret> -w <frame_width>')
+    print ('RTPiCamMQTT.py -a -b <brokerAddr> -c <clientID> -d <deviceID> -h <frame_height>')
+    print ('      -f <format> -k <maxQueued> -r <frame_rate> -s <secret> -v <streams> -w <frame_width>')
+    print ('\n  -a = fixed rate and quality (do not adapt to the link)')
+    print ('  -f = json (base64 JSON records) or binary (compact binary envelope, see README)')
+    print ('  -k = frames waiting to be sent before new frames replace them')
+    print ('  -v = streams to publish as name:widthxheight[:format],... where format is')
+    print ('       mjpeg (the default) or h264. Each is published on <deviceID>/video/<name>.')
+    print ('       For example: -v hd:1280x720,sd:640x360')
     print ('\nDefaults:')
     print ('  -b localhost (hostname or IP address)')
     print ('  -c rtsensorClient')
     print ('  -d rtsensor')
+    print ('  -f json')
     print ('  -h 720')
+    print ('  -k %d' % VIDEO_MAX_QUEUED)
     print ('  -r 30')
     print ('  -s rtsensor')
+    print ('  -v one mjpeg stream of -w x -h on <deviceID>/video')
     print ('  -w 1280')
     sys.exit(2)
 
 for opt, arg in opts:
+    if opt == '-a':
+        adaptive = False
     if opt == '-b':
         brokerAddress = arg
     if opt == '-c':
@@ -182,6 +440,10 @@ for opt, arg in opts:
         deviceID = arg
     if opt == '-h':
         cameraHeight = int(arg)
+    if opt == '-f':
+        jsonMode = (arg != 'binary')
+    if opt == '-k':
+        maxQueued = int(arg)
     if opt == '-r':
         cameraRate = int(arg)
     if opt == '-s':
@@ -189,27 +451,31 @@ for opt, arg in opts:
     if opt == '-w':
         cameraWidth = int(arg)
 
+if (streamSpec == None):
+    streamSpec = [('', cameraWidth, cameraHeight, 'mjpeg')]
+
 print("RTPiCamMQTT starting...")
 sys.stdout.flush()
 
 videoTopic = deviceID + '/video'
 
-MQTTClient = paho.Client(clientID, protocol=paho.MQTTv31)
-MQTTClient.on_connect = onConnect
+MQTTClient = SensorMQTTClient.SensorMQTTClient(clientID, deviceID, deviceSecret, brokerAddress,
+                        maxInflight=VIDEO_MAX_INFLIGHT * len(streamSpec))
+MQTTClient.onConnect = onConnect
 
-MQTTClient.username_pw_set(deviceID, deviceSecret)
+piCameraStreams = []
+for index in range(0, len(streamSpec)):
+    name, width, height, format = streamSpec[index]
+    piCameraStreams.append(PiCameraStream(name, width, height, format,
+                        CAMERA_SPLITTER_PORTS[index]))
 
-# try to connect
+# connect in the background. The client reconnects by itself if the connection is lost.
 
-while True:
-    try:
-        MQTTClient.connect(brokerAddress)
-        break
-    except:
-        print ("waiting to connect to broker",brokerAddress)
-        time.sleep(1)
+MQTTClient.start()
 
-MQTTClient.loop_start()
+publishThread = threading.Thread(target=piCameraPublishLoop)
+publishThread.daemon = True
+publishThread.start()
 
 try:
     piCameraLoop()
@@ -219,6 +485,8 @@ except:
 
 # Exiting so clean everything up.
 
-MQTTClient.loop_stop()
+mustExit = True
+publishThread.join()
+MQTTClient.stop()
 
 print("Exiting")
@@ -0,0 +1,336 @@
+#!/usr/bin/python
+"""
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015-2016, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import sys
+import time
+import json
+import getopt
+import heapq
+import threading
+import collections
+
+sys.path.append('../SensorDrivers')
+
+import SensorJSON
+import SensorMQTTClient
+import SensorBinary
+import SensorMediaStore
+
+# the number of records read ahead of publishing. The reader waits when this many
+# are waiting so memory use stays flat however fast the recording can be read.
+
+REPLAY_QUEUE_LENGTH = 100
+
+# the number of messages that can wait in the MQTT client. Publishing waits for
+# space rather than dropping messages.
+
+REPLAY_MQTT_QUEUE_LENGTH = 100
+
+# the delay (in seconds) before the first record is due, and between passes when looping
+
+REPLAY_START_DELAY = 1.0
+
+# how often (in seconds) the replay counters are reported
+
+STATS_INTERVAL = 10.0
+
+'''
+------------------------------------------------------------
+    MQTT callbacks
+'''
+
+def onConnect(client, userdata, code):
+    print('Connected: ' + str(code))
+    sys.stdout.flush()
+
+'''
+------------------------------------------------------------
+    Reader thread
+'''
+
+# The pipeline of (due time, topic, payload) from the reader to the publisher.
+# None marks the end of the replay.
+
+pipeline = collections.deque()
+pipelineLock = threading.Condition()
+mustExit = False
+
+def pipelinePut(item):
+    ''' waits for space in the pipeline and adds item '''
+    with pipelineLock:
+        while (len(pipeline) >= pipelineLength) and not mustExit:
+            pipelineLock.wait(0.1)
+        pipeline.append(item)
+        pipelineLock.notify_all()
+
+def pipelineGet():
+    ''' waits for the next item in the pipeline '''
+    with pipelineLock:
+        while (len(pipeline) == 0):
+            pipelineLock.wait(0.1)
+        item = pipeline.popleft()
+        pipelineLock.notify_all()
+        return item
+
+def readStream(streamIndex, topic, reader):
+    ''' generates the records of one topic, in the form merged by readerLoop '''
+    isVideo = reader.isVideo()
+    recordNumber = 0
+    for record in reader.frames(clipStart, clipEnd):
+        # the stream index and record number keep records with the same timestamp in order
+        yield (record[0], streamIndex, recordNumber, topic, isVideo, record)
+        recordNumber += 1
+
+def readerLoop():
+    ''' merges the recorded topics into one stream in time order and queues each
+    record with the time it is due to be published '''
+    try:
+        startTime = time.time() + REPLAY_START_DELAY
+        while not mustExit:
+            streams = [readStream(streamIndex, topic, SensorMediaStore.SensorMediaReader(directory))
+                        for streamIndex, (topic, directory) in enumerate(replayTopics)]
+            firstTimestamp = None
+            due = startTime
+            for timestamp, streamIndex, recordNumber, topic, isVideo, record in heapq.merge(*streams):
+                if mustExit:
+                    break
+                if (firstTimestamp == None):
+                    firstTimestamp = timestamp
+                if (speed > 0):
+                    due = startTime + (timestamp - firstTimestamp) / speed
+                else:
+                    due = time.time()
+                pipelinePut((due, topicPrefix + topic, makePayload(topic, isVideo, record, due)))
+            if (not loop) or (firstTimestamp == None):
+                break
+            startTime = due + REPLAY_START_DELAY
+    finally:
+        # the publisher stops when it gets here, whatever happened
+        pipelinePut(None)
+
+def makePayload(topic, isVideo, record, due):
+    ''' returns the message to publish for a record. Unless -k is used, timestamps
+    are moved to the time the record is published so that viewers see live data. '''
+    timestamp, width, height, rate, data = record
+    if isVideo:
+        if restamp:
+            timestamp = due
+        sequenceNumbers[topic] = sequenceNumbers.get(topic, 0) + 1
+        return SensorBinary.packVideo(timestamp, width, height, rate, 'mjpeg',
+                    sequenceNumbers[topic], data)
+
+    if not restamp:
+        return data
+
+    # the recorded timestamp is the arrival time so this keeps the sender's delay
+    offset = due - timestamp
+    if SensorBinary.isMediaEnvelope(data):
+        try:
+            return SensorBinary.shiftTimestamps(data, offset)
+        except ValueError:
+            return data
+    try:
+        jsonObj = json.loads(data)
+    except ValueError:
+        return data
+    if not isinstance(jsonObj, dict):
+        return data
+    if (SensorJSON.TIMESTAMP in jsonObj):
+        jsonObj[SensorJSON.TIMESTAMP] = float(jsonObj[SensorJSON.TIMESTAMP]) + offset
+    elif (SensorJSON.BATCH_TIMESTAMPS in jsonObj):
+        jsonObj[SensorJSON.BATCH_TIMESTAMPS] = [float(batchTimestamp) + offset
+                    for batchTimestamp in jsonObj[SensorJSON.BATCH_TIMESTAMPS]]
+    else:
+        return data
+    return json.dumps(jsonObj)
+
+'''
+------------------------------------------------------------
+    Publishing - runs on the main thread
+'''
+
+def reportStats():
+    ''' prints the replay counters every STATS_INTERVAL seconds '''
+    global statsTime, statsPublished, statsBytes, maxLateness
+
+    now = time.time()
+    if ((now - statsTime) < STATS_INTERVAL):
+        return
+
+    print('Published %.1f messages/s, %.1fKB/s, latest %.3fs late, %d read ahead, MQTT queue %d' %
+            ((publishedCount - statsPublished) / (now - statsTime),
+            (publishedBytes - statsBytes) / (1024.0 * (now - statsTime)), maxLateness,
+            len(pipeline), MQTTClient.getQueueDepth()))
+    sys.stdout.flush()
+
+    statsTime = now
+    statsPublished = publishedCount
+    statsBytes = publishedBytes
+    maxLateness = 0
+
+'''
+------------------------------------------------------------
+    Main code
+'''
+
+deviceID = 'rtreplay'
+brokerAddress = 'localhost'
+deviceSecret = 'rtreplay'
+clientID = 'rtreplayclient'
+recordDir = 'recordings'
+topicFilters = ['#']
+speed = 1.0
+loop = False
+restamp = True
+topicPrefix = ''
+pipelineLength = REPLAY_QUEUE_LENGTH
+clipStart = None
+clipEnd = None
+sequenceNumbers = {}
+publishedCount = 0
+publishedBytes = 0
+maxLateness = 0
+
+# process command line args
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], "b:c:d:i:kln:p:q:s:t:x:")
+except:
+    print ('RTReplayMQTT.py -b <brokerAddr> -c <clientID> -d <deviceID> -i <recordDir> -k -l')
+    print ('    -n <topicPrefix> -p <speed> -q <readAhead> -s <secret> -t <topics> -x <start>:<end>')
+    print ('\n  -i = directory written by RTMediaRecorder')
+    print ('  -k = keep the recorded timestamps')
+    print ('  -l = loop forever')
+    print ('  -n = added to the start of every topic (eg replay/)')
+    print ('  -p = speed. 1 keeps the recorded timing, 10 is ten times faster, 0 is as fast as possible')
+    print ('  -q = records read ahead of publishing')
+    print ('  -t = comma separated recorded topics to replay. Wildcards can be used')
+    print ('  -x = start and end times (Unix time) of the section to replay')
+    print ('\nDefaults:')
+    print ('  -b localhost (hostname or IP address)')
+    print ('  -c rtreplayclient')
+    print ('  -d rtreplay')
+    print ('  -i recordings')
+    print ('  -n none')
+    print ('  -p 1')
+    print ('  -q %d' % REPLAY_QUEUE_LENGTH)
+    print ('  -s rtreplay')
+    print ('  -t # (everything recorded)')
+    print ('  -x the whole recording')
+    sys.exit(2)
+
+for opt, arg in opts:
+    if opt == '-b':
+        brokerAddress = arg
+    if opt == '-c':
+        clientID = arg
+    if opt == '-d':
+        deviceID = arg
+    if opt == '-i':
+        recordDir = arg
+    if opt == '-k':
+        restamp = False
+    if opt == '-l':
+        loop = True
+    if opt == '-n':
+        topicPrefix = arg
+    if opt == '-p':
+        speed = float(arg)
+    if opt == '-q':
+        pipelineLength = max(1, int(arg))
+    if opt == '-s':
+        deviceSecret = arg
+    if opt == '-t':
+        topicFilters = arg.split(',')
+    if opt == '-x':
+        clipStart, clipEnd = [float(value) for value in arg.split(':')]
+
+replayTopics = []
+for topic, directory in SensorMediaStore.listTopics(recordDir):
+    for topicFilter in topicFilters:
+        if SensorMQTTClient.topicMatches(topicFilter, topic):
+            replayTopics.append((topic, directory))
+            break
+
+if (len(replayTopics) == 0):
+    print('Nothing to replay in ' + recordDir)
+    sys.exit(1)
+
+print("RTReplayMQTT starting...")
+for topic, directory in replayTopics:
+    print('Replaying ' + topic)
+sys.stdout.flush()
+
+MQTTClient = SensorMQTTClient.SensorMQTTClient(clientID, deviceID, deviceSecret, brokerAddress,
+                        maxQueueLength=REPLAY_MQTT_QUEUE_LENGTH,
+                        queuePolicy=SensorMQTTClient.QUEUE_BLOCK)
+MQTTClient.onConnect = onConnect
+
+# connect in the background. The client reconnects by itself if the connection is lost.
+
+MQTTClient.start()
+
+statsTime = time.time()
+statsPublished = 0
+statsBytes = 0
+
+try:
+    # the timing starts once connected so the first messages aren't all late
+    while not MQTTClient.isConnected():
+        time.sleep(0.1)
+
+    readerThread = threading.Thread(target=readerLoop)
+    readerThread.daemon = True
+    readerThread.start()
+
+    while True:
+        item = pipelineGet()
+        if (item == None):
+            break
+        due, topic, payload = item
+        delay = due - time.time()
+        if (delay > 0):
+            time.sleep(delay)
+        else:
+            maxLateness = max(maxLateness, -delay)
+        MQTTClient.publish(topic, payload)
+        publishedCount += 1
+        publishedBytes += len(payload)
+        reportStats()
+
+    # let the last messages go out
+    while (MQTTClient.getQueueDepth() > 0) or (MQTTClient.getInflightCount() > 0):
+        time.sleep(0.1)
+except:
+    pass
+
+# Exiting so clean everything up.
+
+mustExit = True
+MQTTClient.stop()
+print('Published %d messages' % publishedCount)
+print("Exiting")
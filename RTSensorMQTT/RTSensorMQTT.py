@@ -30,7 +30,6 @@ import sys
 import getopt
 import time
 import json
-import paho.mqtt.client as paho
 import binascii
 
 # import the sensor drivers
@@ -44,7 +43,11 @@ import RT_BMP180
 import RT_MCP9808
 import RT_HTU21D
 import RT_NullSensor
+import SensorBinary
 import SensorJSON
+import SensorMQTTClient
+import SensorScheduler
+import SensorSpool
 
 # The set of sensors. Uncomment one in each class or use NullSensor if no physical sensor
 # Multi sensor objects (such as BMP180 for temp and pressure) can be reused
@@ -76,6 +79,16 @@ pressure = RT_BMP180.RT_BMP180()
 #humidity = RT_NullSensor.RT_NullSensor()
 humidity = RT_HTU21D.RT_HTU21D()
 
+# Change-only publishing, enabled by the -m option. A reading is only sent if it has
+# moved by more than its deadband since it was last sent or if it hasn't been sent for
+# maxSilence seconds. A deadband of None sends every reading.
+
+sensorDeadbands = {SensorJSON.ACCEL_DATA : 0.02,           # g
+                   SensorJSON.LIGHT_DATA : 1.0,            # lux
+                   SensorJSON.TEMPERATURE_DATA : 0.1,      # degrees C
+                   SensorJSON.PRESSURE_DATA : 0.1,         # hPa
+                   SensorJSON.HUMIDITY_DATA : 0.5}         # %RH
+
 '''
 ------------------------------------------------------------
     MQTT callbacks
@@ -85,14 +98,88 @@ def onConnect(client, userdata, code):
     print('Connected: ' + str(code))
     sys.stdout.flush()
 
+def onDisconnect(client, userdata, code):
+    print('Disconnected: ' + str(code))
+    sys.stdout.flush()
+
+'''
+------------------------------------------------------------
+    Store and forward functions
+'''
+
+# how often the spool is drained while connected
+SPOOL_DRAIN_INTERVAL = 0.1
+
+# how often the spool is flushed to disk so that a power cut loses at most
+# this many seconds of spooled messages
+SPOOL_FLUSH_INTERVAL = 5.0
+
+def sendMessage(payload):
+    ''' publishes the payload or spools it if the broker can't be reached. Once
+    anything has been spooled, new messages also go to the spool until it has
+    been drained so that the order is preserved. '''
+    if (sensorSpool != None) and ((not MQTTClient.isConnected()) or (sensorSpool.getCount() > 0)):
+        sensorSpool.append(sensorTopic, payload)
+        return
+
+    MQTTClient.publish(sensorTopic, payload)
+
+def drainTask():
+    ''' sends a rate limited batch from the spool and flushes it to disk
+    every SPOOL_FLUSH_INTERVAL seconds '''
+    global lastDroppedCount, lastSpoolFlush
+
+    now = time.time()
+    if ((now - lastSpoolFlush) >= SPOOL_FLUSH_INTERVAL):
+        lastSpoolFlush = now
+        sensorSpool.flush()
+
+    if (sensorSpool.getDroppedCount() != lastDroppedCount):
+        lastDroppedCount = sensorSpool.getDroppedCount()
+        print ("Spool full, %d messages dropped" % lastDroppedCount)
+        sys.stdout.flush()
+
+    # wait for anything already queued by the client (which is older) to go first
+    if (not MQTTClient.isConnected()) or (sensorSpool.getCount() == 0) or \
+            (MQTTClient.getQueueDepth() > 0):
+        return SPOOL_DRAIN_INTERVAL
+
+    records = sensorSpool.peek(max(1, int(drainRate * SPOOL_DRAIN_INTERVAL)))
+    for topic, payload in records:
+        MQTTClient.publish(topic, payload)
+    sensorSpool.commit(len(records))
+    return SPOOL_DRAIN_INTERVAL
+
 '''
 ------------------------------------------------------------
     Sensor functions
 '''
 
-# global to maintain last sensor read time
-lastSensorReadTime = time.time() 
+# the readings as (sensor, read function, JSON name). Each reading is sampled
+# at the sensor's own rate and the mean of the samples since the last publish
+# is sent.
+
+sensorReadings = [(accel, accel.readAccel, SensorJSON.ACCEL_DATA),
+                  (light, light.readLight, SensorJSON.LIGHT_DATA),
+                  (temperature, temperature.readTemperature, SensorJSON.TEMPERATURE_DATA),
+                  (pressure, pressure.readPressure, SensorJSON.PRESSURE_DATA),
+                  (humidity, humidity.readHumidity, SensorJSON.HUMIDITY_DATA)]
+
+# the sums and counts of samples since the last publish indexed by JSON name
+sampleSums = {}
+sampleCounts = {}
 
+# the latest value of each reading, reused if there are no new samples
+latestData = {}
+
+# the value and time each reading was last sent, for change-only publishing
+publishedData = {}
+publishedTime = {}
+
+# the samples waiting to be sent in batch mode. batchData holds a list of values
+# (None if no data) per JSON name, in step with batchTimestamps.
+batchTimestamps = []
+batchData = {}
 
 def initSensors():
     accel.enable()
@@ -101,53 +188,126 @@ def initSensors():
     pressure.enable()
     humidity.enable()
 
-def readSensors():
-    global lastSensorReadTime
-
-    if ((time.time() - lastSensorReadTime) < sampleInterval):
-        return
-    # call background loops
-    if accel.sensorValid:
-        accel.background()
-    if light.sensorValid:
-        light.background()
-    if temperature.sensorValid:
-        temperature.background()
-    if pressure.sensorValid:
-        pressure.background()
-    if humidity.sensorValid:
-        humidity.background()
-
-    # time send send the sensor readings
-    lastSensorReadTime = time.time()
-    
-    sensorDict = {}
-    
-    sensorDict[SensorJSON.TIMESTAMP] = time.time()
+def makeBackgroundTask(sensor):
+    ''' returns a task that steps the sensor's background processing '''
+    def backgroundTask():
+        return sensor.background()
+    return backgroundTask
+
+def makeSampleTask(sensor, readFunction, name):
+    ''' returns a task that samples one reading at the sensor's rate '''
+    def sampleTask():
+        period = sensor.getSamplePeriod()
+        if (period == None):
+            period = sampleInterval
+        if not sensor.dataValid:
+            # may still be waiting for the first conversion
+            return period
+
+        data = readFunction()
+        if (sampleCounts.get(name, 0) == 0):
+            sampleSums[name] = data
+            sampleCounts[name] = 1
+        else:
+            if isinstance(data, list):
+                sampleSums[name] = [total + value for total, value in zip(sampleSums[name], data)]
+            else:
+                sampleSums[name] += data
+            sampleCounts[name] += 1
+        return period
+    return sampleTask
+
+def publishTask():
+    ''' sends the sensor readings or adds them to the batch '''
+    timestamp = time.time()
+    sampleData = {}
+
+    for sensor, readFunction, name in sensorReadings:
+        count = sampleCounts.get(name, 0)
+        if (count > 0):
+            if isinstance(sampleSums[name], list):
+                latestData[name] = [total / float(count) for total in sampleSums[name]]
+            else:
+                latestData[name] = sampleSums[name] / float(count)
+            sampleCounts[name] = 0
+        if (name in latestData) and mustSend(name, timestamp):
+            sampleData[name] = latestData[name]
+            publishedData[name] = latestData[name]
+            publishedTime[name] = timestamp
+
+    if (len(sampleData) == 0):
+        # nothing has changed but don't hold on to a batch that is due
+        if (batchTime > 0) and (len(batchTimestamps) > 0) and \
+                ((timestamp - batchTimestamps[0]) >= batchTime):
+            publishBatch()
+        return sampleInterval
+
+    if (batchCount > 0) or (batchTime > 0):
+        addToBatch(timestamp, sampleData)
+        return sampleInterval
+
+    sensorDict = sampleData
+    sensorDict[SensorJSON.TIMESTAMP] = timestamp
     sensorDict[SensorJSON.DEVICEID] = deviceID
     sensorDict[SensorJSON.TOPIC] = sensorTopic
 
-    if accel.dataValid:
-        accelData = accel.readAccel()
-        sensorDict[SensorJSON.ACCEL_DATA] = accelData
-        
-    if light.dataValid:
-        lightData = light.readLight()
-        sensorDict[SensorJSON.LIGHT_DATA] = lightData
-
-    if temperature.dataValid:
-        temperatureData = temperature.readTemperature()
-        sensorDict[SensorJSON.TEMPERATURE_DATA] = temperatureData
-
-    if pressure.dataValid:
-        pressureData = pressure.readPressure()
-        sensorDict[SensorJSON.PRESSURE_DATA] = pressureData
-        
-    if humidity.dataValid:
-        humidityData = humidity.readHumidity()
-        sensorDict[SensorJSON.HUMIDITY_DATA] = humidityData
-
-    MQTTClient.publish(sensorTopic, json.dumps(sensorDict))
+    sendMessage(json.dumps(sensorDict))
+    return sampleInterval
+
+def mustSend(name, timestamp):
+    ''' returns True if the latest value of the reading should be sent '''
+    if (maxSilence <= 0) or (name not in publishedData):
+        return True
+    if ((timestamp - publishedTime[name]) >= maxSilence):
+        return True
+    deadband = sensorDeadbands.get(name)
+    if (deadband == None):
+        return True
+    newData = latestData[name]
+    oldData = publishedData[name]
+    if isinstance(newData, list):
+        for newValue, oldValue in zip(newData, oldData):
+            if (abs(newValue - oldValue) > deadband):
+                return True
+        return False
+    return abs(newData - oldData) > deadband
+
+def addToBatch(timestamp, sampleData):
+    ''' adds a sample to the batch and sends the batch if it is complete '''
+    batchTimestamps.append(timestamp)
+    for sensor, readFunction, name in sensorReadings:
+        batchData.setdefault(name, []).append(sampleData.get(name))
+
+    if ((batchCount > 0) and (len(batchTimestamps) >= batchCount)) or \
+            ((batchTime > 0) and ((timestamp - batchTimestamps[0]) >= batchTime)):
+        publishBatch()
+
+def publishBatch():
+    ''' sends the batch as one message with a column per sensor value '''
+    columns = {}
+    for name, values in batchData.items():
+        present = [value for value in values if value != None]
+        if (len(present) == 0):
+            continue
+        if isinstance(present[0], list):
+            # multi-value readings (accel) become one column per value
+            columns[name] = [[None if value == None else value[i] for value in values]
+                                for i in range(0, len(present[0]))]
+        else:
+            columns[name] = values
+
+    if batchBinary:
+        payload = SensorBinary.packSensorBatch(batchTimestamps, columns)
+    else:
+        sensorDict = columns
+        sensorDict[SensorJSON.BATCH_TIMESTAMPS] = batchTimestamps
+        sensorDict[SensorJSON.DEVICEID] = deviceID
+        sensorDict[SensorJSON.TOPIC] = sensorTopic
+        payload = json.dumps(sensorDict)
+
+    sendMessage(payload)
+    del batchTimestamps[:]
+    batchData.clear()
 
 
 '''
@@ -157,14 +317,23 @@ def readSensors():
 
 
 def sensorLoop():
-    ''' This is the main sensor loop. '''
-
-    while True:
-        # see if anything from the sensors
-        readSensors()
-
-        # give other things a chance
-        time.sleep(0.01)
+    ''' This is the main sensor loop. Each sensor runs on its own schedule
+    and the process sleeps between deadlines. '''
+
+    backgroundSensors = []
+    for sensor, readFunction, name in sensorReadings:
+        if not sensor.sensorValid:
+            continue
+        # multi sensor objects only need one background task
+        if sensor not in backgroundSensors:
+            backgroundSensors.append(sensor)
+            sensorScheduler.add(makeBackgroundTask(sensor))
+        sensorScheduler.add(makeSampleTask(sensor, readFunction, name))
+
+    sensorScheduler.add(publishTask, sampleInterval)
+    if (sensorSpool != None):
+        sensorScheduler.add(drainTask, SPOOL_DRAIN_INTERVAL)
+    sensorScheduler.run()
 
 '''
 ------------------------------------------------------------
@@ -176,19 +345,40 @@ brokerAddress = 'localhost'
 deviceSecret = 'rtsensor'
 clientID = 'rtsensorclient'
 sampleInterval = 0.1
+batchCount = 0
+batchTime = 0
+batchBinary = False
+maxSilence = 0
+spoolDir = 'spool'
+spoolSize = 16
+drainRate = 50.0
+qos = 0
 
 # process command line args
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "b:c:d:i:s:")
+    opts, args = getopt.getopt(sys.argv[1:], "b:c:d:f:i:m:n:q:Q:r:s:t:z:")
 except:
-    print ('RTSensorMQTT.py -b <brokerAddr> -c <clientID> -d <deviceID> -i <interval> -s <secret>')
+    print ('RTSensorMQTT.py -b <brokerAddr> -c <clientID> -d <deviceID> -f <batchFormat> -i <interval>')
+    print ('          -m <maxSilence> -n <batchCount> -q <spoolDir> -Q <qos> -r <drainRate> -s <secret>')
+    print ('          -t <batchTime> -z <spoolSize>')
+    print ('\n  -m = only send readings that have changed, or every maxSilence seconds (0 = send all)')
+    print ('  -n and -t enable batch mode - samples are sent together once either limit is reached')
+    print ('  -q, -r and -z control the spool used while the broker is unreachable')
     print ('\nDefaults:')
     print ('  -b localhost (hostname or IP address)')
     print ('  -c rtsensorClient')
     print ('  -d rtsensor')
-    print ('  -i 0.1 (0.1 seconds between samples)')
+    print ('  -f json (json or binary)')
+    print ('  -i 0.1 (0.1 seconds between published samples)')
+    print ('  -m 0 (every reading is sent)')
+    print ('  -n 0 (no limit on samples per batch)')
+    print ('  -q spool')
+    print ('  -Q 0 (MQTT QoS for published messages)')
+    print ('  -r 50.0 (spooled messages sent per second once reconnected)')
     print ('  -s rtsensor')
+    print ('  -t 0 (no limit on seconds per batch)')
+    print ('  -z 16 (spool size in megabytes, 0 = no spool)')
     sys.exit(2)
 
 for opt, arg in opts:
@@ -198,42 +388,67 @@ for opt, arg in opts:
         clientID = arg
     if opt == '-d':
         deviceID = arg
+    if opt == '-f':
+        batchBinary = (arg == 'binary')
     if opt == '-i':
         sampleInterval = float(arg)
+    if opt == '-m':
+        maxSilence = float(arg)
+    if opt == '-n':
+        batchCount = int(arg)
+    if opt == '-q':
+        spoolDir = arg
+    if opt == '-Q':
+        qos = int(arg)
+    if opt == '-r':
+        drainRate = float(arg)
     if opt == '-s':
         deviceSecret = arg
+    if opt == '-t':
+        batchTime = float(arg)
+    if opt == '-z':
+        spoolSize = float(arg)
 
 print("RTSensorMQTT starting...")
 sys.stdout.flush()
 
 initSensors()
 
+sensorScheduler = SensorScheduler.SensorScheduler()
+
 sensorTopic = deviceID + '/sensors'
 
-MQTTClient = paho.Client(clientID, protocol=paho.MQTTv31)
-MQTTClient.on_connect = onConnect
+# start up the spool
 
-MQTTClient.username_pw_set(deviceID, deviceSecret)
+sensorSpool = None
+if (spoolSize > 0):
+    sensorSpool = SensorSpool.SensorSpool(spoolDir, int(spoolSize * 1024 * 1024))
+    if (sensorSpool.getCount() > 0):
+        print ("%d spooled messages to send" % sensorSpool.getCount())
+lastDroppedCount = 0
+lastSpoolFlush = time.time()
 
-# try to connect
+MQTTClient = SensorMQTTClient.SensorMQTTClient(clientID, deviceID, deviceSecret, brokerAddress, qos)
+MQTTClient.onConnect = onConnect
+MQTTClient.onDisconnect = onDisconnect
 
-while True:
-    try:
-        MQTTClient.connect(brokerAddress)
-        break
-    except:
-        print ("waiting to connect to broker",brokerAddress)
-        time.sleep(1)
+# connect in the background so that readings are spooled in the meantime
 
-MQTTClient.loop_start()
+MQTTClient.start()
 
 try:
     sensorLoop()
 except:
     pass
 
+# send anything left in the batch
+if (len(batchTimestamps) > 0):
+    publishBatch()
+
 # Exiting so clean everything up.
 
-MQTTClient.loop_stop()
+MQTTClient.stop()
+if (sensorSpool != None):
+    sensorSpool.close()
 
 print("Exiting")
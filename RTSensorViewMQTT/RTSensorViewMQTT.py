@@ -31,20 +31,16 @@ import sys
 # add the sensor driver directory
 sys.path.append('../SensorDrivers')
 
-import paho.mqtt.client as paho
 import binascii
 import getopt
 import time
 import json
 
+import SensorIngest
 import SensorJSON
-import SensorPlot
+import SensorMQTTClient
 import SensorRecords
-
-
-# The topic map contains the mapping between topic and sensor object
-
-topicMap = {}
+import SensorRender
 
 
 '''
@@ -62,12 +58,11 @@ def onSubscribe(client, data, mid, grantedQos):
     sys.stdout.flush()
 
 def onMessage(client, userdata, message):
-    global topicMap
-    try:
-        topicMap[sensorTopic].newJSONData(message.payload)
-
-    except:
-        print ("JSON error", sys.exc_info()[0],sys.exc_info()[1])
+    # ignore our own rendered images if the subscription includes them
+    if message.topic.endswith(SensorRender.SENSOR_RENDER_TOPIC_SUFFIX):
+        return
+    # just queue the message - decoding happens on the ingest thread
+    sensorIngest.enqueue(message.topic, message.payload)
 
 
 
@@ -80,23 +75,39 @@ deviceID = 'rtsensorview'
 deviceSecret = 'rtsensorview'
 brokerAddress = 'localhost'
 clientID = 'rtsensorviewclient'
-sensorTopic = "rtsensor/sensors"
+sensorTopic = "+/sensors"
 plotInterval = 1.0
+idleTimeout = 60.0
+maxQueueLength = 1000
+plotWindow = None
+outputDir = None
+imageFormat = 'png'
+publishImages = False
 
 # process command line args
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "b:c:d:p:s:t:")
+    opts, args = getopt.getopt(sys.argv[1:], "b:c:d:e:f:o:p:q:rs:t:w:")
 except:
-    print ('RTSensorViewMQTT.py -b <brokerAddr> -c <clientID> -d <deviceID> -p <plotInterval>')
-    print ('          -s <secret> -t <sensorTopic')
+    print ('RTSensorViewMQTT.py -b <brokerAddr> -c <clientID> -d <deviceID> -e <idleTimeout> -f <imageFormat>')
+    print ('          -o <outputDir> -p <plotInterval> -q <maxQueueLength> -r -s <secret> -t <sensorTopic>')
+    print ('          -w <plotWindow>')
+    print ('\n  -o = headless mode, write an image per topic to outputDir')
+    print ('  -r = headless mode, publish an image per topic as a retained message to <topic>/plot')
+    print ('  -w = plot min/max/mean rollups over the last plotWindow seconds')
     print ('\nDefaults:')
     print ('  -b localhost (hostname or IP address)')
     print ('  -c rtsensorviewclient')
     print ('  -d rtsensorview')
+    print ('  -e 60.0 (seconds before an idle topic is removed, 0 = never)')
+    print ('  -f png (png or svg)')
+    print ('  -o not set (plot to a window)')
     print ('  -p 1.0')
+    print ('  -q 1000 (messages waiting to be decoded before new ones are dropped)')
+    print ('  -r not set')
     print ('  -s rtsensorview')
-    print ('  -t rtsensor/sensors')
+    print ('  -t +/sensors (MQTT wildcards can be used)')
+    print ('  -w not set (plot averaged record)')
     sys.exit(2)
 
 for opt, arg in opts:
@@ -106,57 +117,84 @@ for opt, arg in opts:
         clientID = arg
     if opt == '-d':
         deviceID = arg
+    if opt == '-e':
+        idleTimeout = float(arg)
+    if opt == '-f':
+        imageFormat = arg
+    if opt == '-o':
+        outputDir = arg
     if opt == '-p':
         plotInterval = float(arg)
+    if opt == '-q':
+        maxQueueLength = int(arg)
+    if opt == '-r':
+        publishImages = True
     if opt == '-s':
         deviceSecret = arg
     if opt == '-t':
         sensorTopic = arg
+    if opt == '-w':
+        plotWindow = float(arg)
 
 print("RTSensorViewMQTT starting...")
 sys.stdout.flush()
 
-topicMap[sensorTopic] = SensorRecords.SensorRecords(sensorTopic, plotInterval)
+# start up the decoder
+
+sensorIngest = SensorIngest.SensorIngest(plotInterval, plotInterval, idleTimeout, plotWindow, maxQueueLength)
+sensorIngest.start()
 
 # start up the plotter
 
-sensorPlot = SensorPlot.SensorPlot()
+headless = (outputDir != None) or publishImages
+
+if headless:
+    sensorRender = SensorRender.SensorRender(outputDir, imageFormat, publishImages, plotWindow)
+    sensorRender.start()
+else:
+    # only import pyplot if there is going to be a window
+    import SensorPlot
+    sensorPlot = SensorPlot.SensorPlot(plotWindow)
 
 # lastPlotTime is used to control plot updates
 lastPlotTime = time.time() - plotInterval
 
+# lastDroppedCount is used to report dropped messages
+lastDroppedCount = 0
 
-MQTTClient = paho.Client(clientID, protocol=paho.MQTTv31)
-
-MQTTClient.on_subscribe = onSubscribe
-MQTTClient.on_connect = onConnect
-MQTTClient.on_message = onMessage
-
-MQTTClient.username_pw_set(deviceID, deviceSecret)
 
-# try to connect
+MQTTClient = SensorMQTTClient.SensorMQTTClient(clientID, deviceID, deviceSecret, brokerAddress)
+MQTTClient.onSubscribe = onSubscribe
+MQTTClient.onConnect = onConnect
+MQTTClient.onMessage = onMessage
 
-while True:
-    try:
-        MQTTClient.connect(brokerAddress)
-        break
-    except:
-        print ("waiting to connect to broker",brokerAddress)
-        time.sleep(1)
+# connect in the background. The client reconnects by itself if the connection is lost.
 
-MQTTClient.loop_start()
+MQTTClient.start()
 
 try:
     while True:
         if (time.time() - lastPlotTime) >= plotInterval:
             lastPlotTime = time.time()
-            sensorPlot.plot(topicMap.values())
+            if headless:
+                sensorRender.render(sensorIngest.getSnapshot())
+            else:
+                sensorPlot.plot(sensorIngest.getSnapshot())
+            if (sensorIngest.getDroppedCount() != lastDroppedCount):
+                lastDroppedCount = sensorIngest.getDroppedCount()
+                print ("Messages queued %d, dropped %d" % (sensorIngest.getQueuedCount(), lastDroppedCount))
+        if headless:
+            for topic, image in sensorRender.getImages():
+                MQTTClient.publish(topic + SensorRender.SENSOR_RENDER_TOPIC_SUFFIX, image, 0, True)
         time.sleep(0.05)
 except:
     pass
 
 # Exiting so clean everything up.
 
-MQTTClient.loop_stop()
+MQTTClient.stop()
+sensorIngest.stop()
+if headless:
+    sensorRender.stop()
 print("Exiting")
 
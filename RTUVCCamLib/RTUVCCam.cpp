@@ -173,6 +173,142 @@ static PyObject *vidCapGetFrame(PyObject *self, PyObject *args)
     return retData;
 }
 
+//  RTUVCCam.Frame is a read-only buffer object that owns a captured frame.
+//  It supports both the old and new buffer protocols so it can be passed
+//  to memoryview, file.write, displayJpegImage etc without copying.
+
+typedef struct
+{
+    PyObject_HEAD
+    void *handle;
+    const char *data;
+    Py_ssize_t length;
+} RTUVCCamFrameObject;
+
+static PyTypeObject RTUVCCamFrameType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "RTUVCCam.Frame",
+    sizeof(RTUVCCamFrameObject),
+};
+
+static void frameDealloc(PyObject *self)
+{
+    RTUVCCamFrameObject *frameObj = (RTUVCCamFrameObject *)self;
+
+    RTUVCCamGlue::vidCapReleaseFrame(frameObj->handle);
+    PyObject_Del(self);
+}
+
+static Py_ssize_t frameLength(PyObject *self)
+{
+    return ((RTUVCCamFrameObject *)self)->length;
+}
+
+static Py_ssize_t frameGetReadBuffer(PyObject *self, Py_ssize_t segment, void **ptr)
+{
+    RTUVCCamFrameObject *frameObj = (RTUVCCamFrameObject *)self;
+
+    if (segment != 0) {
+        PyErr_SetString(PyExc_SystemError, "accessing non-existent frame segment");
+        return -1;
+    }
+    *ptr = (void *)frameObj->data;
+    return frameObj->length;
+}
+
+static Py_ssize_t frameGetSegCount(PyObject *self, Py_ssize_t *lenp)
+{
+    if (lenp != NULL)
+        *lenp = ((RTUVCCamFrameObject *)self)->length;
+    return 1;
+}
+
+static Py_ssize_t frameGetCharBuffer(PyObject *self, Py_ssize_t segment, char **ptr)
+{
+    return frameGetReadBuffer(self, segment, (void **)ptr);
+}
+
+static int frameGetBuffer(PyObject *self, Py_buffer *view, int flags)
+{
+    RTUVCCamFrameObject *frameObj = (RTUVCCamFrameObject *)self;
+
+    return PyBuffer_FillInfo(view, self, (void *)frameObj->data, frameObj->length, 1, flags);
+}
+
+static PySequenceMethods frameAsSequence;
+static PyBufferProcs frameAsBuffer;
+
+static PyObject *buildFrameBufferResult(void *handle, const char *frame, int length,
+                                        bool jpeg, int width, int height, int rate)
+{
+    if (handle == NULL)
+        return Py_BuildValue("iOiiii", false, Py_None, jpeg, width, height, rate);
+
+    RTUVCCamFrameObject *frameObj = PyObject_New(RTUVCCamFrameObject, &RTUVCCamFrameType);
+
+    if (frameObj == NULL) {
+        RTUVCCamGlue::vidCapReleaseFrame(handle);
+        return NULL;
+    }
+
+    frameObj->handle = handle;
+    frameObj->data = frame;
+    frameObj->length = length;
+
+    //  "N" hands the reference to frameObj over to the tuple
+    return Py_BuildValue("iNiiii", true, (PyObject *)frameObj, jpeg, width, height, rate);
+}
+
+static PyObject *vidCapGetFrameBuffer(PyObject *self, PyObject *args)
+{
+    int cameraNum;
+    int width = 0;
+    int height = 0;
+    int rate = 0;
+    bool jpeg = false;
+    const char *frame = NULL;
+    int length = 0;
+
+    if (!PyArg_ParseTuple(args, "i", &cameraNum)) {
+        printf("Bad argument to vidCapGetFrameBuffer\n");
+        return Py_BuildValue("iOiiii", false, Py_None, jpeg, width, height, rate);
+    }
+
+    void *handle = rtPyGlue.vidCapGetFrameHandle(cameraNum, &frame, length, jpeg, width, height, rate);
+
+    return buildFrameBufferResult(handle, frame, length, jpeg, width, height, rate);
+}
+
+static PyObject *vidCapWaitFrame(PyObject *self, PyObject *args)
+{
+    int cameraNum;
+    double timeout;
+    int width = 0;
+    int height = 0;
+    int rate = 0;
+    bool jpeg = false;
+    const char *frame = NULL;
+    int length = 0;
+    void *handle;
+
+    if (!PyArg_ParseTuple(args, "id", &cameraNum, &timeout)) {
+        printf("Bad argument to vidCapWaitFrame\n");
+        return Py_BuildValue("iOiiii", false, Py_None, jpeg, width, height, rate);
+    }
+
+    if (timeout < 0)
+        timeout = 0;
+
+    //  other Python threads can run while waiting for the camera
+
+    Py_BEGIN_ALLOW_THREADS
+    handle = rtPyGlue.vidCapWaitFrameHandle(cameraNum, (unsigned long)(timeout * 1000.0),
+                                            &frame, length, jpeg, width, height, rate);
+    Py_END_ALLOW_THREADS
+
+    return buildFrameBufferResult(handle, frame, length, jpeg, width, height, rate);
+}
+
 static PyMethodDef RTUVCCamMethods[] = {
     {"start", (PyCFunction)start, METH_VARARGS,
     "Starts the RTUVCCam library.\n"
@@ -215,6 +351,23 @@ static PyMethodDef RTUVCCamMethods[] = {
     "  height - height of frame\n"
     "  rate - frame rate\n"},
 
+    {"vidCapGetFrameBuffer", (PyCFunction)vidCapGetFrameBuffer, METH_VARARGS,
+    "Same as vidCapGetFrame except that the frame is returned as a\n"
+    "read-only buffer object that owns the captured data.\n"
+    "No copy of the frame is made. The object can be passed to\n"
+    "memoryview, file.write, displayJpegImage etc and the frame\n"
+    "is freed when the object is released.\n"
+    "If valid is False, frame is None.\n"},
+
+    {"vidCapWaitFrame", (PyCFunction)vidCapWaitFrame, METH_VARARGS,
+    "Waits for a captured frame from a camera.\n"
+    "There are two parameters:\n"
+    "  cameraNum - the camera number\n"
+    "  timeout - the maximum time to wait in seconds\n"
+    "The GIL is released while waiting and the call returns as soon\n"
+    "as a frame is available. The return values are the same as\n"
+    "vidCapGetFrameBuffer. valid is False if the timeout expired.\n"},
+
     {"setWindowTitle", (PyCFunction)setWindowTitle, METH_VARARGS,
     "Sets the window title in GUI mode.\n"
     "The parameter is a string containing the new window title.\n"
@@ -241,5 +394,28 @@ static PyMethodDef RTUVCCamMethods[] = {
 
 PyMODINIT_FUNC initRTUVCCam()
 {
-    Py_InitModule3("RTUVCCam", RTUVCCamMethods, "RTUVCCam library");
+    PyObject *module;
+
+    frameAsSequence.sq_length = frameLength;
+
+    frameAsBuffer.bf_getreadbuffer = frameGetReadBuffer;
+    frameAsBuffer.bf_getsegcount = frameGetSegCount;
+    frameAsBuffer.bf_getcharbuffer = frameGetCharBuffer;
+    frameAsBuffer.bf_getbuffer = frameGetBuffer;
+
+    RTUVCCamFrameType.tp_dealloc = frameDealloc;
+    RTUVCCamFrameType.tp_as_sequence = &frameAsSequence;
+    RTUVCCamFrameType.tp_as_buffer = &frameAsBuffer;
+    RTUVCCamFrameType.tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_NEWBUFFER;
+    RTUVCCamFrameType.tp_doc = "Captured frame buffer";
+
+    if (PyType_Ready(&RTUVCCamFrameType) < 0)
+        return;
+
+    module = Py_InitModule3("RTUVCCam", RTUVCCamMethods, "RTUVCCam library");
+    if (module == NULL)
+        return;
+
+    Py_INCREF(&RTUVCCamFrameType);
+    PyModule_AddObject(module, "Frame", (PyObject *)&RTUVCCamFrameType);
 }
@@ -110,3 +110,47 @@ bool RTUVCCamGlue::vidCapGetFrame(int cameraNum, unsigned char** frame, int& len
     return true;
 }
 
+void *RTUVCCamGlue::vidCapGetFrameHandle(int cameraNum, const char **frame, int& length, bool& jpeg,
+                                         int& width, int& height, int& rate)
+{
+    QByteArray *qframe = new QByteArray();
+
+    *frame = NULL;
+    length = 0;
+
+    if (!m_main->vidCapGetFrame(cameraNum, *qframe, jpeg, width, height, rate)) {
+        delete qframe;
+        return NULL;
+    }
+
+    //  the QByteArray is implicitly shared so this hands over the captured
+    //  data without copying it
+
+    *frame = qframe->constData();
+    length = qframe->length();
+    return qframe;
+}
+
+void *RTUVCCamGlue::vidCapWaitFrameHandle(int cameraNum, unsigned long timeoutMs, const char **frame, int& length,
+                                         bool& jpeg, int& width, int& height, int& rate)
+{
+    QByteArray *qframe = new QByteArray();
+
+    *frame = NULL;
+    length = 0;
+
+    if (!m_main->vidCapWaitFrame(cameraNum, timeoutMs, *qframe, jpeg, width, height, rate)) {
+        delete qframe;
+        return NULL;
+    }
+
+    *frame = qframe->constData();
+    length = qframe->length();
+    return qframe;
+}
+
+void RTUVCCamGlue::vidCapReleaseFrame(void *handle)
+{
+    delete (QByteArray *)handle;
+}
+
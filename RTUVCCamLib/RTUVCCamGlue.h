@@ -39,6 +39,19 @@ public:
     bool vidCapGetFrame(int cameraNum, unsigned char** frame, int& length, bool& jpeg,
                                              int& width, int& height, int& rate);
 
+    //  vidCapGetFrameHandle returns an opaque handle that owns the captured frame.
+    //  frame points into the handle's storage and remains valid until
+    //  vidCapReleaseFrame is called. Returns NULL if no frame available.
+
+    void *vidCapGetFrameHandle(int cameraNum, const char **frame, int& length, bool& jpeg,
+                                             int& width, int& height, int& rate);
+    static void vidCapReleaseFrame(void *handle);
+
+    //  vidCapWaitFrameHandle is the same but blocks for up to timeoutMs waiting for a frame
+
+    void *vidCapWaitFrameHandle(int cameraNum, unsigned long timeoutMs, const char **frame, int& length,
+                                             bool& jpeg, int& width, int& height, int& rate);
+
     void startLib(int& argc, char **argv, bool showWindow);
     void stopLib();
     bool checkDaemonMode() { return m_daemonMode;}          // checks if in daemon mode
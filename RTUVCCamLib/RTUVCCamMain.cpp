@@ -25,6 +25,8 @@
 #include "RTUVCCamGlue.h"
 #include "RTUVCCamVidCap.h"
 
+#include <qelapsedtimer.h>
+
 //----------------------------------------------------------
 //
 //  RTUVCCamMain
@@ -82,6 +84,9 @@ bool RTUVCCamMain::vidCapClose(int cameraNum)
         return false;
 
     removeVidCap(cameraNum);
+
+    // release anyone waiting on this camera
+    m_frameAvailable.wakeAll();
     return true;
 }
 
@@ -106,6 +111,8 @@ void RTUVCCamMain::addFrameToQueue(int cameraNum, const QByteArray& frame, bool
     cap->height = height;
     cap->rate = rate;
     cap->jpeg = jpeg;
+
+    m_frameAvailable.wakeAll();
 }
 
 bool RTUVCCamMain::vidCapGetFrame(int cameraNum, QByteArray& frame, bool& jpeg,
@@ -113,10 +120,7 @@ bool RTUVCCamMain::vidCapGetFrame(int cameraNum, QByteArray& frame, bool& jpeg,
 {
     QMutexLocker lock(&m_vidCapLock);
 
-    if (cameraNum >= m_vidCaps.count())
-        return false;
-
-    RTUVCCAM_CAPTURE *cap = m_vidCaps[cameraNum];
+    RTUVCCAM_CAPTURE *cap = getVidCap(cameraNum);
 
     if (cap == NULL)
         return false;
@@ -124,13 +128,57 @@ bool RTUVCCamMain::vidCapGetFrame(int cameraNum, QByteArray& frame, bool& jpeg,
     if (cap->frameQueue.empty())
         return false;
 
+    dequeueFrame(cap, frame, jpeg, width, height, rate);
+    return true;
+}
+
+bool RTUVCCamMain::vidCapWaitFrame(int cameraNum, unsigned long timeoutMs, QByteArray& frame, bool& jpeg,
+                                         int& width, int& height, int& rate)
+{
+    QMutexLocker lock(&m_vidCapLock);
+    QElapsedTimer timer;
+    RTUVCCAM_CAPTURE *cap;
+
+    timer.start();
+
+    while (true) {
+        // the camera could be closed while waiting so look it up each time
+        cap = getVidCap(cameraNum);
+
+        if (cap == NULL)
+            return false;
+
+        if (!cap->frameQueue.empty())
+            break;
+
+        qint64 elapsed = timer.elapsed();
+
+        if (elapsed >= (qint64)timeoutMs)
+            return false;
+
+        m_frameAvailable.wait(&m_vidCapLock, timeoutMs - elapsed);
+    }
+
+    dequeueFrame(cap, frame, jpeg, width, height, rate);
+    return true;
+}
+
+RTUVCCAM_CAPTURE *RTUVCCamMain::getVidCap(int cameraNum)
+{
+    if ((cameraNum < 0) || (cameraNum >= m_vidCaps.count()))
+        return NULL;
+
+    return m_vidCaps[cameraNum];
+}
+
+void RTUVCCamMain::dequeueFrame(RTUVCCAM_CAPTURE *cap, QByteArray& frame, bool& jpeg,
+                                         int& width, int& height, int& rate)
+{
     frame = cap->frameQueue.dequeue();
     jpeg = cap->jpeg;
     width = cap->width;
     height = cap->height;
     rate = cap->rate;
-    jpeg = cap->jpeg;
-    return true;
 }
 
 void RTUVCCamMain::removeVidCap(int cameraNum)
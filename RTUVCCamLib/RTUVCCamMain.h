@@ -28,6 +28,7 @@
 #include <QThread>
 #include <qdialog.h>
 #include <qmutex.h>
+#include <qwaitcondition.h>
 #include <qbytearray.h>
 #include <qqueue.h>
 
@@ -63,6 +64,8 @@ public:
     bool vidCapClose(int cameraNum);
     bool vidCapGetFrame(int cameraNum, QByteArray& frame, bool& jpeg,
                                              int& width, int& height, int& rate);
+    bool vidCapWaitFrame(int cameraNum, unsigned long timeoutMs, QByteArray& frame, bool& jpeg,
+                                             int& width, int& height, int& rate);
     virtual void addVidCapSignal(RTUVCCamVidCap *vidCap) = 0;   // adds signal for captured frames
 
 
@@ -74,7 +77,11 @@ protected:
 
 private:
     void removeVidCap(int cameraNum);
+    RTUVCCAM_CAPTURE *getVidCap(int cameraNum);
+    void dequeueFrame(RTUVCCAM_CAPTURE *cap, QByteArray& frame, bool& jpeg,
+                                             int& width, int& height, int& rate);
     QMutex m_vidCapLock;
+    QWaitCondition m_frameAvailable;                        // signalled when a frame is queued
     QList<RTUVCCAM_CAPTURE *> m_vidCaps;
 };
 #endif // RTUVCCAMMAIN_H
@@ -34,6 +34,7 @@
 #include <qfileinfo.h>
 #include <qdebug.h>
 #include <qbuffer.h>
+#include <qsocketnotifier.h>
 
 #include "RTUVCCamVidCap.h"
 #include <RTUVCCamThread.h>
@@ -49,6 +50,10 @@
 #define DETECT_MIN_TICKS                10
 #define CONNECT_MIN_TICKS               6
 
+#define STATE_POLL_MS                   25          // timer period when not capturing
+#define CAPTURE_WATCHDOG_MS             1000        // timer period when capturing
+#define CAPTURE_TIMEOUT_MS              5000        // no frames for this long means camera has gone
+
 #define appLogError(x) qDebug() << x
 #define appLogWarn(x) qDebug() << x
 #define appLogInfo(x) qDebug() << x
@@ -62,6 +67,8 @@ RTUVCCamVidCap::RTUVCCamVidCap(int cameraNum, int width, int height, int rate)
     m_frameCount = 0;
     m_mmBuffLen = 0;
     m_rgbBuff = NULL;
+    m_timer = -1;
+    m_frameNotifier = NULL;
     m_cameraNum = cameraNum;
     m_preferredWidth = width;
     m_preferredHeight = height;
@@ -102,7 +109,7 @@ void RTUVCCamVidCap::newCamera()
         emit cameraState(m_cameraNum, "Disconnected");
     }
 
-    m_timer = startTimer(25);
+    m_timer = startTimer(STATE_POLL_MS);
 }
 
 void RTUVCCamVidCap::timerEvent(QTimerEvent *)
@@ -141,6 +148,7 @@ void RTUVCCamVidCap::timerEvent(QTimerEvent *)
         if (streamOn()) {
             m_state = STATE_CAPTURING;
             emit cameraState(m_cameraNum, "Running");
+            startCapture();
         }
         else {
             emit cameraState(m_cameraNum, "Disconnected");
@@ -150,7 +158,9 @@ void RTUVCCamVidCap::timerEvent(QTimerEvent *)
         break;
 
     case STATE_CAPTURING:
-        if (!readFrame()) {
+        // frames are processed by frameReady() so this is just a watchdog
+        if (m_lastFrameTime.elapsed() > CAPTURE_TIMEOUT_MS) {
+            appLogError("RTUVCCamVidCap: capture timeout");
             emit cameraState(m_cameraNum, "Disconnected");
             newCamera();
         }
@@ -159,6 +169,42 @@ void RTUVCCamVidCap::timerEvent(QTimerEvent *)
     }
 }
 
+void RTUVCCamVidCap::startCapture()
+{
+    // switch from the polling timer to waiting on the device fd so that
+    // each frame is handled as soon as V4L2 delivers it
+
+    if (m_timer != -1)
+        killTimer(m_timer);
+    m_timer = startTimer(CAPTURE_WATCHDOG_MS);
+
+    m_frameNotifier = new QSocketNotifier(m_fd, QSocketNotifier::Read, this);
+    connect(m_frameNotifier, SIGNAL(activated(int)), this, SLOT(frameReady(int)));
+    m_lastFrameTime.start();
+}
+
+void RTUVCCamVidCap::stopCapture()
+{
+    if (m_frameNotifier == NULL)
+        return;
+
+    // this may be called from within frameReady() so can't delete directly
+    m_frameNotifier->setEnabled(false);
+    m_frameNotifier->deleteLater();
+    m_frameNotifier = NULL;
+}
+
+void RTUVCCamVidCap::frameReady(int)
+{
+    if (!handleFrame()) {
+        emit cameraState(m_cameraNum, "Disconnected");
+        newCamera();
+        return;
+    }
+
+    m_lastFrameTime.restart();
+}
+
 
 bool RTUVCCamVidCap::handleFrame()
 {
@@ -308,36 +354,6 @@ QByteArray RTUVCCamVidCap::YUYV2RGB(quint32 index)
     return QByteArray((const char *)m_rgbBuff, m_width * m_height * 3);
 }
 
-bool RTUVCCamVidCap::readFrame()
-{
-    fd_set fds;
-    struct timeval tv;
-
-    FD_ZERO(&fds);
-    FD_SET(m_fd, &fds);
-    tv.tv_sec = 5;
-    tv.tv_usec = 0;
-
-    int result = select(m_fd + 1, &fds, NULL, NULL, &tv);
-
-    if (result == -1) {
-        if (errno == EINTR) {
-            return true;
-            }
-        else {
-            appLogError(QString("select - %1").arg(strerror(errno)));
-            return false;
-        }
-    }
-
-    if (result == 0) {
-        appLogError("RTUVCCamVidCap: select timeout");
-        return false;
-    }
-
-    return handleFrame();
-}
-
 bool RTUVCCamVidCap::deviceExists()
 {
     QFileInfo info(QString("/dev/video%1").arg(m_cameraNum));
@@ -883,6 +899,8 @@ int RTUVCCamVidCap::xioctl(int request, void *arg)
 
 void RTUVCCamVidCap::closeDevice()
 {
+    stopCapture();
+
     if (m_timer != -1)
         killTimer(m_timer);
     m_timer = -1;
@@ -26,6 +26,7 @@
 
 #include <QSize>
 #include <qimage.h>
+#include <qelapsedtimer.h>
 
 #include <linux/videodev2.h>
 
@@ -34,6 +35,8 @@
 #define HUFFMAN_TABLE_SIZE 420
 #define AVI_HEADER_SIZE 37
 
+class QSocketNotifier;
+
 class RTUVCCamVidCap : public RTUVCCamThread
 {
     Q_OBJECT
@@ -51,6 +54,9 @@ signals:
     void newFrame(int cameraNum, QByteArray frame, bool jpeg, int width, int height, int rate);
     void cameraState(int cameraNum, QString state);
 
+protected slots:
+    void frameReady(int fd);
+
 protected:
     void initModule();
     void stopModule();
@@ -60,7 +66,8 @@ private:
     void newCamera();
     bool openDevice();
     void closeDevice();
-    bool readFrame();
+    void startCapture();
+    void stopCapture();
 
     void queryAvailableFormats();
     void queryAvailableSizes();
@@ -114,6 +121,8 @@ private:
     QList<QSize> m_rateList;
 
     int m_timer;
+    QSocketNotifier *m_frameNotifier;                       // fires when the device has a buffer ready
+    QElapsedTimer m_lastFrameTime;                          // used to detect a stalled camera
     int m_state;
     int m_ticks;
 };
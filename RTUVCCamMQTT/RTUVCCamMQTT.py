@@ -32,13 +32,28 @@ import RTUVCCam
 import sys
 import time
 import json
-import paho.mqtt.client as paho
 import getopt
 import base64
 
 sys.path.append('../SensorDrivers')
 
 import SensorJSON
+import SensorMQTTClient
+import SensorBinary
+import SensorVideoControl
+
+# the default number of frames that can wait to be sent. Once this many are waiting,
+# each new frame replaces the oldest so that the newest frames are always sent.
+
+VIDEO_MAX_QUEUED = 2
+
+# the number of frames that can be with the MQTT client's network code at once
+
+VIDEO_MAX_INFLIGHT = 2
+
+# how often (in seconds) the delivered frame rate is reported
+
+STATS_INTERVAL = 10.0
 
 '''
 ------------------------------------------------------------
@@ -49,6 +64,30 @@ def onConnect(client, userdata, code):
     print('Connected: ' + str(code))
     sys.stdout.flush()
 
+'''
+------------------------------------------------------------
+    Frame rate reporting
+'''
+
+def reportStats():
+    ''' prints the frame rate actually delivered and the number of frames dropped
+    every STATS_INTERVAL seconds '''
+    global statsTime, statsPublished, statsDropped
+
+    now = time.time()
+    if ((now - statsTime) < STATS_INTERVAL):
+        return
+
+    published = MQTTClient.getTopicPublishedCount(videoTopic)
+    dropped = MQTTClient.getTopicDroppedCount(videoTopic)
+    print('Sent %.1f fps, dropped %d frames (%d in total)' %
+            ((published - statsPublished) / (now - statsTime), dropped - statsDropped, dropped))
+    sys.stdout.flush()
+
+    statsTime = now
+    statsPublished = published
+    statsDropped = dropped
+
 '''
 ------------------------------------------------------------
     Main code
@@ -62,28 +101,43 @@ cameraIndex = 0
 cameraWidth = 1280
 cameraHeight = 720
 cameraRate = 30
+jsonMode = True
+adaptive = True
+videoControl = None
+frameSequence = 0
+maxQueued = VIDEO_MAX_QUEUED
+statsTime = time.time()
+statsPublished = 0
+statsDropped = 0
 
 # process command line args
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "b:c:d:h:i:r:s:w:xy")
+    opts, args = getopt.getopt(sys.argv[1:], "ab:c:d:f:h:i:k:r:s:w:xy")
 except:
-    print ('RTUVCCamMQTT.py -b <brokerAddr> -c <clientID> -d <deviceID> -h <height>')
-    print ('   -i <cameraIndex> -r <rate> -s <secret> -w <width> -x -y')
-    print ('\n  -x = console mode')
+    print ('RTUVCCamMQTT.py -a -b <brokerAddr> -c <clientID> -d <deviceID> -h <height>')
+    print ('   -f <format> -i <cameraIndex> -k <maxQueued> -r <rate> -s <secret> -w <width> -x -y')
+    print ('\n  -a = fixed rate and quality (do not adapt to the link)')
+    print ('  -f = json (base64 JSON records) or binary (compact binary envelope, see README)')
+    print ('  -k = frames waiting to be sent before new frames replace them')
+    print ('  -x = console mode')
     print ('  -y = daemon mode')
     print ('\nDefaults:')
     print ('  -b localhost (hostname or IP address)')
     print ('  -c pisensorClient')
     print ('  -d pisensor')
+    print ('  -f json')
     print ('  -h 720')
     print ('  -i 0')
+    print ('  -k %d' % VIDEO_MAX_QUEUED)
     print ('  -r 30')
     print ('  -s pisensor')
     print ('  -w 1280')
     sys.exit(2)
 
 for opt, arg in opts:
+    if opt == '-a':
+        adaptive = False
     if opt == '-b':
         brokerAddress = arg
     if opt == '-c':
@@ -94,6 +148,10 @@ for opt, arg in opts:
         cameraHeight = int(arg)
     if opt == '-i':
         cameraIndex = int(arg)
+    if opt == '-f':
+        jsonMode = (arg != 'binary')
+    if opt == '-k':
+        maxQueued = int(arg)
     if opt == '-r':
         cameraRate = int(arg)
     if opt == '-s':
@@ -102,23 +160,16 @@ for opt, arg in opts:
         cameraWidth = int(arg)
 
 videoTopic = deviceID + '/video'
+statusTopic = videoTopic + '/status'
 
-MQTTClient = paho.Client(clientID, protocol=paho.MQTTv31)
-MQTTClient.on_connect = onConnect
+MQTTClient = SensorMQTTClient.SensorMQTTClient(clientID, deviceID, deviceSecret, brokerAddress,
+                        maxInflight=VIDEO_MAX_INFLIGHT)
+MQTTClient.onConnect = onConnect
+MQTTClient.setTopicLimit(videoTopic, maxQueued)
 
-MQTTClient.username_pw_set(deviceID, deviceSecret)
+# connect in the background. The client reconnects by itself if the connection is lost.
 
-# try to connect
-
-while True:
-    try:
-        MQTTClient.connect(brokerAddress)
-        break
-    except:
-        print ("waiting to connect to broker",brokerAddress)
-        time.sleep(1)
-
-MQTTClient.loop_start()
+MQTTClient.start()
 
 # start RTUVCCamLib running
 RTUVCCam.start(sys.argv, True)
@@ -141,10 +192,10 @@ sys.stdout.flush()
 
 while(True):
     try:
-        # give other things a chance
-        time.sleep(0.02)
-        # get a frame from the camera
-        ret, frame, jpeg, width, height, rate = RTUVCCam.vidCapGetFrame(cameraIndex)
+        # wait for a frame from the camera. This releases the GIL and returns as soon
+        # as a frame arrives. The frame is a buffer object that references the
+        # captured data directly rather than a copy.
+        ret, frame, jpeg, width, height, rate = RTUVCCam.vidCapWaitFrame(cameraIndex, 0.5)
         if (ret):            
             # and display it
             if (jpeg):
@@ -152,22 +203,55 @@ while(True):
             else:
                 RTUVCCam.displayImage(frame, width, height, "")
             
-            binImage = base64.b64encode(frame)
-
-            sensorDict = {}
-            sensorDict[SensorJSON.TIMESTAMP] = time.time()
-            sensorDict[SensorJSON.DEVICEID] = deviceID
-            sensorDict[SensorJSON.TOPIC] = videoTopic
-            sensorDict[SensorJSON.VIDEO_DATA] = binImage
-            sensorDict[SensorJSON.VIDEO_WIDTH] = width
-            sensorDict[SensorJSON.VIDEO_HEIGHT] = height
-            sensorDict[SensorJSON.VIDEO_RATE] = rate
             if jpeg:
-                sensorDict[SensorJSON.VIDEO_FORMAT] = 'mjpeg'
+                videoFormat = 'mjpeg'
+            else:
+                videoFormat = 'raw'
+
+            if (videoControl == None):
+                # JPEG frames can be re-encoded at lower quality and size if PIL is
+                # available. Otherwise only the frame rate can be reduced.
+                if jpeg and SensorVideoControl.canRecode():
+                    levels = SensorVideoControl.VIDEO_CONTROL_LEVELS
+                else:
+                    levels = SensorVideoControl.VIDEO_CONTROL_RATE_LEVELS
+                videoControl = SensorVideoControl.SensorVideoControl(MQTTClient, videoTopic,
+                            statusTopic, deviceID, width, height, rate, levels, adaptive)
+
+            # skip frames to get the current frame rate
+            if not videoControl.wantFrame(time.time()):
+                continue
+
+            if (videoControl.getQuality() != None):
+                frame, width, height = SensorVideoControl.recodeJpeg(frame,
+                            videoControl.getQuality(), videoControl.getScale())
+            rate = videoControl.getRate()
+
+            frameSequence += 1
+
+            if jsonMode:
+                binImage = base64.b64encode(frame)
+
+                sensorDict = {}
+                sensorDict[SensorJSON.TIMESTAMP] = time.time()
+                sensorDict[SensorJSON.DEVICEID] = deviceID
+                sensorDict[SensorJSON.TOPIC] = videoTopic
+                sensorDict[SensorJSON.VIDEO_DATA] = binImage
+                sensorDict[SensorJSON.VIDEO_WIDTH] = width
+                sensorDict[SensorJSON.VIDEO_HEIGHT] = height
+                sensorDict[SensorJSON.VIDEO_RATE] = rate
+                sensorDict[SensorJSON.VIDEO_FORMAT] = videoFormat
+                sensorDict[SensorJSON.VIDEO_SEQUENCE] = frameSequence
+
+                MQTTClient.publish(videoTopic, json.dumps(sensorDict))
             else:
-                sensorDict[SensorJSON.VIDEO_FORMAT] = 'raw'
+                # binary envelope avoids the base64 and JSON overhead
+                MQTTClient.publish(videoTopic, SensorBinary.packVideo(time.time(),
+                            width, height, rate, videoFormat, frameSequence, frame))
+
+            videoControl.update()
 
-            MQTTClient.publish(videoTopic, json.dumps(sensorDict))        
+        reportStats()
         
     except:
         break
@@ -176,5 +260,5 @@ while(True):
 
 RTUVCCam.vidCapClose(cameraIndex)
 RTUVCCam.stop()
-MQTTClient.loop_stop()
+MQTTClient.stop()
 print("Exiting")
@@ -87,6 +87,7 @@ class RT_ADXL345(RT_NullSensor):
         RT_NullSensor.__init__(self)
         # set default address
         self.addr = ADXL345_ADDRESS_ALT_GND
+        self.dataRate = ADXL345_DATARATE_100_HZ
         self.sensorValid = True
             
     def enable(self, busnum=-1, debug=False):
@@ -125,11 +126,16 @@ class RT_ADXL345(RT_NullSensor):
         # Note: The LOW_POWER bits are currently ignored,
         # we always keep the device in 'normal' mode
         self.accel.write8(ADXL345_REG_BW_RATE, dataRate & 0x0F)
+        self.dataRate = dataRate & 0x0F
 
 
     def getDataRate(self):
         return self.accel.readU8(ADXL345_REG_BW_RATE) & 0x0F
 
+    def getSamplePeriod(self):
+        # each rate code doubles the rate, ending at 3200Hz
+        return 1.0 / (3200.0 / (1 << (ADXL345_DATARATE_3200_HZ - self.dataRate)))
+
 
     # Read the accelerometer
     def readAccel(self):
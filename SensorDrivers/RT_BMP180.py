@@ -58,6 +58,16 @@ BMP180_STATE_IDLE = 0
 BMP180_STATE_TEMPERATURE = 1
 BMP180_STATE_PRESSURE = 2
 
+# Timing (seconds)
+
+BMP180_TEMPCONV_TIME = 0.005            # temperature conversion time
+BMP180_PRESSURECONV_TIME = (0.005,      # pressure conversion time indexed by oss
+                            0.008,
+                            0.014,
+                            0.026)
+BMP180_POLL_TIME = 0.002                # time between checks if a conversion is late
+BMP180_CYCLE_INTERVAL = 0.1             # time between the end of one cycle and the start of the next
+
 class RT_BMP180(RT_NullSensor):
     ''' richards-tech driver for the BMP180 pressure sensor '''
     
@@ -121,19 +131,23 @@ class RT_BMP180(RT_NullSensor):
         ''' returns temperature in degrees C '''
         return self.temperature
         
+    def getSamplePeriod(self):
+        return BMP180_CYCLE_INTERVAL + BMP180_TEMPCONV_TIME + BMP180_PRESSURECONV_TIME[self.oss]
+
     def background(self):
+        # returns the time until the next step is due
 
         if (self.state == BMP180_STATE_IDLE):
             # start a temperature conversion
             self.bmp.write8(BMP180_REG_SCO, BMP180_SCO_TEMPCONV)
             self.state = BMP180_STATE_TEMPERATURE
-            return
+            return BMP180_TEMPCONV_TIME
 	        
         elif (self.state == BMP180_STATE_TEMPERATURE):
 	        # see if temperature ready
             res = self.bmp.readU8(BMP180_REG_SCO)
             if ((res & 0x20) == 0x20):
-                return                                      # conversion not finished
+                return BMP180_POLL_TIME                     # conversion not finished
 			
 			# get the temperature
             data = self.bmp.readList(BMP180_REG_RESULT, 2)
@@ -142,13 +156,13 @@ class RT_BMP180(RT_NullSensor):
 		    # start the pressure reading
             self.bmp.write8(BMP180_REG_SCO, 0x34 + (self.oss << 6))
             self.state = BMP180_STATE_PRESSURE
-            return
+            return BMP180_PRESSURECONV_TIME[self.oss]
 
         elif (self.state == BMP180_STATE_PRESSURE):
             # see if pressure ready
             res = self.bmp.readU8(BMP180_REG_SCO)
             if ((res & 0x20) == 0x20):
-                return                                          # conversion not finished
+                return BMP180_POLL_TIME                         # conversion not finished
 
             data = self.bmp.readList(BMP180_REG_RESULT, 2)
             self.rawPressure = self.__readUnsignedShort(data[0], data[1])
@@ -161,6 +175,7 @@ class RT_BMP180(RT_NullSensor):
             self.dataValid = True
 
             self.state = BMP180_STATE_IDLE
+            return BMP180_CYCLE_INTERVAL
 
     def compensateTemperature(self):
         # calculate compensated temperature
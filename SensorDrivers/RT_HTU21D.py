@@ -92,10 +92,16 @@ class RT_HTU21D(RT_NullSensor):
         ''' returns temperature in degrees C '''
         return self.temperature
         
+    def getSamplePeriod(self):
+        # a full cycle takes three state changes
+        return 3 * HTU21D_STATE_INTERVAL
+
     def background(self):
+        # returns the time until the next state change is due.
         # only do processing at the appropriate interval
-        if ((time.time() - self.lastStateChange) < HTU21D_STATE_INTERVAL):
-            return
+        remaining = HTU21D_STATE_INTERVAL - (time.time() - self.lastStateChange)
+        if (remaining > 0):
+            return remaining
             
         self.lastStateChange = time.time()
 
@@ -103,7 +109,7 @@ class RT_HTU21D(RT_NullSensor):
             # start a temperature conversion
             self.writeI2C.write(HTU21D_CMD_TRIG_TEMP)
             self.state = HTU21D_STATE_TEMP_REQ
-            return
+            return HTU21D_STATE_INTERVAL
 	        
         elif (self.state == HTU21D_STATE_TEMP_REQ):
             # get temperature and then start humidity
@@ -113,7 +119,7 @@ class RT_HTU21D(RT_NullSensor):
             # start the pressure reading
             self.writeI2C.write(HTU21D_CMD_TRIG_HUM)
             self.state = HTU21D_STATE_HUM_REQ
-            return
+            return HTU21D_STATE_INTERVAL
 
         elif (self.state == HTU21D_STATE_HUM_REQ):
             # get the humidity
@@ -123,5 +129,6 @@ class RT_HTU21D(RT_NullSensor):
             # now got valid data and start again
             self.dataValid = True
             self.state = HTU21D_STATE_IDLE
+            return HTU21D_STATE_INTERVAL
 
 
@@ -44,6 +44,10 @@ MCP9808_REG_CONFIG = 1                  # config register
 MCP9808_REG_TEMP = 5                    # temp register (2 bytes)
 MCP9808_REG_ID = 7                      # device ID
 
+# Timing
+
+MCP9808_CONVERSION_TIME = 0.25          # conversion time at the default resolution
+
 class RT_MCP9808(RT_NullSensor):
     ''' richards-tech driver for the MCP9808 temperature sensor '''
     
@@ -70,6 +74,9 @@ class RT_MCP9808(RT_NullSensor):
 
         self.dataValid = True
 
+    def getSamplePeriod(self):
+        return MCP9808_CONVERSION_TIME
+
     def readTemperature(self):
         # read the sensor - returns temperature in degrees C
         val = self.temp.readList(MCP9808_REG_TEMP, 2) 
@@ -52,8 +52,14 @@ class RT_NullSensor():
         pass
     
     def background(self):
-        # in case a sensor needs a background loop
-        pass
+        # in case a sensor needs a background loop. Returns the number of seconds
+        # until background should be called again or None if it isn't needed.
+        return None
+
+    def getSamplePeriod(self):
+        # returns the number of seconds between new readings or None if the
+        # sensor doesn't have a natural rate
+        return None
         
     def readAccel(self):
         # dummy accel data
@@ -57,12 +57,20 @@ TMP102_CONTROL_HIGH_TM = 0x2                              # sets interrupt for t
 TMP102_CONTROL_HIGH_POL = 0x40                            # polarity mode
 TMP102_CONTROL_HIGH_OS = 0x80                             # enables one shot mode
 
+# Conversion periods (seconds) for each conversion rate
+
+TMP102_CONVERSION_PERIOD = {TMP102_CONTROL_LOW_CRD25 : 4.0,
+                            TMP102_CONTROL_LOW_CR1 : 1.0,
+                            TMP102_CONTROL_LOW_CR4 : 0.25,
+                            TMP102_CONTROL_LOW_CR8 : 0.125}
+
 class RT_TMP102(RT_NullSensor):
     ''' richards-tech driver for the TMP102 temperature sensor '''
     
     def __init__(self):
         RT_NullSensor.__init__(self)
         self.addr = TMP102_ADDRESS_AD0_VCC
+        self.tempRate = TMP102_CONTROL_LOW_CR8
         self.sensorValid = True
  
     def enable(self, busnum=-1, debug=False):
@@ -88,6 +96,9 @@ class RT_TMP102(RT_NullSensor):
         # set the sample rate
         self.tempRate = sampleRate
 
+    def getSamplePeriod(self):
+        return TMP102_CONVERSION_PERIOD.get(self.tempRate)
+
     def readTemperature(self):
         # read the sensor - returns temperature in degrees C
         val = self.temp.readList(TMP102_DATA, 2)       
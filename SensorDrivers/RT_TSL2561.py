@@ -75,6 +75,10 @@ TSL2561_SCALE_13D7 = (1.0 / 0.034)
 TSL2561_SCALE_101 = (1.0 / 0.252)
 TSL2561_SCALE_402 = (1.0)
 
+# Integration times (seconds) indexed by the timing register integration bits
+
+TSL2561_INTEGRATION_TIME = (0.0137, 0.101, 0.402)
+
 # Interrupt control bits
 
 TSL2561_INTERRUPT_LEVEL = 0x10        # level interrupt mode enable
@@ -110,6 +114,11 @@ class RT_TSL2561(RT_NullSensor):
     def setIntegrationTime(self, integrationTime):
         self.integrationTime = integrationTime
 
+    def getSamplePeriod(self):
+        if (self.integrationTime == TSL2561_TIMING_INTEGMAN):
+            return None
+        return TSL2561_INTEGRATION_TIME[self.integrationTime]
+
     # Read the sensor
     def readLight(self):
         ''' returns light level in Lux '''
@@ -0,0 +1,238 @@
+#!/usr/bin/python
+"""
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015-2016, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+# Audio codecs used by RTAudioMQTT and RTMediaViewMQTT. The input to the encoders
+# and the output of the decoders is always interleaved int16 PCM. The formats are:
+#
+#   pcm     no compression
+#   ulaw    G.711 mu-law, 2:1. Each message stands alone.
+#   adpcm   IMA ADPCM, 4:1. Each channel is coded separately and the encoder state
+#           at the start of each message is sent with it so that a lost message
+#           doesn't upset the decoding of the ones after it. Two samples are coded
+#           per byte so if a block has an odd number of samples per channel the
+#           last one is carried over to the next block.
+#   opus    Opus, available if opuslib is installed. The data is a sequence of
+#           Opus packets, each preceded by its length as a little endian uint16.
+#           Opus only supports 8000, 12000, 16000, 24000 and 48000Hz.
+
+import audioop
+import struct
+
+try:
+    import opuslib
+except ImportError:
+    opuslib = None
+
+AUDIO_FORMATS = ('pcm', 'ulaw', 'adpcm', 'opus')
+
+AUDIO_SAMPLE_WIDTH = 2                      # bytes per int16 sample
+
+OPUS_FRAME_MS = 20                          # the normal Opus packet length
+OPUS_SHORT_FRAME_MS = 10                    # used to code the remainder of a block
+OPUS_MAX_FRAME_MS = 120                     # the longest packet a decoder can get
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+OPUS_LENGTH = struct.Struct('<H')
+
+def isFormatAvailable(format, rate):
+    ''' returns True if format can be used at the sample rate '''
+    if (format == 'opus'):
+        return (opuslib != None) and (rate in OPUS_RATES)
+    return format in AUDIO_FORMATS
+
+class SensorAudioEncoder():
+    ''' Encodes blocks of int16 PCM in one of the AUDIO_FORMATS '''
+
+    def __init__(self, format, rate, channels):
+        if not isFormatAvailable(format, rate):
+            raise ValueError('audio format %s is not available at %dHz' % (format, rate))
+        self.format = format
+        self.rate = rate
+        self.channels = channels
+
+        # the ADPCM state for each channel and the samples carried over to the next block
+        self.adpcmState = [None] * channels
+        self.adpcmPending = b''
+
+        self.opusEncoder = None
+        if (format == 'opus'):
+            self.opusEncoder = opuslib.Encoder(rate, channels, opuslib.APPLICATION_AUDIO)
+            # Opus packets can only be certain lengths so any part of a block that
+            # doesn't fill a short packet is carried over to the next block
+            self.opusPending = b''
+
+    def encode(self, samples):
+        ''' encodes samples. Returns (data, state) where state is the codec
+        state that the decoder needs (None for codecs that don't need it). '''
+        if (self.format == 'ulaw'):
+            return audioop.lin2ulaw(samples, AUDIO_SAMPLE_WIDTH), None
+        if (self.format == 'adpcm'):
+            return self.__encodeAdpcm(samples)
+        if (self.format == 'opus'):
+            return self.__encodeOpus(samples), None
+        return samples, None
+
+    def __encodeAdpcm(self, samples):
+        samples = self.adpcmPending + samples
+        frameBytes = self.channels * AUDIO_SAMPLE_WIDTH
+        if ((len(samples) // frameBytes) % 2 == 1):
+            # the last nibble would be padding so the last sample waits for the next block
+            self.adpcmPending = samples[-frameBytes:]
+            samples = samples[:-frameBytes]
+        else:
+            self.adpcmPending = b''
+
+        state = []
+        data = []
+        for channel in range(0, self.channels):
+            channelSamples = splitChannel(samples, self.channels, channel)
+            channelState = self.adpcmState[channel]
+            state.append(list(channelState) if (channelState != None) else [0, 0])
+            coded, self.adpcmState[channel] = audioop.lin2adpcm(channelSamples,
+                            AUDIO_SAMPLE_WIDTH, channelState)
+            data.append(coded)
+        # the channels are the same length so the decoder can split the data evenly
+        return b''.join(data), state
+
+    def __encodeOpus(self, samples):
+        samples = self.opusPending + samples
+        bytesPerMs = self.rate * self.channels * AUDIO_SAMPLE_WIDTH // 1000
+        packets = []
+        offset = 0
+        for frameMs in (OPUS_FRAME_MS, OPUS_SHORT_FRAME_MS):
+            frameBytes = frameMs * bytesPerMs
+            while ((len(samples) - offset) >= frameBytes):
+                packet = self.opusEncoder.encode(samples[offset:offset + frameBytes],
+                                frameBytes // (self.channels * AUDIO_SAMPLE_WIDTH))
+                packets.append(OPUS_LENGTH.pack(len(packet)))
+                packets.append(packet)
+                offset += frameBytes
+        self.opusPending = samples[offset:]
+        return b''.join(packets)
+
+class SensorAudioDecoder():
+    ''' Decodes data from SensorAudioEncoder back to int16 PCM '''
+
+    def __init__(self, format, rate, channels):
+        if not isFormatAvailable(format, rate):
+            raise ValueError('audio format %s is not available at %dHz' % (format, rate))
+        self.format = format
+        self.rate = rate
+        self.channels = channels
+
+        self.opusDecoder = None
+        if (format == 'opus'):
+            self.opusDecoder = opuslib.Decoder(rate, channels)
+
+    def decode(self, data, state=None):
+        ''' decodes data using state from the encoder. Returns the PCM samples. '''
+        if (self.format == 'ulaw'):
+            return audioop.ulaw2lin(data, AUDIO_SAMPLE_WIDTH)
+        if (self.format == 'adpcm'):
+            return self.__decodeAdpcm(data, state)
+        if (self.format == 'opus'):
+            return self.__decodeOpus(data)
+        return data
+
+    def __decodeAdpcm(self, data, state):
+        channelLength = len(data) // self.channels
+        channels = []
+        for channel in range(0, self.channels):
+            channelState = None
+            if (state != None):
+                channelState = tuple(state[channel])
+            coded = data[channel * channelLength:(channel + 1) * channelLength]
+            channels.append(audioop.adpcm2lin(coded, AUDIO_SAMPLE_WIDTH, channelState)[0])
+        if (self.channels == 1):
+            return channels[0]
+        return joinChannels(channels)
+
+    def __decodeOpus(self, data):
+        maxFrameSize = self.rate * OPUS_MAX_FRAME_MS // 1000
+        samples = []
+        offset = 0
+        while ((offset + OPUS_LENGTH.size) <= len(data)):
+            length = OPUS_LENGTH.unpack_from(data, offset)[0]
+            offset += OPUS_LENGTH.size
+            samples.append(self.opusDecoder.decode(bytes(data[offset:offset + length]), maxFrameSize))
+            offset += length
+        return b''.join(samples)
+
+def splitChannel(samples, channels, channel):
+    ''' returns one channel of interleaved int16 samples '''
+    if (channels == 1):
+        return samples
+    if (channels == 2):
+        return audioop.tomono(samples, AUDIO_SAMPLE_WIDTH, 1 - channel, channel)
+    # audioop can only deal with stereo so more channels are split by hand
+    sampleCount = len(samples) // (channels * AUDIO_SAMPLE_WIDTH)
+    values = struct.unpack('<%dh' % (sampleCount * channels), samples)
+    return struct.pack('<%dh' % sampleCount, *values[channel::channels])
+
+def joinChannels(channels):
+    ''' interleaves a list of int16 channels '''
+    if (len(channels) == 2):
+        return audioop.add(audioop.tostereo(channels[0], AUDIO_SAMPLE_WIDTH, 1, 0),
+                           audioop.tostereo(channels[1], AUDIO_SAMPLE_WIDTH, 0, 1),
+                           AUDIO_SAMPLE_WIDTH)
+    sampleCount = len(channels[0]) // AUDIO_SAMPLE_WIDTH
+    values = [struct.unpack('<%dh' % sampleCount, channel) for channel in channels]
+    interleaved = [value for frame in zip(*values) for value in frame]
+    return struct.pack('<%dh' % len(interleaved), *interleaved)
+
+if __name__ == '__main__':
+    # round trip check of each codec using blocks with an odd number of samples
+    # per channel (eg 50mS at 44100Hz) which must all come out again
+    import math
+
+    for format, rate in (('pcm', 44100), ('ulaw', 44100), ('adpcm', 44100), ('adpcm', 16000),
+                         ('opus', 48000)):
+        if not isFormatAvailable(format, rate):
+            print ('%s not available' % format)
+            continue
+        for channels in (1, 2, 3):
+            encoder = SensorAudioEncoder(format, rate, channels)
+            decoder = SensorAudioDecoder(format, rate, channels)
+            blockSamples = (rate // 20) | 1
+            samplesIn = 0
+            samplesOut = 0
+            for block in range(0, 21):
+                values = []
+                for sample in range(0, blockSamples):
+                    value = int(8000 * math.sin((block * blockSamples + sample) / 10.0))
+                    values.extend([value] * channels)
+                data, state = encoder.encode(struct.pack('<%dh' % len(values), *values))
+                samplesIn += blockSamples
+                samplesOut += len(decoder.decode(data, state)) // (channels * AUDIO_SAMPLE_WIDTH)
+            # only the samples still waiting in the encoder may be missing
+            waiting = 0
+            if (format == 'adpcm'):
+                waiting = len(encoder.adpcmPending) // (channels * AUDIO_SAMPLE_WIDTH)
+            elif (format == 'opus'):
+                waiting = len(encoder.opusPending) // (channels * AUDIO_SAMPLE_WIDTH)
+            print ('%s %dHz %d channels: %d samples in, %d out, %d waiting' %
+                    (format, rate, channels, samplesIn, samplesOut, waiting))
+            assert samplesOut + waiting == samplesIn
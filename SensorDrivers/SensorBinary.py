@@ -0,0 +1,225 @@
+#!/usr/bin/python
+'''
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''
+
+# Binary media envelope. This is an alternative to the base64-in-JSON
+# records described in SensorJSON. A fixed size header is followed directly
+# by the raw media data so there is no encoding overhead.
+#
+# Header layout (little endian):
+#
+#   magic       4 bytes     'RTMB'
+#   version     uint8       envelope version
+#   mediaType   uint8       MEDIA_TYPE_VIDEO etc
+#   format      uint8       one of the FORMAT_ codes below
+#   timestamp   double      seconds since epoch
+#   width       uint16      video frame width
+#   height      uint16      video frame height
+#   rate        uint16      video frame rate
+#   sequence    uint32      per-stream sequence number
+#
+# The header has no equivalent of the SensorJSON DEVICEID and TOPIC fields of a
+# JSON video record. These are left out because they repeat what the MQTT topic
+# already says, so unpackVideo doesn't return them. Consumers that need them
+# should take them from the topic the frame arrived on.
+#
+# Sensor batches use the same magic, version and media type fields followed by:
+#
+#   fields      uint8       bit mask of the SENSOR_BATCH_FIELDS present
+#   count       uint32      number of samples
+#
+# then count timestamps as doubles and, for each field present, count
+# floats per column. NaN marks samples where the sensor had no data.
+
+import struct
+
+import SensorJSON
+
+MEDIA_MAGIC = 'RTMB'
+MEDIA_VERSION = 1
+
+MEDIA_HEADER = struct.Struct('<4sBBBdHHHI')
+MEDIA_HEADER_SIZE = MEDIA_HEADER.size
+
+# media types
+
+MEDIA_TYPE_VIDEO = 1
+MEDIA_TYPE_SENSOR_BATCH = 2
+
+SENSOR_BATCH_HEADER = struct.Struct('<4sBBBI')
+SENSOR_BATCH_HEADER_SIZE = SENSOR_BATCH_HEADER.size
+
+# the sensor batch fields in bit order as (SensorJSON name, number of columns)
+
+SENSOR_BATCH_FIELDS = ((SensorJSON.ACCEL_DATA, 3),
+                       (SensorJSON.LIGHT_DATA, 1),
+                       (SensorJSON.TEMPERATURE_DATA, 1),
+                       (SensorJSON.PRESSURE_DATA, 1),
+                       (SensorJSON.HUMIDITY_DATA, 1))
+
+# format codes and the equivalent SensorJSON format strings
+
+FORMAT_MJPEG = 1
+FORMAT_RAW = 2
+FORMAT_H264 = 3
+
+formatCodes = {'mjpeg' : FORMAT_MJPEG, 'raw' : FORMAT_RAW, 'h264' : FORMAT_H264}
+formatNames = {FORMAT_MJPEG : 'mjpeg', FORMAT_RAW : 'raw', FORMAT_H264 : 'h264'}
+
+def isMediaEnvelope(payload):
+    ''' returns True if the payload is a binary media envelope rather than JSON '''
+    return payload[:len(MEDIA_MAGIC)] == MEDIA_MAGIC
+
+def packVideo(timestamp, width, height, rate, format, sequence, frame):
+    ''' builds a binary video envelope. format is a SensorJSON format string (eg mjpeg).
+    frame can be a string or any object supporting the buffer protocol
+    (eg RTUVCCam.Frame) and is copied exactly once, into the envelope. '''
+    payload = bytearray(MEDIA_HEADER_SIZE + len(frame))
+    MEDIA_HEADER.pack_into(payload, 0, MEDIA_MAGIC, MEDIA_VERSION, MEDIA_TYPE_VIDEO,
+                    formatCodes[format], timestamp, width, height, rate,
+                    sequence & 0xffffffff)
+    payload[MEDIA_HEADER_SIZE:] = frame
+    return payload
+
+def unpackVideo(payload):
+    ''' decodes a binary video envelope.
+    Returns a dictionary using the SensorJSON keys so that callers can treat
+    it the same as a decoded JSON record. The video data is returned raw,
+    not base64 encoded. '''
+
+    if len(payload) < MEDIA_HEADER_SIZE:
+        raise ValueError('media envelope too short')
+
+    (magic, version, mediaType, format, timestamp, width, height, rate,
+        sequence) = MEDIA_HEADER.unpack_from(payload)
+
+    if magic != MEDIA_MAGIC:
+        raise ValueError('not a media envelope')
+    if version != MEDIA_VERSION:
+        raise ValueError('unsupported media envelope version %d' % version)
+    if mediaType != MEDIA_TYPE_VIDEO:
+        raise ValueError('media envelope is not video')
+
+    sensorDict = {}
+    sensorDict[SensorJSON.TIMESTAMP] = timestamp
+    sensorDict[SensorJSON.VIDEO_DATA] = payload[MEDIA_HEADER_SIZE:]
+    sensorDict[SensorJSON.VIDEO_WIDTH] = width
+    sensorDict[SensorJSON.VIDEO_HEIGHT] = height
+    sensorDict[SensorJSON.VIDEO_RATE] = rate
+    sensorDict[SensorJSON.VIDEO_FORMAT] = formatNames.get(format, 'unknown')
+    sensorDict[SensorJSON.VIDEO_SEQUENCE] = sequence
+    return sensorDict
+
+def shiftTimestamps(payload, offset):
+    ''' returns a copy of a binary envelope (video or sensor batch) with offset
+    added to its timestamps, for example to replay a recording as live data '''
+    if (len(payload) < SENSOR_BATCH_HEADER_SIZE) or not isMediaEnvelope(payload):
+        raise ValueError('not a media envelope')
+    payload = bytearray(payload)
+    mediaType = SENSOR_BATCH_HEADER.unpack_from(payload)[2]
+
+    if (mediaType == MEDIA_TYPE_VIDEO):
+        if len(payload) < MEDIA_HEADER_SIZE:
+            raise ValueError('media envelope too short')
+        header = list(MEDIA_HEADER.unpack_from(payload))
+        header[4] += offset
+        MEDIA_HEADER.pack_into(payload, 0, *header)
+    elif (mediaType == MEDIA_TYPE_SENSOR_BATCH):
+        count = SENSOR_BATCH_HEADER.unpack_from(payload)[4]
+        if len(payload) < SENSOR_BATCH_HEADER_SIZE + 8 * count:
+            raise ValueError('sensor batch too short')
+        timestamps = struct.unpack_from('<%dd' % count, payload, SENSOR_BATCH_HEADER_SIZE)
+        struct.pack_into('<%dd' % count, payload, SENSOR_BATCH_HEADER_SIZE,
+                        *[timestamp + offset for timestamp in timestamps])
+    else:
+        raise ValueError('unknown media type %d' % mediaType)
+    return payload
+
+def packSensorBatch(timestamps, columns):
+    ''' builds a binary sensor batch. columns is a dictionary keyed by SensorJSON
+    name in the same form as a JSON batch - a list of values per sample (or a
+    list of three such lists for accel) with None for missing values. '''
+    count = len(timestamps)
+    fields = 0
+    body = [struct.pack('<%dd' % count, *timestamps)]
+    for bit in range(0, len(SENSOR_BATCH_FIELDS)):
+        name, width = SENSOR_BATCH_FIELDS[bit]
+        data = columns.get(name)
+        if (data == None):
+            continue
+        fields |= 1 << bit
+        if (width == 1):
+            data = [data]
+        for column in data:
+            body.append(struct.pack('<%df' % count,
+                            *[float('nan') if value == None else value for value in column]))
+    header = SENSOR_BATCH_HEADER.pack(MEDIA_MAGIC, MEDIA_VERSION, MEDIA_TYPE_SENSOR_BATCH, fields, count)
+    return header + b''.join(body)
+
+def isSensorBatch(payload):
+    ''' returns True if the payload is a binary sensor batch '''
+    if (len(payload) < SENSOR_BATCH_HEADER_SIZE) or not isMediaEnvelope(payload):
+        return False
+    return SENSOR_BATCH_HEADER.unpack_from(payload)[2] == MEDIA_TYPE_SENSOR_BATCH
+
+def unpackSensorBatch(payload):
+    ''' decodes a binary sensor batch.
+    Returns a dictionary in the same form as a decoded JSON batch except that
+    missing values are NaN rather than None. '''
+
+    if len(payload) < SENSOR_BATCH_HEADER_SIZE:
+        raise ValueError('sensor batch too short')
+
+    magic, version, mediaType, fields, count = SENSOR_BATCH_HEADER.unpack_from(payload)
+
+    if magic != MEDIA_MAGIC:
+        raise ValueError('not a media envelope')
+    if version != MEDIA_VERSION:
+        raise ValueError('unsupported media envelope version %d' % version)
+    if mediaType != MEDIA_TYPE_SENSOR_BATCH:
+        raise ValueError('media envelope is not a sensor batch')
+
+    columnCount = 0
+    for bit in range(0, len(SENSOR_BATCH_FIELDS)):
+        if (fields & (1 << bit)):
+            columnCount += SENSOR_BATCH_FIELDS[bit][1]
+    if len(payload) != SENSOR_BATCH_HEADER_SIZE + count * (8 + 4 * columnCount):
+        raise ValueError('sensor batch length mismatch')
+
+    sensorDict = {}
+    offset = SENSOR_BATCH_HEADER_SIZE
+    sensorDict[SensorJSON.BATCH_TIMESTAMPS] = struct.unpack_from('<%dd' % count, payload, offset)
+    offset += 8 * count
+
+    for bit in range(0, len(SENSOR_BATCH_FIELDS)):
+        if not (fields & (1 << bit)):
+            continue
+        name, width = SENSOR_BATCH_FIELDS[bit]
+        data = []
+        for column in range(0, width):
+            data.append(struct.unpack_from('<%df' % count, payload, offset))
+            offset += 4 * count
+        sensorDict[name] = data[0] if (width == 1) else data
+    return sensorDict
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+"""
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015-2016, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import collections
+import sys
+import threading
+
+class SensorDecodePool():
+    ''' Decodes messages on a pool of worker threads so that the thread that
+    receives them only has to queue them. The queue is bounded and, as a newer
+    message supersedes an older one, the oldest is discarded when it is full.
+    Messages can also be queued with a key (eg the topic) in which case a new
+    message replaces one with the same key that is still waiting, so that each
+    source only ever has its latest message queued. With one worker the
+    messages are decoded in order. '''
+
+    def __init__(self, decode, workerCount=2, maxQueueLength=4):
+        # the function called (on a worker thread) for each message
+        self.decode = decode
+        self.workerCount = workerCount
+        self.maxQueueLength = maxQueueLength
+
+        # the queue holds [key, message] entries. keyed holds the entries that
+        # have a key so that they can be replaced.
+        self.queue = collections.deque()
+        self.keyed = {}
+        self.queueLock = threading.Condition()
+
+        # counters
+        self.skippedCount = 0
+        self.decodedCount = 0
+        self.errorCount = 0
+
+        self.mustExit = False
+        self.threads = []
+
+    def start(self):
+        ''' starts the worker threads '''
+        self.mustExit = False
+        for worker in range(0, self.workerCount):
+            thread = threading.Thread(target=self.__workerLoop)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        ''' stops the worker threads. Messages still queued are discarded. '''
+        self.mustExit = True
+        with self.queueLock:
+            self.queueLock.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def enqueue(self, message, key=None):
+        ''' queues a message for decoding. This never blocks. '''
+        with self.queueLock:
+            if (key != None) and (key in self.keyed):
+                # the waiting message is out of date
+                self.keyed[key][1] = message
+                self.skippedCount += 1
+                return
+            if (len(self.queue) >= self.maxQueueLength):
+                self.__forget(self.queue.popleft())
+                self.skippedCount += 1
+            entry = [key, message]
+            self.queue.append(entry)
+            if (key != None):
+                self.keyed[key] = entry
+            self.queueLock.notify()
+
+    def __forget(self, entry):
+        # called with queueLock held when an entry leaves the queue
+        if (entry[0] != None):
+            del self.keyed[entry[0]]
+
+    # counter access functions
+
+    def getSkippedCount(self):
+        return self.skippedCount
+
+    def getDecodedCount(self):
+        return self.decodedCount
+
+    def getErrorCount(self):
+        return self.errorCount
+
+    def getQueueDepth(self):
+        return len(self.queue)
+
+    def __workerLoop(self):
+        while True:
+            with self.queueLock:
+                while (len(self.queue) == 0) and not self.mustExit:
+                    self.queueLock.wait(0.1)
+                if self.mustExit:
+                    return
+                entry = self.queue.popleft()
+                self.__forget(entry)
+                message = entry[1]
+
+            try:
+                self.decode(message)
+                with self.queueLock:
+                    self.decodedCount += 1
+            except Exception:
+                with self.queueLock:
+                    self.errorCount += 1
+                print ("decode error", sys.exc_info()[0], sys.exc_info()[1])
+                sys.stdout.flush()
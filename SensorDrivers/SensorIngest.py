@@ -0,0 +1,190 @@
+#!/usr/bin/python
+"""
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015-2016, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import collections
+import sys
+import threading
+import time
+
+import SensorRecords
+
+class SensorIngest():
+    ''' Hands sensor messages from the MQTT thread to a decoding thread. The
+    decoded records are published as immutable snapshots for the plotter. '''
+
+    def __init__(self, accumInterval, snapshotInterval, idleTimeout=0, rollupWindow=None,
+                 maxQueueLength=1000, batchSize=100):
+        # the SensorRecords accumulation interval
+        self.accumInterval = accumInterval
+
+        # how often a new snapshot is made available
+        self.snapshotInterval = snapshotInterval
+
+        # topics not seen for this many seconds are removed (0 = never)
+        self.idleTimeout = idleTimeout
+
+        # the rollup window captured in each snapshot (None = no rollups)
+        self.rollupWindow = rollupWindow
+
+        # the queue of (topic, payload) from the MQTT thread. deque append and
+        # popleft are atomic so no lock is required.
+        self.queue = collections.deque()
+        self.queueEvent = threading.Event()
+        self.maxQueueLength = maxQueueLength
+        self.batchSize = batchSize
+
+        # these are only accessed by the decoding thread
+        self.topicMap = {}
+        self.topicLastSeen = {}
+
+        # the latest snapshot list, replaced as a whole each time
+        self.snapshot = []
+
+        # the (update count, snapshot) last taken for each topic. Snapshots are
+        # immutable so one is reused until its topic changes.
+        self.topicSnapshots = {}
+
+        # counters
+        self.queuedCount = 0
+        self.droppedCount = 0
+        self.decodedCount = 0
+        self.errorCount = 0
+
+        self.mustExit = False
+        self.thread = None
+
+    def start(self):
+        ''' starts the decoding thread '''
+        self.mustExit = False
+        self.thread = threading.Thread(target=self.__decodeLoop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        ''' stops the decoding thread '''
+        self.mustExit = True
+        self.queueEvent.set()
+        if (self.thread != None):
+            self.thread.join()
+            self.thread = None
+
+    def enqueue(self, topic, payload):
+        ''' called from the MQTT thread. This never blocks - if the queue is full
+        the message is dropped and counted. Returns True if queued. '''
+        if (len(self.queue) >= self.maxQueueLength):
+            self.droppedCount += 1
+            return False
+        self.queue.append((topic, payload))
+        self.queuedCount += 1
+        self.queueEvent.set()
+        return True
+
+    def getSnapshot(self):
+        ''' returns the latest list of SensorRecords snapshots in topic order '''
+        return self.snapshot
+
+    # counter access functions
+
+    def getQueuedCount(self):
+        return self.queuedCount
+
+    def getDroppedCount(self):
+        return self.droppedCount
+
+    def getDecodedCount(self):
+        return self.decodedCount
+
+    def getErrorCount(self):
+        return self.errorCount
+
+    def getQueueDepth(self):
+        return len(self.queue)
+
+    def __decodeLoop(self):
+        lastSnapshotTime = 0
+        while not self.mustExit:
+            self.queueEvent.wait(self.snapshotInterval)
+            self.queueEvent.clear()
+
+            # decode in batches so that a flood of messages doesn't hold up snapshots
+            while self.__decodeBatch() and not self.mustExit:
+                if ((time.time() - lastSnapshotTime) >= self.snapshotInterval):
+                    break
+
+            now = time.time()
+            if ((now - lastSnapshotTime) >= self.snapshotInterval):
+                lastSnapshotTime = now
+                self.__evictIdleTopics(now)
+                self.__takeSnapshot()
+
+    def __decodeBatch(self):
+        # decodes up to batchSize messages. Returns False if the queue was emptied.
+        now = time.time()
+        for i in range(0, self.batchSize):
+            try:
+                topic, payload = self.queue.popleft()
+            except IndexError:
+                return False
+
+            sensor = self.topicMap.get(topic)
+            if (sensor == None):
+                # first message from this device so create a model for it
+                sensor = SensorRecords.SensorRecords(topic, self.accumInterval)
+                self.topicMap[topic] = sensor
+                print ("New sensor topic", topic)
+            self.topicLastSeen[topic] = now
+
+            try:
+                sensor.newJSONData(payload)
+                self.decodedCount += 1
+            except:
+                self.errorCount += 1
+                print ("JSON error", sys.exc_info()[0],sys.exc_info()[1])
+        return True
+
+    def __evictIdleTopics(self, now):
+        if (self.idleTimeout <= 0):
+            return
+        for topic in list(self.topicLastSeen.keys()):
+            if ((now - self.topicLastSeen[topic]) >= self.idleTimeout):
+                del self.topicLastSeen[topic]
+                del self.topicMap[topic]
+                self.topicSnapshots.pop(topic, None)
+                print ("Removed idle sensor topic", topic)
+
+    def __takeSnapshot(self):
+        # the plotter may still be using the old list so build a new one. Only
+        # topics that have changed since the last snapshot are copied.
+        snapshot = []
+        for topic in sorted(self.topicMap.keys()):
+            sensor = self.topicMap[topic]
+            updateCount, topicSnapshot = self.topicSnapshots.get(topic, (None, None))
+            if (updateCount != sensor.getUpdateCount()):
+                topicSnapshot = sensor.snapshot(self.rollupWindow)
+                self.topicSnapshots[topic] = (sensor.getUpdateCount(), topicSnapshot)
+            snapshot.append(topicSnapshot)
+        self.snapshot = snapshot
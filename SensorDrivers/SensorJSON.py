@@ -35,9 +35,15 @@ TIMESTAMP = 'timestamp'                 # seconds since epoch
 ACCEL_DATA = 'accel'                    # accelerometer x, y, z data in gs
 LIGHT_DATA = 'light'                    # light data in lux
 TEMPERATURE_DATA = 'temperature'        # temperature data in degrees C
-PRESSURE_DATA = 'pressure'              # pressure in Pa
+PRESSURE_DATA = 'pressure'              # pressure in hPa
 HUMIDITY_DATA = 'humidity'              # humidity in %RH
 
+# variables used in batched sensor records. A batch has one timestamp per sample
+# and each sensor type is a column (accel is three columns, x, y and z) with
+# null for samples where the sensor had no data.
+
+BATCH_TIMESTAMPS = 'timestamps'         # array of seconds since epoch
+
 # variables used in JSON video records
 
 VIDEO_DATA = 'video'                    # video data in hex
@@ -45,6 +51,15 @@ VIDEO_WIDTH = 'vwidth'                  # video frame width
 VIDEO_HEIGHT = 'vheight'                # video frame height
 VIDEO_RATE = 'vrate'                    # video frame rate
 VIDEO_FORMAT = 'vformat'                # video frame format (eg mjpeg)
+VIDEO_SEQUENCE = 'vsequence'            # video frame sequence number
+
+# variables used in JSON video status records. These also use VIDEO_WIDTH,
+# VIDEO_HEIGHT and VIDEO_RATE for the current operating point.
+
+VIDEO_QUALITY = 'vquality'              # JPEG quality (null if not re-encoded)
+VIDEO_LEVEL = 'vlevel'                  # operating point index (0 = best)
+VIDEO_SENT_RATE = 'vsentrate'           # measured frames per second delivered
+VIDEO_DROPPED = 'vdropped'              # frames dropped in the last interval
 
 # variables used in JSON audio records
 
@@ -52,5 +67,6 @@ AUDIO_DATA = 'audio'                    # audio data in hex
 AUDIO_RATE = 'arate'                    # audio sample rate
 AUDIO_CHANNELS = 'achannels'            # number of audio channels
 AUDIO_SAMPTYPE = 'asamptype'            # sample type (eg int16)
-AUDIO_FORMAT = 'aformat'
+AUDIO_FORMAT = 'aformat'                # audio coding (pcm, ulaw, adpcm or opus)
+AUDIO_CODEC_STATE = 'astate'            # codec state at the start of the data (adpcm only)
 
@@ -0,0 +1,439 @@
+#!/usr/bin/python
+"""
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015-2016, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+# Common MQTT client used by the RTMQTT scripts. It wraps a paho client with:
+#
+#   - a network thread that reconnects with exponential backoff. It sleeps in
+#     select until the broker sends something or a message is published
+#   - a bounded outgoing queue that either drops the oldest message or blocks
+#     the caller when full
+#   - optional per topic limits on the number of queued messages. When a topic
+#     is at its limit a new message replaces the oldest queued one for that
+#     topic (latest wins) which suits video frames and status messages
+#   - a limit on the number of messages handed to paho but not yet sent
+#     (or acknowledged for QoS 1 and 2) so that paho's own buffers stay small
+#   - counters for queue depth, drops and publish latency, in total and per topic
+
+import collections
+import random
+import select
+import socket
+import sys
+import threading
+import time
+
+import paho.mqtt.client as paho
+
+# outgoing queue policies
+
+QUEUE_DROP_OLDEST = 0                       # discard the oldest queued message
+QUEUE_BLOCK = 1                             # wait for space
+
+# defaults
+
+MQTT_PORT = 1883
+MQTT_KEEPALIVE = 60
+MQTT_MAX_QUEUE_LENGTH = 1000
+MQTT_MAX_INFLIGHT = 20
+MQTT_MIN_BACKOFF = 1.0                      # first reconnect delay in seconds
+MQTT_MAX_BACKOFF = 60.0                     # longest reconnect delay in seconds
+MQTT_LOOP_TIMEOUT = 1.0                     # longest network loop wait. publish wakes it at once.
+
+def topicMatches(subscription, topic):
+    ''' returns True if topic matches subscription, which can contain + and # wildcards '''
+    return paho.topic_matches_sub(subscription, topic)
+
+class SensorMQTTClient():
+    ''' paho client wrapper with reconnect backoff, an outgoing queue and metrics.
+    The callbacks (onConnect etc) use the same arguments as the paho ones except
+    that onConnect is always (client, userdata, code). '''
+
+    def __init__(self, clientID, deviceID, deviceSecret, brokerAddress, qos=0,
+                 maxInflight=MQTT_MAX_INFLIGHT, maxQueueLength=MQTT_MAX_QUEUE_LENGTH,
+                 queuePolicy=QUEUE_DROP_OLDEST, port=MQTT_PORT):
+        self.brokerAddress = brokerAddress
+        self.port = port
+        self.qos = qos
+        self.maxInflight = maxInflight
+        self.maxQueueLength = maxQueueLength
+        self.queuePolicy = queuePolicy
+
+        self.client = paho.Client(clientID, protocol=paho.MQTTv31)
+        self.client.username_pw_set(deviceID, deviceSecret)
+        self.client.on_connect = self.__onConnect
+        self.client.on_disconnect = self.__onDisconnect
+        self.client.on_publish = self.__onPublish
+        self.client.on_message = self.__onMessage
+        self.client.on_subscribe = self.__onSubscribe
+        if hasattr(self.client, 'max_inflight_messages_set'):
+            self.client.max_inflight_messages_set(maxInflight)
+
+        # user callbacks
+        self.onConnect = None
+        self.onDisconnect = None
+        self.onMessage = None
+        self.onSubscribe = None
+
+        # the outgoing queue of (topic, payload, qos, retain, queued time)
+        self.queue = collections.deque()
+        self.queueLock = threading.Condition()
+
+        # per topic queue limits and the number of messages queued for each topic
+        self.topicLimits = {}
+        self.topicQueued = {}
+
+        # the (queued time, qos, topic) of each message handed to paho, keyed by mid
+        self.inflight = {}
+        self.inflightLock = threading.Lock()
+        # mids published before paho returned from publish
+        self.earlyPublished = set()
+
+        self.connected = False
+        self.socketOpen = False
+        self.refused = False
+        self.everConnected = False
+        self.connectAttempts = 0
+
+        self.mustExit = False
+        self.exitEvent = threading.Event()
+        self.thread = None
+
+        # publish and stop write a byte here to wake the network thread from select
+        self.wakeReader, self.wakeWriter = socket.socketpair()
+        self.wakeReader.setblocking(False)
+        self.wakeWriter.setblocking(False)
+
+        self.resetMetrics()
+        self.reconnectCount = 0
+
+    def start(self):
+        ''' starts the network thread which connects to the broker '''
+        self.mustExit = False
+        self.exitEvent.clear()
+        self.thread = threading.Thread(target=self.__networkLoop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        ''' stops the network thread and disconnects '''
+        self.mustExit = True
+        self.exitEvent.set()
+        with self.queueLock:
+            self.queueLock.notify_all()
+        self.__wake()
+        if (self.thread != None):
+            self.thread.join()
+            self.thread = None
+        if self.socketOpen:
+            try:
+                self.client.disconnect()
+            except Exception:
+                pass
+            self.socketOpen = False
+        self.connected = False
+
+    def isConnected(self):
+        return self.connected
+
+    def subscribe(self, topic, qos=0):
+        ''' subscribes to topic. Usually called from onConnect so that it is
+        repeated after a reconnect. '''
+        return self.client.subscribe(topic, qos)
+
+    def setTopicLimit(self, topic, maxQueued):
+        ''' limits the number of messages for topic that can wait to be sent.
+        Once maxQueued are waiting, each new message replaces the oldest one
+        for the topic rather than joining the queue. None removes the limit. '''
+        with self.queueLock:
+            if (maxQueued == None):
+                self.topicLimits.pop(topic, None)
+            else:
+                self.topicLimits[topic] = max(1, maxQueued)
+
+    def publish(self, topic, payload, qos=None, retain=False, timeout=None):
+        ''' queues a message for sending. qos defaults to the client's QoS. With
+        QUEUE_BLOCK this waits up to timeout seconds (None = forever) for space.
+        Returns True if the message was queued. '''
+        if (qos == None):
+            qos = self.qos
+        with self.queueLock:
+            limit = self.topicLimits.get(topic)
+            if (limit != None) and (self.topicQueued.get(topic, 0) >= limit):
+                # latest wins - this replaces the oldest message waiting for the topic
+                self.__removeOldest(topic)
+                self.__dropped(topic)
+            elif (len(self.queue) >= self.maxQueueLength):
+                if (self.queuePolicy == QUEUE_BLOCK):
+                    deadline = None if (timeout == None) else time.time() + timeout
+                    while (len(self.queue) >= self.maxQueueLength) and not self.mustExit:
+                        remaining = None if (deadline == None) else deadline - time.time()
+                        if (remaining != None) and (remaining <= 0):
+                            break
+                        self.queueLock.wait(remaining)
+                    if (len(self.queue) >= self.maxQueueLength):
+                        self.__dropped(topic)
+                        return False
+                else:
+                    oldest = self.queue.popleft()
+                    self.__unqueued(oldest[0])
+                    self.__dropped(oldest[0])
+            self.queue.append((topic, payload, qos, retain, time.time()))
+            self.topicQueued[topic] = self.topicQueued.get(topic, 0) + 1
+            self.maxQueueDepth = max(self.maxQueueDepth, len(self.queue))
+        self.__wake()
+        return True
+
+    def __removeOldest(self, topic):
+        # removes the oldest queued message for topic. Called with queueLock held.
+        for index, message in enumerate(self.queue):
+            if (message[0] == topic):
+                del self.queue[index]
+                self.__unqueued(topic)
+                return
+
+    def __unqueued(self, topic):
+        # called with queueLock held when a message leaves the queue
+        count = self.topicQueued[topic] - 1
+        if (count == 0):
+            del self.topicQueued[topic]
+        else:
+            self.topicQueued[topic] = count
+
+    def __dropped(self, topic):
+        self.droppedCount += 1
+        self.topicDropped[topic] = self.topicDropped.get(topic, 0) + 1
+
+    # metrics
+
+    def resetMetrics(self):
+        ''' clears the counters that accumulate (not the reconnect count) '''
+        self.publishedCount = 0
+        self.droppedCount = 0
+        self.topicPublished = {}
+        self.topicDropped = {}
+        self.maxQueueDepth = 0
+        self.latencyTotal = 0.0
+        self.latencyMax = 0.0
+
+    def getQueueDepth(self):
+        return len(self.queue)
+
+    def getMaxQueueDepth(self):
+        return self.maxQueueDepth
+
+    def getInflightCount(self):
+        return len(self.inflight)
+
+    def getPublishedCount(self):
+        return self.publishedCount
+
+    def getDroppedCount(self):
+        return self.droppedCount
+
+    def getTopicPublishedCount(self, topic):
+        return self.topicPublished.get(topic, 0)
+
+    def getTopicDroppedCount(self, topic):
+        return self.topicDropped.get(topic, 0)
+
+    def getTopicQueueDepth(self, topic):
+        return self.topicQueued.get(topic, 0)
+
+    def getReconnectCount(self):
+        return self.reconnectCount
+
+    def getMeanLatency(self):
+        ''' returns the mean time in seconds from publish to sent (QoS 0) or acknowledged '''
+        if (self.publishedCount == 0):
+            return 0.0
+        return self.latencyTotal / self.publishedCount
+
+    def getMaxLatency(self):
+        return self.latencyMax
+
+    def formatMetrics(self):
+        ''' returns a one line summary of the metrics '''
+        return ('published %d, dropped %d, queue %d (max %d), inflight %d, latency %.1fms (max %.1fms), reconnects %d' %
+                (self.publishedCount, self.droppedCount, self.getQueueDepth(), self.maxQueueDepth,
+                 self.getInflightCount(), self.getMeanLatency() * 1000.0, self.latencyMax * 1000.0,
+                 self.reconnectCount))
+
+    # network thread
+
+    def __networkLoop(self):
+        while not self.mustExit:
+            if not self.socketOpen:
+                try:
+                    if self.everConnected:
+                        self.client.reconnect()
+                    else:
+                        self.client.connect(self.brokerAddress, self.port, MQTT_KEEPALIVE)
+                    self.socketOpen = True
+                except Exception:
+                    print ("waiting to connect to broker", self.brokerAddress)
+                    sys.stdout.flush()
+                    self.__backoff()
+                    continue
+
+            if (self.__loop() != paho.MQTT_ERR_SUCCESS) or self.refused:
+                # lost the connection (or it was refused)
+                self.__connectionLost()
+                self.__backoff()
+                continue
+
+    def __loop(self):
+        # one pass of paho's network loop. This waits in select for data from the
+        # broker or a wake up from publish, rather than polling, so an idle client
+        # only wakes every MQTT_LOOP_TIMEOUT seconds to send keepalives.
+        sock = self.client.socket()
+        if (sock == None):
+            return paho.MQTT_ERR_NO_CONN
+        writers = [sock] if self.client.want_write() else []
+        try:
+            readable, writable, exceptional = select.select([sock, self.wakeReader], writers, [],
+                        MQTT_LOOP_TIMEOUT)
+        except (select.error, ValueError):
+            return paho.MQTT_ERR_CONN_LOST
+
+        if self.wakeReader in readable:
+            try:
+                while self.wakeReader.recv(1024):
+                    pass
+            except socket.error:
+                pass
+
+        result = paho.MQTT_ERR_SUCCESS
+        if sock in readable:
+            result = self.client.loop_read()
+        if (result == paho.MQTT_ERR_SUCCESS) and self.connected:
+            self.__sendQueued()
+        if (result == paho.MQTT_ERR_SUCCESS) and self.client.want_write():
+            result = self.client.loop_write()
+        if (result == paho.MQTT_ERR_SUCCESS):
+            result = self.client.loop_misc()
+        return result
+
+    def __wake(self):
+        try:
+            self.wakeWriter.send(b'w')
+        except socket.error:
+            # the socket is full so a wake up is already waiting
+            pass
+
+    def __backoff(self):
+        # waits before the next connect attempt, doubling the delay each time with some jitter
+        delay = min(MQTT_MAX_BACKOFF, MQTT_MIN_BACKOFF * (2 ** min(self.connectAttempts, 16)))
+        self.connectAttempts += 1
+        self.exitEvent.wait(random.uniform(delay / 2.0, delay))
+
+    def __connectionLost(self):
+        if self.socketOpen:
+            try:
+                self.client.disconnect()
+            except Exception:
+                pass
+        self.socketOpen = False
+        self.refused = False
+        self.connected = False
+
+        # QoS 0 messages handed to paho are gone. paho resends QoS 1 and 2 itself.
+        with self.inflightLock:
+            for mid in list(self.inflight.keys()):
+                if (self.inflight[mid][1] == 0):
+                    del self.inflight[mid]
+            self.earlyPublished.clear()
+
+    def __sendQueued(self):
+        while (len(self.inflight) < self.maxInflight):
+            with self.queueLock:
+                if (len(self.queue) == 0):
+                    return
+                message = self.queue.popleft()
+                self.__unqueued(message[0])
+                self.queueLock.notify()
+
+            topic, payload, qos, retain, queuedTime = message
+            result = self.client.publish(topic, payload, qos, retain)
+            rc, mid = result[0], result[1]
+            if (rc != paho.MQTT_ERR_SUCCESS):
+                # put it back to try again after reconnecting
+                with self.queueLock:
+                    self.queue.appendleft(message)
+                    self.topicQueued[topic] = self.topicQueued.get(topic, 0) + 1
+                return
+
+            with self.inflightLock:
+                if mid in self.earlyPublished:
+                    self.earlyPublished.discard(mid)
+                    self.__published(queuedTime, topic)
+                else:
+                    self.inflight[mid] = (queuedTime, qos, topic)
+
+    def __published(self, queuedTime, topic):
+        latency = time.time() - queuedTime
+        self.publishedCount += 1
+        self.topicPublished[topic] = self.topicPublished.get(topic, 0) + 1
+        self.latencyTotal += latency
+        self.latencyMax = max(self.latencyMax, latency)
+
+    # paho callbacks
+
+    def __onConnect(self, client, userdata, *args):
+        # paho versions differ in whether flags are passed but the result code is always last
+        code = args[-1]
+        if (code == 0):
+            self.connected = True
+            if self.everConnected:
+                self.reconnectCount += 1
+            self.everConnected = True
+            self.connectAttempts = 0
+        else:
+            # refused - the network loop will back off and try again
+            self.refused = True
+        if (self.onConnect != None):
+            self.onConnect(client, userdata, code)
+
+    def __onDisconnect(self, client, userdata, *args):
+        self.connected = False
+        if (self.onDisconnect != None):
+            self.onDisconnect(client, userdata, args[-1] if (len(args) > 0) else 0)
+
+    def __onPublish(self, client, userdata, mid):
+        with self.inflightLock:
+            message = self.inflight.pop(mid, None)
+            if (message == None):
+                # called from inside publish before the mid was recorded
+                self.earlyPublished.add(mid)
+                return
+            self.__published(message[0], message[2])
+
+    def __onMessage(self, client, userdata, message):
+        if (self.onMessage != None):
+            self.onMessage(client, userdata, message)
+
+    def __onSubscribe(self, client, userdata, mid, grantedQos, *args):
+        if (self.onSubscribe != None):
+            self.onSubscribe(client, userdata, mid, grantedQos)
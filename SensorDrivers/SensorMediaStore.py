@@ -0,0 +1,501 @@
+#!/usr/bin/python
+"""
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015-2016, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+# Disk store for recorded topics. Each topic has its own directory of segments
+# and a file holding the topic's name. A segment is a pair of files named after
+# the timestamp (in mS) of its first record:
+#
+#   <start>.mjpg    video topics: the JPEG frames exactly as received, one after the other
+#   <start>.msg     other topics: the MQTT payloads exactly as received
+#   <start>.idx     the index of the records in the .mjpg or .msg file
+#
+# The .mjpg file is a plain MJPEG stream that most players will open directly.
+# A new segment is started when the current one reaches the segment size.
+#
+# Index layout (little endian):
+#
+#   magic        4 bytes     'RTVI'
+#   version      uint8       index version
+#   pad          3 bytes
+#
+# followed by one fixed size record per frame or message:
+#
+#   timestamp    double      frame timestamp (the arrival time for messages)
+#   offset       uint32      offset of the record in the data file
+#   length       uint32      record length
+#   width        uint16      frame width (0 for messages)
+#   height       uint16      frame height (0 for messages)
+#   rate         uint16      frame rate (0 for messages)
+#
+# Records are in timestamp order so readers can binary search the memory mapped
+# index rather than scan the data. Data is always written before the index
+# records that refer to it, and readers ignore records that point past the end
+# of the data file, so a segment cut short by a crash or power loss is still
+# readable up to the last complete record.
+
+import bisect
+import collections
+import mmap
+import os
+import struct
+import threading
+import time
+
+STORE_INDEX_MAGIC = 'RTVI'
+STORE_INDEX_VERSION = 1
+
+STORE_INDEX_HEADER = struct.Struct('<4sB3x')
+STORE_INDEX_RECORD = struct.Struct('<dIIHHH')
+
+VIDEO_DATA_SUFFIX = '.mjpg'
+MESSAGE_DATA_SUFFIX = '.msg'
+STORE_INDEX_SUFFIX = '.idx'
+
+STORE_TOPIC_FILE = 'topic'
+
+STORE_SEGMENT_BYTES = 64 * 1024 * 1024              # size at which a new segment is started
+
+# Records are gathered in memory and written in batches. Small scattered writes
+# are slow on SD cards and wear them out.
+
+STORE_FLUSH_BYTES = 1024 * 1024                     # write once this much is waiting...
+STORE_FLUSH_INTERVAL = 1.0                          # ...or this many seconds have passed
+STORE_SYNC_INTERVAL = 5.0                           # how often written data is fsync'd
+
+# If the disk can't keep up, the oldest frames waiting to be written are dropped
+# once this much is waiting so that memory use stays bounded.
+
+STORE_MAX_PENDING_BYTES = 32 * 1024 * 1024
+
+def topicDirectory(rootDir, topic):
+    ''' returns the directory used for a topic's segments '''
+    return os.path.join(rootDir, topic.replace('/', '_'))
+
+def readTopic(directory):
+    ''' returns the topic recorded in directory '''
+    try:
+        with open(os.path.join(directory, STORE_TOPIC_FILE), 'r') as topicFile:
+            return topicFile.read().strip()
+    except IOError:
+        # recorded before the topic was saved. This is right unless the topic has a _ in it.
+        return os.path.basename(directory.rstrip(os.sep)).replace('_', '/')
+
+def listTopics(rootDir):
+    ''' returns the (topic, directory) of every topic recorded under rootDir '''
+    topics = []
+    if not os.path.isdir(rootDir):
+        return topics
+    for directoryName in sorted(os.listdir(rootDir)):
+        directory = os.path.join(rootDir, directoryName)
+        if os.path.isdir(directory):
+            topics.append((readTopic(directory), directory))
+    return topics
+
+def indexPath(dataPath):
+    ''' returns the path of the index for the data file dataPath '''
+    return os.path.splitext(dataPath)[0] + STORE_INDEX_SUFFIX
+
+def listSegments(directory):
+    ''' returns the (start time, data file path) of each segment in directory,
+    oldest first '''
+    segments = []
+    if not os.path.isdir(directory):
+        return segments
+    for fileName in os.listdir(directory):
+        name, suffix = os.path.splitext(fileName)
+        if suffix not in (VIDEO_DATA_SUFFIX, MESSAGE_DATA_SUFFIX):
+            continue
+        try:
+            startTime = int(name) / 1000.0
+        except ValueError:
+            continue
+        segments.append((startTime, os.path.join(directory, fileName)))
+    segments.sort()
+    return segments
+
+def enforceRetention(rootDir, maxAge=0, maxBytes=0, exclude=()):
+    ''' deletes the oldest segments under rootDir, from every topic, until none is
+    older than maxAge seconds and the total size is no more than maxBytes (0 = no
+    limit). Segments in exclude (ie being written) are never deleted. Returns the
+    number of bytes removed. '''
+    segments = []
+    totalBytes = 0
+    if not os.path.isdir(rootDir):
+        return 0
+    for directoryName in os.listdir(rootDir):
+        directory = os.path.join(rootDir, directoryName)
+        for startTime, path in listSegments(directory):
+            try:
+                size = os.path.getsize(path)
+                modified = os.path.getmtime(path)
+                if os.path.exists(indexPath(path)):
+                    size += os.path.getsize(indexPath(path))
+            except OSError:
+                continue
+            totalBytes += size
+            if path not in exclude:
+                # the modification time is when the last frame was written
+                segments.append((modified, path, size))
+
+    segments.sort()
+    removedBytes = 0
+    now = time.time()
+    for modified, path, size in segments:
+        if not (((maxAge > 0) and ((now - modified) > maxAge)) or
+                ((maxBytes > 0) and (totalBytes > maxBytes))):
+            break
+        for segmentPath in (path, indexPath(path)):
+            try:
+                os.remove(segmentPath)
+            except OSError:
+                pass
+        totalBytes -= size
+        removedBytes += size
+    return removedBytes
+
+def exportClip(directory, startTime, endTime, outputPath):
+    ''' writes the frames of a topic from startTime to endTime to outputPath as an
+    MJPEG file. The frames are copied as recorded. Returns the number of frames. '''
+    reader = SensorMediaReader(directory)
+    count = 0
+    with open(outputPath, 'wb') as outputFile:
+        for timestamp, width, height, rate, frame in reader.frames(startTime, endTime):
+            outputFile.write(frame)
+            count += 1
+    return count
+
+
+class SensorMediaWriter():
+    ''' Appends the JPEG frames (or MQTT payloads) of one topic to size rotated
+    segments. append can be called from any thread. flush does the actual writing
+    and should be called regularly from one thread. '''
+
+    def __init__(self, directory, topic, segmentBytes=STORE_SEGMENT_BYTES, dataSuffix=VIDEO_DATA_SUFFIX):
+        self.directory = directory
+        self.segmentBytes = segmentBytes
+        self.dataSuffix = dataSuffix
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, STORE_TOPIC_FILE), 'w') as topicFile:
+            topicFile.write(topic + '\n')
+
+        # frames waiting to be written
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.pendingBytes = 0
+
+        # the segment being written
+        self.path = None
+        self.dataFile = None
+        self.indexFile = None
+        self.dataSize = 0
+        self.lastTimestamp = 0
+
+        self.lastFlushTime = time.time()
+        self.lastSyncTime = time.time()
+
+        # counters
+        self.frameCount = 0
+        self.byteCount = 0
+        self.segmentCount = 0
+
+    def append(self, timestamp, width, height, rate, frame):
+        ''' queues a frame to be written. frame is the JPEG data or the message
+        payload (with zero width, height and rate). Returns the number of older
+        frames dropped because more than STORE_MAX_PENDING_BYTES was waiting. '''
+        frame = bytes(frame)
+        droppedCount = 0
+        with self.lock:
+            self.pending.append((timestamp, width, height, rate, frame))
+            self.pendingBytes += len(frame)
+            while (self.pendingBytes > STORE_MAX_PENDING_BYTES) and (len(self.pending) > 1):
+                self.pendingBytes -= len(self.pending.popleft()[4])
+                droppedCount += 1
+        return droppedCount
+
+    def flush(self, force=False):
+        ''' writes the waiting frames if enough have built up or it is time to,
+        and fsyncs the segment every STORE_SYNC_INTERVAL seconds. force writes
+        and syncs everything now. '''
+        now = time.time()
+        with self.lock:
+            if not (force or (self.pendingBytes >= STORE_FLUSH_BYTES) or
+                    ((now - self.lastFlushTime) >= STORE_FLUSH_INTERVAL)):
+                return
+            pending = self.pending
+            self.pending = collections.deque()
+            self.pendingBytes = 0
+        self.lastFlushTime = now
+
+        data = []
+        index = []
+        for timestamp, width, height, rate, frame in pending:
+            if (self.dataFile == None) or ((self.dataSize > 0) and
+                    ((self.dataSize + len(frame)) > self.segmentBytes)):
+                self.__write(data, index)
+                data = []
+                index = []
+                self.__newSegment(timestamp)
+
+            # the index must stay in order for searching so a timestamp that goes
+            # backwards (eg the camera's clock was reset) is recorded as the last one
+            self.lastTimestamp = max(timestamp, self.lastTimestamp)
+            index.append(STORE_INDEX_RECORD.pack(self.lastTimestamp, self.dataSize,
+                            len(frame), width, height, rate))
+            data.append(frame)
+            self.dataSize += len(frame)
+            self.frameCount += 1
+            self.byteCount += len(frame)
+        self.__write(data, index)
+
+        if force or ((now - self.lastSyncTime) >= STORE_SYNC_INTERVAL):
+            self.__sync()
+            self.lastSyncTime = now
+
+    def close(self):
+        self.flush(True)
+        self.__closeSegment()
+
+    def getPath(self):
+        ''' returns the data file path of the segment being written '''
+        return self.path
+
+    def getFrameCount(self):
+        return self.frameCount
+
+    def getByteCount(self):
+        return self.byteCount
+
+    def getSegmentCount(self):
+        return self.segmentCount
+
+    def __write(self, data, index):
+        # the frames go to the OS first so that the index never gets ahead of them
+        if (len(data) == 0):
+            return
+        self.dataFile.write(b''.join(data))
+        self.dataFile.flush()
+        self.indexFile.write(b''.join(index))
+        self.indexFile.flush()
+
+    def __sync(self):
+        if (self.dataFile == None):
+            return
+        os.fsync(self.dataFile.fileno())
+        os.fsync(self.indexFile.fileno())
+
+    def __newSegment(self, timestamp):
+        self.__closeSegment()
+        self.path = os.path.join(self.directory, '%015d%s' % (int(timestamp * 1000), self.dataSuffix))
+
+        # carry on with the segment if one already has this name (eg after a restart)
+        self.dataFile = open(self.path, 'ab')
+        self.indexFile = open(indexPath(self.path), 'ab')
+        self.dataSize = self.dataFile.tell()
+        if (self.indexFile.tell() == 0):
+            self.indexFile.write(STORE_INDEX_HEADER.pack(STORE_INDEX_MAGIC, STORE_INDEX_VERSION))
+        self.segmentCount += 1
+
+    def __closeSegment(self):
+        if (self.dataFile == None):
+            return
+        self.__sync()
+        self.dataFile.close()
+        self.indexFile.close()
+        self.dataFile = None
+        self.indexFile = None
+
+
+class SensorMediaSegment():
+    ''' Read access to one segment through memory maps of its files. Only the frames
+    written when the segment was opened are visible. '''
+
+    def __init__(self, path):
+        self.path = path
+        self.indexMap = None
+        self.dataMap = None
+        self.count = 0
+
+        with open(indexPath(path), 'rb') as indexFile:
+            indexSize = os.fstat(indexFile.fileno()).st_size
+            if (indexSize < STORE_INDEX_HEADER.size):
+                raise ValueError('video index too short')
+            # the mapping stays valid after the file is closed
+            self.indexMap = mmap.mmap(indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = STORE_INDEX_HEADER.unpack_from(self.indexMap)
+        if (magic != STORE_INDEX_MAGIC) or (version != STORE_INDEX_VERSION):
+            self.close()
+            raise ValueError('not a media index')
+
+        with open(path, 'rb') as dataFile:
+            dataSize = os.fstat(dataFile.fileno()).st_size
+            if (dataSize > 0):
+                self.dataMap = mmap.mmap(dataFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # ignore a partly written index record and any that refer to missing frames
+        self.count = (indexSize - STORE_INDEX_HEADER.size) // STORE_INDEX_RECORD.size
+        while (self.count > 0):
+            timestamp, offset, length, width, height, rate = self.getRecord(self.count - 1)
+            if ((offset + length) <= dataSize):
+                break
+            self.count -= 1
+
+    def close(self):
+        if (self.indexMap != None):
+            self.indexMap.close()
+            self.indexMap = None
+        if (self.dataMap != None):
+            self.dataMap.close()
+            self.dataMap = None
+
+    def getCount(self):
+        return self.count
+
+    def getRecord(self, frameIndex):
+        ''' returns the (timestamp, offset, length, width, height, rate) of a frame '''
+        return STORE_INDEX_RECORD.unpack_from(self.indexMap,
+                    STORE_INDEX_HEADER.size + frameIndex * STORE_INDEX_RECORD.size)
+
+    def getTimestamp(self, frameIndex):
+        return struct.unpack_from('<d', self.indexMap,
+                    STORE_INDEX_HEADER.size + frameIndex * STORE_INDEX_RECORD.size)[0]
+
+    def getFrame(self, frameIndex):
+        ''' returns the (timestamp, width, height, rate, jpeg) of a frame '''
+        timestamp, offset, length, width, height, rate = self.getRecord(frameIndex)
+
+        # empty MQTT payloads (eg clearing a retained message) have no data and a
+        # segment holding only those has an empty data file that can't be mapped
+        if (length == 0) or (self.dataMap == None):
+            return (timestamp, width, height, rate, b'')
+        return (timestamp, width, height, rate, self.dataMap[offset:offset + length])
+
+    def find(self, timestamp):
+        ''' returns the index of the first frame at or after timestamp '''
+        low = 0
+        high = self.count
+        while (low < high):
+            middle = (low + high) // 2
+            if (self.getTimestamp(middle) < timestamp):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+class SensorMediaReader():
+    ''' Reads the frames (or messages) of one topic's segments in time order '''
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def getSegments(self):
+        return listSegments(self.directory)
+
+    def isVideo(self):
+        ''' returns True if the segments hold video frames rather than messages '''
+        segments = self.getSegments()
+        return (len(segments) > 0) and segments[0][1].endswith(VIDEO_DATA_SUFFIX)
+
+    def getTimeRange(self):
+        ''' returns the (first, last) frame timestamps or None if there are no frames '''
+        first = None
+        last = None
+        for startTime, path in self.getSegments():
+            try:
+                segment = SensorMediaSegment(path)
+            except (ValueError, IOError, OSError, mmap.error):
+                continue
+            if (segment.getCount() > 0):
+                if (first == None):
+                    first = segment.getTimestamp(0)
+                last = segment.getTimestamp(segment.getCount() - 1)
+            segment.close()
+        if (first == None):
+            return None
+        return (first, last)
+
+    def frames(self, startTime=None, endTime=None):
+        ''' generates the (timestamp, width, height, rate, jpeg) of each frame from
+        startTime up to endTime (None = no limit). Only one segment is open at a time. '''
+        segments = self.getSegments()
+        first = 0
+        if (startTime != None):
+            # the last segment starting at or before startTime holds the first frame
+            first = max(0, bisect.bisect_right([start for start, path in segments], startTime) - 1)
+
+        for segmentStart, path in segments[first:]:
+            if (endTime != None) and (segmentStart > endTime):
+                break
+            try:
+                segment = SensorMediaSegment(path)
+            except (ValueError, IOError, OSError, mmap.error):
+                print ("Skipping bad media segment", path)
+                continue
+            try:
+                frameIndex = 0
+                if (startTime != None):
+                    frameIndex = segment.find(startTime)
+                while (frameIndex < segment.getCount()):
+                    frame = segment.getFrame(frameIndex)
+                    if (endTime != None) and (frame[0] > endTime):
+                        return
+                    yield frame
+                    frameIndex += 1
+            finally:
+                segment.close()
+
+if __name__ == '__main__':
+    # round trip check of video frames and of messages, including segments that
+    # hold only empty payloads
+    import shutil
+    import tempfile
+
+    rootDir = tempfile.mkdtemp()
+    try:
+        for topic, dataSuffix, records in (
+                ('camera/video', VIDEO_DATA_SUFFIX,
+                    [(100.0 + i, 320, 240, 15, b'\xff\xd8' + b'x' * i + b'\xff\xd9') for i in range(0, 50)]),
+                ('device/sensors', MESSAGE_DATA_SUFFIX,
+                    [(200.0 + i, 0, 0, 0, (b'{}' if (i % 3) else b'')) for i in range(0, 50)]),
+                ('device/status', MESSAGE_DATA_SUFFIX, [(5.0, 0, 0, 0, b'')]),
+                ('device/retained', MESSAGE_DATA_SUFFIX, [(6.0 + i, 0, 0, 0, b'') for i in range(0, 3)])):
+            directory = topicDirectory(rootDir, topic)
+            # small segments so that the records are spread over several of them
+            writer = SensorMediaWriter(directory, topic, 64, dataSuffix)
+            for record in records:
+                writer.append(*record)
+                writer.flush(True)
+            writer.close()
+            readBack = list(SensorMediaReader(directory).frames())
+            print ('%s: %d records written, %d read in %d segments' %
+                    (topic, len(records), len(readBack), len(listSegments(directory))))
+            assert readBack == records
+    finally:
+        shutil.rmtree(rootDir)
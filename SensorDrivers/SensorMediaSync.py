@@ -0,0 +1,307 @@
+#!/usr/bin/python
+"""
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015-2016, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+# Playout of audio and video streams against a common presentation clock.
+#
+# Each stream has a SensorJitterBuffer that holds its media in source timestamp
+# order. When audio is playing, the presentation clock is the source time of
+# the sample currently being heard, so video is locked to the audio. Otherwise
+# the clock follows the local time: the local time minus the smallest transit
+# delay seen recently (an estimate of the offset between the source and local
+# clocks), less the target latency.
+#
+# SensorAudioPlayer plays audio through a PortAudio callback so that nothing
+# else ever waits for the audio device. It starts playing once the target
+# latency has been buffered. If the buffer runs dry, it plays silence, refills
+# to the target and raises the target. If too much builds up, it discards the
+# oldest audio. The target is slowly reduced again while there are no underruns.
+
+import heapq
+import itertools
+import threading
+import time
+
+import pyaudio
+
+MEDIA_CLOCK_AUDIO_TIMEOUT = 0.5             # audio anchors older than this aren't used
+MEDIA_CLOCK_OFFSET_WINDOW = 10.0            # seconds over which the smallest delay is found
+
+AUDIO_MAX_LATENCY = 2.0                     # the most the audio target can grow to
+AUDIO_TRIM_FACTOR = 2.0                     # trim when more than this times the target is buffered
+AUDIO_UNDERRUN_GROWTH = 1.5                 # the target is multiplied by this after an underrun
+AUDIO_SHRINK_INTERVAL = 10.0                # seconds without underruns before the target is reduced
+AUDIO_SHRINK_FACTOR = 0.9
+
+class SensorJitterBuffer():
+    ''' Holds media items in timestamp order. Each item can have a duration so that
+    the amount of buffered media is known. Safe to use from more than one thread. '''
+
+    def __init__(self, maxLength):
+        self.maxLength = maxLength
+        self.heap = []
+        self.lock = threading.Lock()
+        # breaks ties between items with the same timestamp so they stay in arrival order
+        self.counter = itertools.count()
+        self.duration = 0.0
+        self.droppedCount = 0
+
+    def put(self, timestamp, item, duration=0.0):
+        ''' adds an item. If the buffer is full the oldest item is discarded. '''
+        with self.lock:
+            if (len(self.heap) >= self.maxLength):
+                self.__pop()
+                self.droppedCount += 1
+            heapq.heappush(self.heap, (timestamp, next(self.counter), item, duration))
+            self.duration += duration
+
+    def pop(self):
+        ''' removes the oldest item. Returns (timestamp, item) or None if empty. '''
+        with self.lock:
+            if (len(self.heap) == 0):
+                return None
+            return self.__pop()
+
+    def popUntil(self, timestamp):
+        ''' removes all the items up to and including timestamp. Returns a list of
+        (timestamp, item), oldest first. '''
+        items = []
+        with self.lock:
+            while (len(self.heap) > 0) and (self.heap[0][0] <= timestamp):
+                items.append(self.__pop())
+        return items
+
+    def __pop(self):
+        timestamp, count, item, duration = heapq.heappop(self.heap)
+        self.duration -= duration
+        if (len(self.heap) == 0):
+            # stop rounding errors accumulating
+            self.duration = 0.0
+        return (timestamp, item)
+
+    def peekTimestamp(self):
+        ''' returns the oldest timestamp or None if empty '''
+        heap = self.heap
+        if (len(heap) == 0):
+            return None
+        return heap[0][0]
+
+    def clear(self):
+        with self.lock:
+            self.heap = []
+            self.duration = 0.0
+
+    def getDepth(self):
+        return len(self.heap)
+
+    def getDuration(self):
+        ''' returns the total duration of the buffered items in seconds '''
+        return self.duration
+
+    def getDroppedCount(self):
+        return self.droppedCount
+
+
+class SensorMediaClock():
+    ''' The presentation clock, in source time '''
+
+    def __init__(self, targetLatency):
+        self.targetLatency = targetLatency
+
+        # (source time, local time) of the audio sample most recently given to the device
+        self.audioAnchor = None
+
+        # the smallest (arrival time - timestamp) seen in the last window and in this one
+        self.offset = None
+        self.windowOffset = None
+        self.windowStart = time.time()
+
+    def arrived(self, timestamp):
+        ''' called with the timestamp of every message as it arrives '''
+        now = time.time()
+        delay = now - timestamp
+        if (self.windowOffset == None) or (delay < self.windowOffset):
+            self.windowOffset = delay
+        if (self.offset == None) or (delay < self.offset):
+            self.offset = delay
+        if ((now - self.windowStart) >= MEDIA_CLOCK_OFFSET_WINDOW):
+            # start a new window so the estimate can follow clock drift upwards
+            self.offset = self.windowOffset
+            self.windowOffset = None
+            self.windowStart = now
+
+    def setAudioAnchor(self, sourceTime, localTime):
+        ''' called by the audio player: the sample with sourceTime will be heard at localTime '''
+        self.audioAnchor = (sourceTime, localTime)
+
+    def isAudioDriven(self):
+        anchor = self.audioAnchor
+        return (anchor != None) and ((time.time() - anchor[1]) < MEDIA_CLOCK_AUDIO_TIMEOUT)
+
+    def now(self):
+        ''' returns the current presentation time or None if nothing has arrived yet '''
+        now = time.time()
+        anchor = self.audioAnchor
+        if (anchor != None) and ((now - anchor[1]) < MEDIA_CLOCK_AUDIO_TIMEOUT):
+            return anchor[0] + (now - anchor[1])
+        if (self.offset == None):
+            return None
+        return now - self.offset - self.targetLatency
+
+
+class SensorAudioPlayer():
+    ''' Plays int16 PCM from a jitter buffer and drives a SensorMediaClock '''
+
+    def __init__(self, audioDevice, clock, targetLatency, maxLength=1000):
+        self.audioDevice = audioDevice
+        self.clock = clock
+        self.minTarget = targetLatency
+        self.target = targetLatency
+        self.buffer = SensorJitterBuffer(maxLength)
+
+        self.stream = None
+        self.rate = 0
+        self.channels = 0
+        self.frameBytes = 0
+        self.outputLatency = 0.0
+
+        # the chunk being played, its source time and how much of it has been played
+        self.pending = None
+        self.pendingTime = 0
+        self.pendingOffset = 0
+
+        self.prefilling = True
+        self.lastUnderrunTime = time.time()
+        self.lastShrinkTime = time.time()
+
+        self.underrunCount = 0
+        self.trimmedCount = 0
+        self.playedCount = 0
+
+    def put(self, timestamp, samples, rate, channels):
+        ''' queues samples that were captured at timestamp. The output is (re)opened
+        if the sample rate or number of channels changes. '''
+        if (self.stream == None) or (rate != self.rate) or (channels != self.channels):
+            self.__open(rate, channels)
+        duration = float(len(samples)) / (self.frameBytes * self.rate)
+        self.buffer.put(timestamp, samples, duration)
+
+    def close(self):
+        if (self.stream != None):
+            try:
+                self.stream.stop_stream()
+                self.stream.close()
+            except Exception:
+                pass
+            self.stream = None
+
+    def getTarget(self):
+        return self.target
+
+    def getBufferedTime(self):
+        return self.buffer.getDuration()
+
+    def getUnderrunCount(self):
+        return self.underrunCount
+
+    def getTrimmedCount(self):
+        return self.trimmedCount + self.buffer.getDroppedCount()
+
+    def __open(self, rate, channels):
+        self.close()
+        self.rate = rate
+        self.channels = channels
+        self.frameBytes = 2 * channels
+        self.buffer.clear()
+        self.pending = None
+        self.prefilling = True
+        self.stream = self.audioDevice.open(format=pyaudio.paInt16, channels=channels,
+                        rate=rate, output=True, stream_callback=self.__callback)
+        self.outputLatency = self.stream.get_output_latency()
+
+    def __callback(self, inData, frameCount, timeInfo, status):
+        # runs in PortAudio's thread. Must not block.
+        need = frameCount * self.frameBytes
+        silence = b'\x00' * need
+        now = time.time()
+
+        if self.prefilling:
+            if (self.buffer.getDuration() < self.target):
+                return (silence, pyaudio.paContinue)
+            self.prefilling = False
+
+        self.__adjustTarget(now)
+
+        # don't let the latency build up
+        while (self.buffer.getDuration() > self.target * AUDIO_TRIM_FACTOR):
+            self.buffer.pop()
+            self.trimmedCount += 1
+
+        chunks = []
+        filled = 0
+        firstTime = None
+        while (filled < need):
+            if (self.pending == None):
+                item = self.buffer.pop()
+                if (item == None):
+                    # ran dry - play silence and wait for the buffer to refill
+                    self.underrunCount += 1
+                    self.lastUnderrunTime = now
+                    self.target = min(self.target * AUDIO_UNDERRUN_GROWTH, AUDIO_MAX_LATENCY)
+                    self.prefilling = True
+                    chunks.append(silence[filled:])
+                    break
+                self.pendingTime, self.pending = item
+                self.pendingOffset = 0
+
+            if (firstTime == None):
+                firstTime = self.pendingTime + float(self.pendingOffset) / (self.frameBytes * self.rate)
+
+            take = min(need - filled, len(self.pending) - self.pendingOffset)
+            chunks.append(self.pending[self.pendingOffset:self.pendingOffset + take])
+            filled += take
+            self.pendingOffset += take
+            if (self.pendingOffset >= len(self.pending)):
+                self.pending = None
+
+        if (firstTime != None):
+            # this buffer will be heard after the output latency
+            latency = timeInfo.get('output_buffer_dac_time', 0) - timeInfo.get('current_time', 0)
+            if (latency <= 0) or (latency > 1.0):
+                # not all host APIs report the times
+                latency = self.outputLatency
+            self.clock.setAudioAnchor(firstTime, now + latency)
+            self.playedCount += 1
+
+        return (b''.join(chunks), pyaudio.paContinue)
+
+    def __adjustTarget(self, now):
+        # gradually reduces the target latency while there are no underruns
+        if ((now - self.lastUnderrunTime) < AUDIO_SHRINK_INTERVAL):
+            return
+        if ((now - self.lastShrinkTime) < AUDIO_SHRINK_INTERVAL):
+            return
+        self.lastShrinkTime = now
+        self.target = max(self.minTarget, self.target * AUDIO_SHRINK_FACTOR)
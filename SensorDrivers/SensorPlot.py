@@ -24,113 +24,219 @@
 //  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import sys
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 
 import SensorRecords
 
+# The subplots in each figure. Each entry is the title, the y axis limits and
+# the lines as (sensor record index, line style, legend format). The first
+# line in each subplot determines whether there is valid data.
+
+SENSOR_SUBPLOTS = (
+    ('Accelerometer data', (-2, 2),
+        ((SensorRecords.SENSOR_RECORD_ACCEL_X, 'b-', 'Accel X (%.2fg)'),
+         (SensorRecords.SENSOR_RECORD_ACCEL_Y, 'r-', 'Accel Y(%.2fg)'),
+         (SensorRecords.SENSOR_RECORD_ACCEL_Z, 'g-', 'Accel Z(%.2fg)'))),
+    ('Light intensity data', (0, 1500),
+        ((SensorRecords.SENSOR_RECORD_LIGHT, 'b-', 'Light (%.2f lux)'),)),
+    ('Temperature data', (-50, 150),
+        ((SensorRecords.SENSOR_RECORD_TEMPERATURE, 'b-', 'Temperature (%.2f deg C)'),)),
+    ('Pressure data', (800, 1200),
+        ((SensorRecords.SENSOR_RECORD_PRESSURE, 'b-', 'Pressure (%.2f hPa)'),)),
+    ('Humidity data', (0, 100),
+        ((SensorRecords.SENSOR_RECORD_HUMIDITY, 'b-', 'Humidity (%.2f %%RH)'),)),
+)
+
+NO_DATA_LABELS = ['No data']
+
+class SensorPlotFigure():
+    ''' The figure for one sensor. The artists are created once and then
+    updated in place. If the canvas supports it, only the lines and legends
+    are redrawn and blitted over a saved background. '''
+
+    def __init__(self, figNumber, xAxis, plotWindow, useBlit):
+        self.plotWindow = plotWindow
+        self.fig, self.axarr = plt.subplots(len(SENSOR_SUBPLOTS), sharex = True, num = figNumber + 1)
+        self.fig.subplots_adjust(hspace = 0.5)
+        self.fig.set_size_inches(8, 10, forward=True)
+
+        self.useBlit = useBlit and hasattr(self.fig.canvas, 'copy_from_bbox')
+
+        # topicName is used to update the window title when the sensor changes
+        self.topicName = None
+
+        # the background without lines or legends and the background with legends
+        self.background = None
+        self.legendBackground = None
+
+        # dirty is set when the background must be recaptured
+        self.dirty = True
+
+        # legendChanged is set when the legends need to be redrawn
+        self.legendChanged = True
+
+        # per subplot lists of (line, [min line, max line]) and legend state
+        self.lines = []
+        self.legends = []
+        self.labels = []
+
+        emptyData = np.zeros(len(xAxis))
+
+        for axis, (title, ylim, series) in zip(self.axarr, SENSOR_SUBPLOTS):
+            axis.set_ylim(ylim[0], ylim[1])
+            axis.set_title(title)
+            lines = []
+            for recordIndex, style, labelFormat in series:
+                line, = axis.plot(xAxis, emptyData, style, animated = self.useBlit)
+                bands = []
+                if (self.plotWindow != None):
+                    # the min and max are shown as faint lines either side of the mean
+                    for i in range(0, 2):
+                        band, = axis.plot(xAxis, emptyData, style, linewidth = 0.5, alpha = 0.4,
+                                        animated = self.useBlit)
+                        bands.append(band)
+                lines.append((line, bands))
+            self.lines.append(lines)
+            self.legends.append(None)
+            self.labels.append(None)
+
+        if (self.plotWindow != None):
+            self.axarr[0].set_xlim(-self.plotWindow, 0)
+        else:
+            self.axarr[0].set_xlim(xAxis[0], xAxis[-1])
+
+        # any full redraw (eg a resize) invalidates the saved backgrounds
+        self.fig.canvas.mpl_connect('draw_event', self.__onDraw)
+
+    def close(self):
+        plt.close(self.fig)
+
+    def update(self, sensor):
+        ''' updates the artists from sensor and redraws the figure '''
+        self.updateArtists(sensor)
+        self.__draw()
+
+    def updateArtists(self, sensor):
+        ''' updates the artists from sensor without drawing anything '''
+        if (sensor.getTopicName() != self.topicName):
+            self.topicName = sensor.getTopicName()
+            if (self.fig.canvas.manager != None):
+                self.fig.canvas.manager.set_window_title(self.topicName)
+
+        for subplot in range(0, len(SENSOR_SUBPLOTS)):
+            title, ylim, series = SENSOR_SUBPLOTS[subplot]
+            valid = sensor.getDataValid(series[0][0])
+            labels = []
+            for lineIndex in range(0, len(series)):
+                recordIndex, style, labelFormat = series[lineIndex]
+                line, bands = self.lines[subplot][lineIndex]
+
+                # without data only the first line is shown
+                visible = valid or (lineIndex == 0)
+                line.set_visible(visible)
+                for band in bands:
+                    band.set_visible(visible)
+                if (visible):
+                    self.__updateLine(sensor, recordIndex, line, bands)
+                if (valid):
+                    labels.append(labelFormat % sensor.getCurrentData(recordIndex))
+
+            if (not valid):
+                labels = NO_DATA_LABELS
+            self.__updateLegend(subplot, labels)
+
+    def __updateLine(self, sensor, recordIndex, line, bands):
+        if (self.plotWindow == None):
+            line.set_ydata(sensor.getData(recordIndex))
+            return
+
+        rollup = sensor.queryRollup(recordIndex, self.plotWindow)
+        if (rollup == None):
+            # no data for this sensor yet
+            line.set_data([], [])
+            for band in bands:
+                band.set_data([], [])
+            return
+
+        times, minData, maxData, meanData, count = rollup
+        line.set_data(times, meanData)
+        bands[0].set_data(times, minData)
+        bands[1].set_data(times, maxData)
+
+    def __updateLegend(self, subplot, labels):
+        # the legend is only touched if the text has changed
+        if (labels == self.labels[subplot]):
+            return
+
+        if ((self.labels[subplot] == None) or (len(labels) != len(self.labels[subplot]))):
+            # the number of entries has changed so the legend has to be rebuilt
+            handles = [self.lines[subplot][i][0] for i in range(0, len(labels))]
+            legend = self.axarr[subplot].legend(handles, labels, loc='upper center',
+                                    shadow=True, fontsize='x-small')
+            legend.set_animated(self.useBlit)
+            self.legends[subplot] = legend
+        else:
+            for text, label in zip(self.legends[subplot].get_texts(), labels):
+                text.set_text(label)
+
+        self.labels[subplot] = labels
+        self.legendChanged = True
+
+    def __draw(self):
+        canvas = self.fig.canvas
+
+        if (not self.useBlit):
+            canvas.draw_idle()
+            return
+
+        if (self.dirty):
+            # draw everything that isn't animated and save it
+            canvas.draw()
+            self.background = canvas.copy_from_bbox(self.fig.bbox)
+            self.dirty = False
+            self.legendChanged = True
+
+        if (self.legendChanged):
+            # add the legends to the background and save that too
+            canvas.restore_region(self.background)
+            for axis, legend in zip(self.axarr, self.legends):
+                if (legend != None):
+                    axis.draw_artist(legend)
+            self.legendBackground = canvas.copy_from_bbox(self.fig.bbox)
+            self.legendChanged = False
+        else:
+            canvas.restore_region(self.legendBackground)
+
+        for axis, lines in zip(self.axarr, self.lines):
+            for line, bands in lines:
+                for artist in [line] + bands:
+                    if (artist.get_visible()):
+                        axis.draw_artist(artist)
+
+        canvas.blit(self.fig.bbox)
+
+    def __onDraw(self, event):
+        self.dirty = True
+
 class SensorPlot():
     
     # this is used to provide the x axis data for the plots
     xAxis = np.arange(-SensorRecords.SENSOR_RECORD_LENGTH, 0, 1)
     
-    # this list contains the active figures (one per sensor)
-    figures = []
-    
-    # this list contains the axis data for each figure
-    axes = []
-    
-    def __doPlot(self, figNumber, sensor):
-        if (figNumber > len(self.figures)):
-            return
-        
-        if (figNumber == len(self.figures)):
-            # need to add a figure
-            fig, axarr = plt.subplots(5, sharex = True)
-            self.figures.append(fig)
-            self.axes.append(axarr)
-            fig.subplots_adjust(hspace = 0.5)
-            fig.set_size_inches(8, 10, forward=True)
-       
-        # now ready to actually draw the charts
-       
-        plt.figure(figNumber + 1)
-        axarr = self.axes[figNumber]
-        
-        self.figures[figNumber].canvas.set_window_title(sensor.getTopicName())
-       
-        # do accel plot
-        axarr[0].clear()
-        axarr[0].set_ylim(-2, 2)        
-        if (sensor.getAccelValid()):
- 
-            axarr[0].plot(self.xAxis, sensor.getAccelDataX(), 'b-', 
-                            label = 'Accel X (%.2fg)' % sensor.getCurrentAccelDataX())
-            axarr[0].plot(self.xAxis, sensor.getAccelDataY(), 'r-', 
-                            label = 'Accel Y(%.2fg)' % sensor.getCurrentAccelDataY())
-            axarr[0].plot(self.xAxis, sensor.getAccelDataZ(), 'g-', 
-                            label = 'Accel Z(%.2fg)' % sensor.getCurrentAccelDataZ())
-        else:
-            axarr[0].plot(self.xAxis, sensor.getAccelDataX(), 'b-', 
-                            label = 'No data')
-
-        axarr[0].legend(loc='upper center', shadow=True, fontsize='x-small')
-        axarr[0].set_title("Accelerometer data")
-
-        #do light intensity plot
-        axarr[1].clear()
-        axarr[1].set_ylim(0, 1500)
-        if (sensor.getLightValid()):
-            axarr[1].plot(self.xAxis, sensor.getLightData(), 'b-', 
-                           label = 'Light (%.2f lux)' % sensor.getCurrentLightData())
-        else:
-            axarr[1].plot(self.xAxis, sensor.getLightData(), 'b-', 
-                           label = 'No data')
-            
-        axarr[1].legend(loc='upper center', shadow=True, fontsize='x-small')
-        axarr[1].set_title("Light intensity data")
-       
-        #do temperature plot 
-        axarr[2].clear()
-        axarr[2].set_ylim(-50, 150)
-        if (sensor.getTemperatureValid()):
-            axarr[2].plot(self.xAxis, sensor.getTemperatureData(), 'b-', 
-                           label = 'Temperature (%.2f deg C)' % sensor.getCurrentTemperatureData())
-        else:
-            axarr[2].plot(self.xAxis, sensor.getTemperatureData(), 'b-', 
-                           label = 'No data')
-                
-        axarr[2].legend(loc='upper center', shadow=True, fontsize='x-small')
-        axarr[2].set_title("Temperature data")
-                 
-        #do pressure plot 
-        axarr[3].clear()
-        axarr[3].set_ylim(800, 1200)
-        if (sensor.getPressureValid()):
-            axarr[3].plot(self.xAxis, sensor.getPressureData(), 'b-', 
-                           label = 'Pressure (%.2f hPa)' % sensor.getCurrentPressureData())
-        else:
-            axarr[3].plot(self.xAxis, sensor.getPressureData(), 'b-', 
-                           label = 'No data')
-                
-        axarr[3].legend(loc='upper center', shadow=True, fontsize='x-small')
-        axarr[3].set_title("Pressure data")
-                 
-        #do humidity plot 
-        axarr[4].clear()
-        axarr[4].set_ylim(0, 100)
-        if (sensor.getHumidityValid()):
-            axarr[4].plot(self.xAxis, sensor.getHumidityData(), 'b-', 
-                           label = 'Humidity (%.2f %%RH)' % sensor.getCurrentHumidityData())
-        else:
-            axarr[4].plot(self.xAxis, sensor.getHumidityData(), 'b-', 
-                           label = 'No data')
-                
-        axarr[4].legend(loc='upper center', shadow=True, fontsize='x-small')
-        axarr[4].set_title("Humidity data")
-                          
-    def __init__(self):
-        ''' Sets up the sensor plot '''
+    def __init__(self, plotWindow = None, useBlit = True):
+        ''' Sets up the sensor plot. If plotWindow (in seconds) is set, the
+        min/max/mean rollups covering that window are plotted instead of the
+        averaged record. useBlit can be set False to always redraw the
+        whole figure. '''
+        self.plotWindow = plotWindow
+        self.useBlit = useBlit
+
+        # this list contains the active figures (one per sensor)
+        self.figures = []
+
         plt.ion()
        
     def plot(self, sensors):
@@ -138,22 +244,74 @@ class SensorPlot():
         
         figNumber = 0
         for sensor in sensors:
-            self.__doPlot(figNumber, sensor)
+            if (figNumber == len(self.figures)):
+                # need to add a figure
+                self.figures.append(SensorPlotFigure(figNumber, self.xAxis, self.plotWindow, self.useBlit))
+            self.figures[figNumber].update(sensor)
             figNumber += 1
             
-        if (len(self.figures) > 0):    
-            plt.draw()
-                       
         # check if anything has gone missing
         while (len(self.figures) > figNumber):
-            plt.close(len(self.figures))
-            self.figures.pop()
-            self.axes.pop()
-            
-            
-        
- 
-      
-        
-        
-    
+            self.figures.pop().close()
+
+        # let the GUI process events
+        for figure in self.figures:
+            figure.fig.canvas.flush_events()
+
+'''
+------------------------------------------------------------
+    Benchmark. Run with -n to disable blitting for comparison.
+'''
+
+if __name__ == "__main__":
+    import getopt
+    import json
+    import matplotlib
+
+    # the 50 topic run has a figure per topic, which is more than matplotlib warns about
+    matplotlib.rcParams['figure.max_open_warning'] = 0
+
+    useBlit = True
+    plotWindow = None
+    frames = 20
+
+    opts, args = getopt.getopt(sys.argv[1:], "f:nw:")
+    for opt, arg in opts:
+        if opt == '-f':
+            frames = int(arg)
+        if opt == '-n':
+            useBlit = False
+        if opt == '-w':
+            plotWindow = float(arg)
+
+    for topicCount in (1, 10, 50):
+        # make some sensors with a full set of data
+        # each sensor has its own clock, the timestamp of its latest record
+        sensors = []
+        timestamps = []
+        for topic in range(0, topicCount):
+            sensor = SensorRecords.SensorRecords('bench%d/sensors' % topic, 1.0)
+            timestamp = 0.0
+            for i in range(0, SensorRecords.SENSOR_RECORD_LENGTH, 10):
+                timestamp = float(i)
+                sensor.newJSONData(json.dumps({'timestamp' : timestamp, 'accel' : [0.1, 0.2, 1.0],
+                    'light' : 100.0 + i % 50, 'temperature' : 20.0, 'pressure' : 1000.0, 'humidity' : 50.0}))
+            sensors.append(sensor)
+            timestamps.append(timestamp)
+
+        sensorPlot = SensorPlot(plotWindow, useBlit)
+
+        # the first frame creates the figures so isn't timed
+        sensorPlot.plot(sensors)
+
+        startTime = time.time()
+        for frame in range(0, frames):
+            for index, sensor in enumerate(sensors):
+                timestamps[index] += 1.0
+                sensor.newJSONData(json.dumps({'timestamp' : timestamps[index], 'accel' : [0.1, 0.2, frame / 100.0],
+                    'light' : 100.0 + frame, 'temperature' : 20.0, 'pressure' : 1000.0, 'humidity' : 50.0}))
+            sensorPlot.plot(sensors)
+        frameTime = (time.time() - startTime) / frames
+
+        print ("%d topics: %.1f ms per frame (blit %s)" % (topicCount, frameTime * 1000.0, str(sensorPlot.useBlit)))
+        sensorPlot.plot([])
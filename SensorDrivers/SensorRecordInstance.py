@@ -24,10 +24,18 @@
 //  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import numpy as np
+
+import SensorRollupTier
+
+# read only zero records returned for sensors that have no data, keyed by length
+
+emptyRecords = {}
+
 class SensorRecordInstance():
     ''' Sensor record for a single sensor type '''
         
-    def __init__(self, recordLength, timeInterval): 
+    def __init__(self, recordLength, timeInterval, rollupTiers=(), holdTimeout=0): 
         # this var determines how big the record array is
         self.recordLength = recordLength
         
@@ -39,20 +47,55 @@ class SensorRecordInstance():
         # and this is how many samples have been accumulated
         self.currentDataCount = 0
      
-        # this var is used to store averaged record per time interval
-        self.data = []
+        # this var is used to store averaged record per time interval. It is a ring
+        # buffer that is stored twice (the second copy starts at recordLength) so
+        # that the ordered record is always available as a contiguous slice.
+        # It is not allocated until data is received so that sensors a device
+        # does not have cost nothing.
+        self.data = None
+
+        # this is the index of the oldest entry in the ring buffer
+        self.head = 0
     
         # this var indicates if data has been received
         self.dataValid = False
             
-        # preset the store
-        for i in range (0, self.recordLength):
-            self.data.append(0.0)  
-            
         # this is used to time the aggregation
         self.currentTime = 0 
+
+        # records without data for this sensor mean that the value hasn't changed
+        # (change-only publishing), so the last value received is carried forward
+        # for up to holdTimeout seconds. 0 disables this.
+        self.holdTimeout = holdTimeout
+        self.lastData = 0
+        self.lastDataTime = 0
+
+        # the multi-resolution rollups, one per (interval, length) pair, finest first.
+        # These are also created when data is first received.
+        self.rollupTiers = sorted(rollupTiers)
+        self.rollups = []
                           
     def addData(self, newTimestamp, newData):
+        self.lastData = newData
+        self.lastDataTime = newTimestamp
+        self.__addSample(newTimestamp, newData)
+
+    def holdData(self, newTimestamp):
+        # called for a record that has no data for this sensor. Adds the last
+        # known value if it is recent enough.
+        if (self.holdTimeout <= 0) or not self.dataValid:
+            return
+        if ((newTimestamp - self.lastDataTime) <= self.holdTimeout):
+            self.__addSample(newTimestamp, self.lastData)
+
+    def __addSample(self, newTimestamp, newData):
+        if (self.data is None):
+            self.__allocate()
+
+        # the rollups are maintained incrementally from every sample
+        for rollup in self.rollups:
+            rollup.addData(newTimestamp, newData)
+
         if (self.currentDataCount == 0):
             # special case for first data point
             self.currentTime = newTimestamp
@@ -65,11 +108,9 @@ class SensorRecordInstance():
             # this record is for a new time interval
             timeUnits = int((newTimestamp - self.currentTime) /
                         self.timeInterval)                  # this is how many slots to fill based on gap
-            self.currentTime += timeUnits                   # advance the clock
+            self.currentTime += timeUnits * self.timeInterval   # advance the clock
             
-            for i in range(0, timeUnits):
-                self.data.pop(0)
-                self.data.append(self.currentData / self.currentDataCount)
+            self.__appendSlots(self.currentData / self.currentDataCount, timeUnits)
  
             # zero out accumulator for next set
             self.currentData = 0
@@ -78,10 +119,157 @@ class SensorRecordInstance():
         # add in new data   
         self.currentData += newData 
         self.currentDataCount += 1
+
+    def addBatch(self, timestamps, data):
+        # adds numpy arrays of timestamps and data. NaN marks samples without data.
+        # The result is the same as calling addData for each sample in turn (and
+        # holdData for each NaN). The samples are totalled a run at a time rather
+        # than one by one.
+        if (len(timestamps) == 0):
+            return
+
+        valid = ~np.isnan(data)
+        if not valid.all():
+            keep = valid
+            if (self.holdTimeout > 0):
+                # find the last valid sample at or before each position (-1 if none)
+                positions = np.maximum.accumulate(np.where(valid, np.arange(len(data)), -1))
+                found = positions >= 0
+                if self.dataValid:
+                    sourceData = np.where(found, data[positions], self.lastData)
+                    sourceTimes = np.where(found, timestamps[positions], self.lastDataTime)
+                else:
+                    sourceData = np.where(found, data[positions], np.nan)
+                    sourceTimes = np.where(found, timestamps[positions], np.nan)
+                with np.errstate(invalid='ignore'):
+                    keep = valid | ((timestamps - sourceTimes) <= self.holdTimeout)
+                data = np.where(valid, data, sourceData)
+            if valid.any():
+                last = np.flatnonzero(valid)[-1]
+                self.lastData = data[last]
+                self.lastDataTime = timestamps[last]
+            timestamps = timestamps[keep]
+            data = data[keep]
+        else:
+            self.lastData = data[-1]
+            self.lastDataTime = timestamps[-1]
+
+        self.__addSamples(timestamps, data)
+
+    def __addSamples(self, timestamps, data):
+        if (len(timestamps) == 0):
+            return
+        if (self.data is None):
+            self.__allocate()
+
+        for rollup in self.rollups:
+            rollup.addBatch(timestamps, data)
+
+        if (self.currentDataCount == 0):
+            # special case for first data point
+            self.currentTime = timestamps[0]
+            self.dataValid = True
+            self.currentData = data[0]
+            self.currentDataCount = 1
+            timestamps = timestamps[1:]
+            data = data[1:]
+            if (len(timestamps) == 0):
+                return
+
+        # The intervals are found run by run in the same way as __addSample does so
+        # that the boundaries (and the rounding of currentTime) are the same. A sample
+        # starts a new interval if it is at least timeInterval after currentTime, so
+        # the first such sample is found using the running maximum of the timestamps.
+        # Late samples go into whichever interval is current when they arrive.
+        peaks = np.maximum.accumulate(timestamps)
+        count = len(timestamps)
+        averages = []
+        gaps = []
+        timeUnits = 0
+        index = 0
+        while (index < count):
+            if (index > 0) and ((peaks[index - 1] - self.currentTime) >= self.timeInterval):
+                # rounding left a sample before this one at least an interval ahead
+                # so the running maximum can't be used to find the next interval
+                nextIndex = index
+                while (nextIndex < count) and \
+                        ((timestamps[nextIndex] - self.currentTime) < self.timeInterval):
+                    nextIndex += 1
+            else:
+                # searchsorted gives a nearby position that is corrected for the
+                # rounding of the subtraction
+                nextIndex = index + int(np.searchsorted(peaks[index:],
+                            self.currentTime + self.timeInterval))
+                while (nextIndex > index) and \
+                        ((peaks[nextIndex - 1] - self.currentTime) >= self.timeInterval):
+                    nextIndex -= 1
+                while (nextIndex < count) and \
+                        ((peaks[nextIndex] - self.currentTime) < self.timeInterval):
+                    nextIndex += 1
+
+            # samples up to nextIndex belong to the current interval. cumsum adds them
+            # in order so the total is exactly what __addSample would have.
+            if (nextIndex > index):
+                self.currentData = np.cumsum(np.concatenate(([self.currentData],
+                            data[index:nextIndex])))[-1]
+                self.currentDataCount += nextIndex - index
+            if (nextIndex >= count):
+                break
+
+            # this sample starts a new time interval
+            units = int((timestamps[nextIndex] - self.currentTime) / self.timeInterval)
+            self.currentTime += units * self.timeInterval
+            averages.append(self.currentData / self.currentDataCount)
+            gaps.append(min(units, self.recordLength))
+            timeUnits += units
+            self.currentData = data[nextIndex]
+            self.currentDataCount = 1
+            index = nextIndex + 1
+
+        # each completed interval's average fills the slots up to the start of the next
+        if (timeUnits > 0):
+            values = np.repeat(averages, gaps)[-self.recordLength:]
+            self.__appendSlots(values, timeUnits)
+
+    def __allocate(self):
+        # first data for this sensor so allocate the storage
+        self.data = np.zeros(2 * self.recordLength)
+        for interval, length in self.rollupTiers:
+            self.rollups.append(SensorRollupTier.SensorRollupTier(interval, length))
+
+    def __appendSlots(self, values, count):
+        # appends count slots, discarding the oldest entries. values is either a single
+        # value for every slot or an array of the newest min(count, recordLength) slots.
+        fill = min(count, self.recordLength)
+        values = np.broadcast_to(values, (fill,))
+
+        # the slots to be overwritten end just before the new head and may wrap around
+        start = (self.head + count - fill) % self.recordLength
+        first = min(fill, self.recordLength - start)
+        self.__setSlots(start, values[:first])
+        self.__setSlots(0, values[first:])
+
+        self.head = (self.head + count) % self.recordLength
+
+    def __setSlots(self, start, values):
+        # updates both copies of the ring buffer
+        count = len(values)
+        if (count <= 0):
+            return
+        self.data[start:start + count] = values
+        self.data[start + self.recordLength:start + self.recordLength + count] = values
     
     def getData(self):
-        # accumulated data access function
-        return self.data
+        # accumulated data access function. Returns a read only view, oldest first, that
+        # does not copy the data. Note that the view is updated as new data arrives.
+        if (self.data is None):
+            if (self.recordLength not in emptyRecords):
+                emptyRecords[self.recordLength] = np.zeros(self.recordLength)
+                emptyRecords[self.recordLength].flags.writeable = False
+            return emptyRecords[self.recordLength]
+        view = self.data[self.head:self.head + self.recordLength]
+        view.flags.writeable = False
+        return view
         
     def getCurrentData(self):
         # current data access function
@@ -93,8 +281,93 @@ class SensorRecordInstance():
     def getDataValid(self):
         # data valid function
         return self.dataValid
- 
-        
-        
-        
-        
+
+    def getRollup(self, window):
+        # returns the finest rollup tier that covers window seconds (or the coarsest
+        # if none do). Returns None if there are no rollups or no data has been received.
+        for rollup in self.rollups:
+            if (rollup.getWindow() >= window):
+                return rollup
+        if (len(self.rollups) == 0):
+            return None
+        return self.rollups[-1]
+
+    def queryRollup(self, window):
+        # returns (times, min, max, mean, count) for the last window seconds or None
+        rollup = self.getRollup(window)
+        if (rollup == None):
+            return None
+        return rollup.query(window)
+
+    def snapshot(self, rollupWindow=None):
+        # returns an immutable copy that can be safely used by another thread
+        return SensorRecordSnapshot(self, rollupWindow)
+
+
+class SensorRecordSnapshot():
+    ''' Immutable copy of a SensorRecordInstance. Only the rollup query for
+    rollupWindow is captured as copying every tier would be expensive. '''
+
+    def __init__(self, record, rollupWindow):
+        self.dataValid = record.getDataValid()
+        self.currentData = record.getCurrentData()
+        if (self.dataValid):
+            self.data = np.array(record.getData())
+            self.data.flags.writeable = False
+        else:
+            # this is the shared read only empty record so no need to copy
+            self.data = record.getData()
+
+        self.rollupWindow = rollupWindow
+        self.rollup = None
+        if (rollupWindow != None):
+            self.rollup = record.queryRollup(rollupWindow)
+
+    def getData(self):
+        return self.data
+
+    def getCurrentData(self):
+        return self.currentData
+
+    def getDataValid(self):
+        return self.dataValid
+
+    def getRollup(self, window):
+        # the tiers themselves are not part of the snapshot
+        return None
+
+    def queryRollup(self, window):
+        if (window != self.rollupWindow):
+            return None
+        return self.rollup
+
+
+if __name__ == '__main__':
+    # checks that addBatch gives exactly the same result as adding the samples one
+    # at a time. The samples are 0.45 seconds apart so many fall close to interval
+    # boundaries, some arrive late and some have no data, including a gap longer
+    # than the hold timeout.
+    timestamps = 101.0 + 0.45 * np.arange(93)
+    for index in range(13, len(timestamps), 13):
+        timestamps[index - 1], timestamps[index] = timestamps[index], timestamps[index - 1]
+    data = 10.0 + np.sin(np.arange(len(timestamps)) / 7.0)
+    data[::5] = np.nan
+    data[40:50] = np.nan
+
+    expected = SensorRecordInstance(100, 0.5, holdTimeout=3.0)
+    for timestamp, value in zip(timestamps, data):
+        if np.isnan(value):
+            expected.holdData(timestamp)
+        else:
+            expected.addData(timestamp, value)
+
+    for batchLength in (len(timestamps), 37, 1):
+        record = SensorRecordInstance(100, 0.5, holdTimeout=3.0)
+        for start in range(0, len(timestamps), batchLength):
+            record.addBatch(timestamps[start:start + batchLength], data[start:start + batchLength])
+        print ('batches of %d: last slot %.4f, current time %.2f, %d samples pending' %
+                (batchLength, record.getData()[-1], record.currentTime, record.currentDataCount))
+        assert np.array_equal(record.getData(), expected.getData())
+        assert record.currentTime == expected.currentTime
+        assert record.currentDataCount == expected.currentDataCount
+        assert record.getCurrentData() == expected.getCurrentData()
@@ -24,13 +24,24 @@
 //  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import copy
 import json
+import numpy as np
+import SensorBinary
 import SensorJSON
 import SensorRecordInstance
 
 # global defines
 
-SENSOR_RECORD_LENGTH = 600                                  # number of time intervals
+SENSOR_RECORD_LENGTH = 7200                                 # number of time intervals (2 hours at 1 second)
+
+# the rollup tiers as (slot interval in seconds, number of slots)
+
+SENSOR_ROLLUP_TIERS = ((1.0, 600),                          # 10 minutes at 1 second
+                       (60.0, 1440),                        # 24 hours at 1 minute
+                       (900.0, 2880))                       # 30 days at 15 minutes
+
+SENSOR_HOLD_TIMEOUT = 60.0                                  # seconds a value is carried forward if not resent
 
 # the sensor record array indices
 
@@ -44,22 +55,43 @@ SENSOR_RECORD_HUMIDITY = 6
 
 SENSOR_RECORD_COUNT = 7
 
+# the sensor record indices for each column of a batched record
+
+SENSOR_BATCH_COLUMNS = ((SensorJSON.ACCEL_DATA, (SENSOR_RECORD_ACCEL_X, SENSOR_RECORD_ACCEL_Y,
+                                                 SENSOR_RECORD_ACCEL_Z)),
+                        (SensorJSON.LIGHT_DATA, (SENSOR_RECORD_LIGHT,)),
+                        (SensorJSON.TEMPERATURE_DATA, (SENSOR_RECORD_TEMPERATURE,)),
+                        (SensorJSON.PRESSURE_DATA, (SENSOR_RECORD_PRESSURE,)),
+                        (SensorJSON.HUMIDITY_DATA, (SENSOR_RECORD_HUMIDITY,)))
+
 class SensorRecords():
     ''' Sensor model used by viewers '''
         
-    def __init__(self, topicName, accumInterval):       
+    def __init__(self, topicName, accumInterval, rollupTiers=SENSOR_ROLLUP_TIERS,
+                 holdTimeout=SENSOR_HOLD_TIMEOUT):
         # the sensor instance vars
         self.sensorRecords = []
         for i in range (0, SENSOR_RECORD_COUNT):
             self.sensorRecords.append(SensorRecordInstance.SensorRecordInstance(SENSOR_RECORD_LENGTH,
-                            accumInterval))
+                            accumInterval, rollupTiers, holdTimeout))
         self.topicName = topicName
         self.accumInterval = accumInterval
+
+        # incremented for every record added so that consumers can tell if anything changed
+        self.updateCount = 0
                               
     def newJSONData(self, data):
-        ''' adds a sensor JSON record to the record '''
+        ''' adds a sensor JSON record, JSON batch or binary batch to the record '''
+        if SensorBinary.isMediaEnvelope(data):
+            self.newBatch(SensorBinary.unpackSensorBatch(data))
+            return
+
         # decode the JSON record
         sensorDict = json.loads(data)
+        if (SensorJSON.BATCH_TIMESTAMPS in sensorDict):
+            self.newBatch(sensorDict)
+            return
+
         newTimestamp = sensorDict.get(SensorJSON.TIMESTAMP)
         newAccelData = sensorDict.get(SensorJSON.ACCEL_DATA)
         newLightData = sensorDict.get(SensorJSON.LIGHT_DATA)
@@ -70,29 +102,96 @@ class SensorRecords():
         if (newTimestamp == None):
             print ("Received JSON record without timestamp")
             return
+
+        self.updateCount += 1
             
-        # now update instances
+        # now update instances. Missing data means the value hasn't changed.
         
         if (newAccelData != None):
             self.sensorRecords[SENSOR_RECORD_ACCEL_X].addData(newTimestamp, newAccelData[0])
             self.sensorRecords[SENSOR_RECORD_ACCEL_Y].addData(newTimestamp, newAccelData[1])
             self.sensorRecords[SENSOR_RECORD_ACCEL_Z].addData(newTimestamp, newAccelData[2])
+        else:
+            self.sensorRecords[SENSOR_RECORD_ACCEL_X].holdData(newTimestamp)
+            self.sensorRecords[SENSOR_RECORD_ACCEL_Y].holdData(newTimestamp)
+            self.sensorRecords[SENSOR_RECORD_ACCEL_Z].holdData(newTimestamp)
             
         if (newLightData != None):
              self.sensorRecords[SENSOR_RECORD_LIGHT].addData(newTimestamp, newLightData)
+        else:
+             self.sensorRecords[SENSOR_RECORD_LIGHT].holdData(newTimestamp)
              
         if (newTemperatureData != None):
              self.sensorRecords[SENSOR_RECORD_TEMPERATURE].addData(newTimestamp, newTemperatureData)
+        else:
+             self.sensorRecords[SENSOR_RECORD_TEMPERATURE].holdData(newTimestamp)
              
         if (newPressureData != None):
              self.sensorRecords[SENSOR_RECORD_PRESSURE].addData(newTimestamp, newPressureData)
+        else:
+             self.sensorRecords[SENSOR_RECORD_PRESSURE].holdData(newTimestamp)
              
         if (newHumidityData != None):
              self.sensorRecords[SENSOR_RECORD_HUMIDITY].addData(newTimestamp, newHumidityData)
+        else:
+             self.sensorRecords[SENSOR_RECORD_HUMIDITY].holdData(newTimestamp)
    
+    def newBatch(self, sensorDict):
+        ''' adds a decoded batch to the record. Each sensor column is added in one pass. '''
+        timestamps = np.asarray(sensorDict[SensorJSON.BATCH_TIMESTAMPS], dtype=float)
+        if (len(timestamps) == 0):
+            return
+
+        for name, recordIndices in SENSOR_BATCH_COLUMNS:
+            columns = sensorDict.get(name)
+            if (columns == None):
+                # no data at all for this sensor in the batch
+                columns = [np.full(len(timestamps), np.nan)] * len(recordIndices)
+            elif (len(recordIndices) == 1):
+                columns = [columns]
+            for recordIndex, column in zip(recordIndices, columns):
+                # None (JSON null) becomes NaN and marks samples without data
+                values = np.array(column, dtype=float)
+                self.sensorRecords[recordIndex].addBatch(timestamps, values)
+
+        self.updateCount += len(timestamps)
+
     def getTopicName(self):
         return self.topicName
+
+    def getUpdateCount(self):
+        return self.updateCount
+
+    # rollup query functions. recordIndex is one of the SENSOR_RECORD_ indices.
+
+    def getRollup(self, recordIndex, window):
+        ''' returns the rollup tier best suited to displaying window seconds '''
+        return self.sensorRecords[recordIndex].getRollup(window)
+
+    def queryRollup(self, recordIndex, window):
+        ''' returns (times, min, max, mean, count) for the last window seconds
+        from the best suited rollup tier, or None if there are no rollups '''
+        return self.sensorRecords[recordIndex].queryRollup(window)
+
+    def snapshot(self, rollupWindow=None):
+        ''' returns an immutable copy of the records that can be used by another
+        thread while this object continues to be updated. The copy supports
+        the same access functions. '''
+        records = copy.copy(self)
+        records.sensorRecords = [record.snapshot(rollupWindow) for record in self.sensorRecords]
+        return records
    
+    # generic access functions. recordIndex is one of the SENSOR_RECORD_ indices.
+
+    def getDataValid(self, recordIndex):
+        return self.sensorRecords[recordIndex].getDataValid()
+
+    def getData(self, recordIndex):
+        return self.sensorRecords[recordIndex].getData()
+
+    def getCurrentData(self, recordIndex):
+        return self.sensorRecords[recordIndex].getCurrentData()
+
     # data validity functions
     
     def getAccelValid(self):
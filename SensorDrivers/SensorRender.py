@@ -0,0 +1,216 @@
+#!/usr/bin/python
+"""
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015-2016, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+# Headless sensor plot rendering. The figures are drawn with the Agg backend
+# in a separate process so that rendering never holds up MQTT ingestion.
+# Each rendered image can be written to a file and/or handed back so that
+# the caller can publish it.
+
+import io
+import multiprocessing
+import os
+import sys
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import SensorRecords
+
+# images are published to the sensor topic with this suffix added
+SENSOR_RENDER_TOPIC_SUFFIX = '/plot'
+
+SENSOR_RENDER_FORMATS = ('png', 'svg')
+
+def imageFileName(topic, imageFormat):
+    ''' returns the file name used for topic's image '''
+    return topic.replace('/', '_') + '.' + imageFormat
+
+def renderWorker(jobQueue, resultQueue, outputDir, imageFormat, publishImages, plotWindow):
+    ''' the render process. Each job is (changed sensor snapshots, all active topics).
+    A job of None causes the process to exit. '''
+
+    # this must happen before pyplot is imported by SensorPlot
+    import matplotlib
+    matplotlib.use('Agg')
+    import SensorPlot
+
+    xAxis = SensorPlot.SensorPlot.xAxis
+
+    # the figures are kept so that the artists can be reused
+    figures = {}
+    figNumber = 0
+
+    while True:
+        job = jobQueue.get()
+        if (job == None):
+            break
+        sensors, activeTopics = job
+
+        # close figures for topics that have gone away
+        for topic in list(figures.keys()):
+            if (topic not in activeTopics):
+                figures.pop(topic).close()
+
+        for sensor in sensors:
+            topic = sensor.getTopicName()
+            figure = figures.get(topic)
+            if (figure == None):
+                figure = SensorPlot.SensorPlotFigure(figNumber, xAxis, plotWindow, False)
+                figure.fig.suptitle(topic)
+                figures[topic] = figure
+                figNumber += 1
+
+            try:
+                figure.updateArtists(sensor)
+                image = io.BytesIO()
+                figure.fig.savefig(image, format=imageFormat)
+                image = image.getvalue()
+
+                if (outputDir != None):
+                    # write then rename so that readers never see a partial image
+                    fileName = os.path.join(outputDir, imageFileName(topic, imageFormat))
+                    tempName = fileName + '.tmp'
+                    with open(tempName, 'wb') as imageFile:
+                        imageFile.write(image)
+                    os.rename(tempName, fileName)
+
+                if (publishImages):
+                    resultQueue.put((topic, image))
+            except:
+                print ("Render error", topic, sys.exc_info()[0], sys.exc_info()[1])
+
+        sys.stdout.flush()
+
+    for figure in figures.values():
+        figure.close()
+
+class SensorRender():
+    ''' Renders sensor snapshots to images in a worker process. Only topics
+    that have changed since they were last rendered are sent to the worker. '''
+
+    def __init__(self, outputDir=None, imageFormat='png', publishImages=False, plotWindow=None):
+        if (imageFormat not in SENSOR_RENDER_FORMATS):
+            raise ValueError('unsupported image format %s' % imageFormat)
+        self.outputDir = outputDir
+        self.imageFormat = imageFormat
+        self.publishImages = publishImages
+        self.plotWindow = plotWindow
+
+        # only one job is allowed to wait so a slow renderer can't build up a backlog
+        self.jobQueue = multiprocessing.Queue(1)
+        self.resultQueue = multiprocessing.Queue()
+
+        # the update count of each topic when it was last sent for rendering
+        self.renderedCounts = {}
+
+        # counters
+        self.renderedCount = 0
+        self.unchangedCount = 0
+        self.busyCount = 0
+
+        self.process = None
+
+    def start(self):
+        ''' starts the render process '''
+        if (self.outputDir != None) and not os.path.isdir(self.outputDir):
+            os.makedirs(self.outputDir)
+        self.process = multiprocessing.Process(target=renderWorker,
+                            args=(self.jobQueue, self.resultQueue, self.outputDir,
+                                self.imageFormat, self.publishImages, self.plotWindow))
+        self.process.daemon = True
+        self.process.start()
+
+    def stop(self):
+        ''' stops the render process '''
+        if (self.process == None):
+            return
+        try:
+            self.jobQueue.put(None, True, 5.0)
+            self.process.join(5.0)
+        except queue.Full:
+            pass
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+
+    def render(self, sensors):
+        ''' queues the changed sensors from the list of snapshots for rendering.
+        This never blocks - if the render process is still busy with the
+        last job nothing is queued and the changes are picked up next time.
+        Returns the number of topics queued. '''
+
+        activeTopics = set()
+        changed = []
+        for sensor in sensors:
+            topic = sensor.getTopicName()
+            activeTopics.add(topic)
+            if (self.renderedCounts.get(topic) == sensor.getUpdateCount()):
+                self.unchangedCount += 1
+            else:
+                changed.append(sensor)
+
+        # forget topics that have gone away so they are rendered if they come back
+        for topic in list(self.renderedCounts.keys()):
+            if (topic not in activeTopics):
+                del self.renderedCounts[topic]
+
+        if (len(changed) == 0):
+            return 0
+
+        try:
+            self.jobQueue.put_nowait((changed, activeTopics))
+        except queue.Full:
+            self.busyCount += 1
+            return 0
+
+        for sensor in changed:
+            self.renderedCounts[sensor.getTopicName()] = sensor.getUpdateCount()
+        self.renderedCount += len(changed)
+        return len(changed)
+
+    def getImages(self):
+        ''' returns a list of (topic, image data) for images rendered since the
+        last call. Only used if publishImages was set. '''
+        images = []
+        while True:
+            try:
+                images.append(self.resultQueue.get_nowait())
+            except queue.Empty:
+                break
+        return images
+
+    # counter access functions
+
+    def getRenderedCount(self):
+        return self.renderedCount
+
+    def getUnchangedCount(self):
+        return self.unchangedCount
+
+    def getBusyCount(self):
+        return self.busyCount
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+"""
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015-2016, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import math
+import numpy as np
+
+class SensorRollupTier():
+    ''' Min, max, mean and count rollup of a single sensor type at one time resolution '''
+
+    def __init__(self, interval, length):
+        # this is the time interval covered by each slot
+        self.interval = interval
+
+        # this is the number of slots kept
+        self.length = length
+
+        # the per slot statistics. Each array is a ring buffer indexed in the same way.
+        # Slots with no samples have a count of zero.
+        self.minData = np.zeros(length)
+        self.maxData = np.zeros(length)
+        self.sumData = np.zeros(length)
+        self.countData = np.zeros(length, dtype=np.int32)
+
+        # this is the index of the oldest slot in the ring buffers
+        self.head = 0
+
+        # this is the absolute slot number (timestamp / interval) of the newest slot
+        self.currentSlot = None
+
+    def getWindow(self):
+        # returns the time span covered by the tier in seconds
+        return self.interval * self.length
+
+    def getInterval(self):
+        return self.interval
+
+    def addData(self, newTimestamp, newData):
+        slot = int(math.floor(newTimestamp / self.interval))
+
+        if (self.currentSlot == None):
+            # special case for first data point
+            self.currentSlot = slot
+
+        if (slot > self.currentSlot):
+            # moved on to a new slot - clear out the slots skipped over
+            self.__advance(slot - self.currentSlot)
+            self.currentSlot = slot
+
+        age = self.currentSlot - slot
+        if (age >= self.length):
+            # too old to be recorded
+            return
+
+        # late data still goes into the correct slot
+        index = (self.head - 1 - age) % self.length
+
+        if (self.countData[index] == 0):
+            self.minData[index] = newData
+            self.maxData[index] = newData
+        else:
+            if (newData < self.minData[index]):
+                self.minData[index] = newData
+            if (newData > self.maxData[index]):
+                self.maxData[index] = newData
+        self.sumData[index] += newData
+        self.countData[index] += 1
+
+    def addBatch(self, timestamps, data):
+        # adds numpy arrays of timestamps and data. The result is the same as
+        # calling addData for each sample in turn.
+        if (len(timestamps) == 0):
+            return
+        slots = np.floor(timestamps / self.interval).astype(np.int64)
+
+        if (self.currentSlot == None):
+            self.currentSlot = int(slots[0])
+
+        newestSlot = max(self.currentSlot, int(slots.max()))
+        if (newestSlot > self.currentSlot):
+            self.__advance(newestSlot - self.currentSlot)
+            self.currentSlot = newestSlot
+
+        # anything older than the tier is dropped, either on arrival or by a later advance
+        ages = self.currentSlot - slots
+        keep = ages < self.length
+        if not keep.all():
+            ages = ages[keep]
+            data = data[keep]
+        indices = (self.head - 1 - ages) % self.length
+
+        # slots without samples hold zeros so must be reset before min/max are applied
+        fresh = indices[self.countData[indices] == 0]
+        self.minData[fresh] = np.inf
+        self.maxData[fresh] = -np.inf
+
+        np.minimum.at(self.minData, indices, data)
+        np.maximum.at(self.maxData, indices, data)
+        np.add.at(self.sumData, indices, data)
+        np.add.at(self.countData, indices, 1)
+
+    def __advance(self, count):
+        # discards the oldest count slots and makes count new empty slots
+        clear = min(count, self.length)
+        first = min(clear, self.length - self.head)
+        self.__clearSlots(self.head, first)
+        self.__clearSlots(0, clear - first)
+        self.head = (self.head + count) % self.length
+
+    def __clearSlots(self, start, count):
+        if (count <= 0):
+            return
+        self.minData[start:start + count] = 0
+        self.maxData[start:start + count] = 0
+        self.sumData[start:start + count] = 0
+        self.countData[start:start + count] = 0
+
+    def query(self, window):
+        ''' returns the most recent slots covering window seconds, oldest first.
+        The result is a tuple of numpy arrays (times, min, max, mean, count).
+        times are the slot start times relative to the start of the newest slot.
+        min, max and mean are NaN for slots without any samples. '''
+
+        slots = int(min(self.length, max(1, math.ceil(window / self.interval))))
+        indices = (self.head - slots + np.arange(slots)) % self.length
+
+        times = (np.arange(slots) - (slots - 1)) * self.interval
+        count = self.countData[indices]
+        empty = (count == 0)
+
+        minData = self.minData[indices]
+        maxData = self.maxData[indices]
+        meanData = self.sumData[indices] / np.maximum(count, 1)
+        minData[empty] = np.nan
+        maxData[empty] = np.nan
+        meanData[empty] = np.nan
+
+        return (times, minData, maxData, meanData, count)
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+"""
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015-2016, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import heapq
+import time
+
+class SensorScheduler():
+    ''' Deadline scheduler for sensor tasks. Each task is a function that
+    returns the number of seconds until it should be called again, or None
+    if it is finished. The run loop sleeps until the next deadline rather
+    than polling. '''
+
+    def __init__(self):
+        # the heap of (deadline, sequence, task). sequence keeps tasks with
+        # equal deadlines in the order they were added.
+        self.tasks = []
+        self.sequence = 0
+        self.mustExit = False
+
+        # the number of tasks called, for diagnostics
+        self.callCount = 0
+
+    def add(self, task, delay=0):
+        ''' adds a task that will first be called after delay seconds '''
+        self.__schedule(time.time() + delay, task)
+
+    def stop(self):
+        ''' causes run to return after the current task '''
+        self.mustExit = True
+
+    def getCallCount(self):
+        return self.callCount
+
+    def getTaskCount(self):
+        return len(self.tasks)
+
+    def run(self):
+        ''' calls tasks as they become due until stop is called or there are no tasks left '''
+        self.mustExit = False
+        while not self.mustExit and (len(self.tasks) > 0):
+            deadline, sequence, task = self.tasks[0]
+            now = time.time()
+            if (deadline > now):
+                time.sleep(deadline - now)
+                continue
+
+            heapq.heappop(self.tasks)
+            self.callCount += 1
+            delay = task()
+            if (delay == None):
+                continue
+
+            # schedule relative to the deadline so periodic tasks don't drift but
+            # if running late don't try to catch up with a burst of calls
+            nextDeadline = deadline + delay
+            if (nextDeadline < now):
+                nextDeadline = now
+            self.__schedule(nextDeadline, task)
+
+    def __schedule(self, deadline, task):
+        heapq.heappush(self.tasks, (deadline, self.sequence, task))
+        self.sequence += 1
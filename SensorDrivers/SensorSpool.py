@@ -0,0 +1,280 @@
+#!/usr/bin/python
+"""
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015-2016, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+# Disk backed store-and-forward spool for MQTT messages. Messages are appended
+# to fixed size memory mapped segment files in a spool directory. When the
+# spool reaches its size cap the oldest segment is deleted so memory use stays
+# flat however long the broker is unreachable.
+#
+# Segment layout (little endian):
+#
+#   magic        4 bytes     'RTSP'
+#   version      uint8       spool version
+#   pad          3 bytes
+#   writeOffset  uint32      offset of the next record to be written
+#   readOffset   uint32      offset of the next record to be sent
+#   recordCount  uint32      number of records written
+#   readCount    uint32      number of records sent
+#
+# followed by records consisting of:
+#
+#   length       uint32      payload length
+#   topicLength  uint16      topic length
+#   topic
+#   payload
+
+import mmap
+import os
+import struct
+
+SPOOL_MAGIC = 'RTSP'
+SPOOL_VERSION = 1
+
+SPOOL_HEADER = struct.Struct('<4sB3xIIII')
+SPOOL_RECORD_HEADER = struct.Struct('<IH')
+
+SPOOL_SEGMENT_BYTES = 1024 * 1024                   # size of each segment file
+SPOOL_MAX_BYTES = 16 * 1024 * 1024                  # default size cap for the spool
+
+SPOOL_SEGMENT_PREFIX = 'spool'
+SPOOL_SEGMENT_SUFFIX = '.seg'
+
+class SensorSpool():
+    ''' Append-only disk spool of (topic, payload) records, sent oldest first '''
+
+    def __init__(self, spoolDir, maxBytes=SPOOL_MAX_BYTES, segmentBytes=SPOOL_SEGMENT_BYTES):
+        self.spoolDir = spoolDir
+        self.segmentBytes = segmentBytes
+
+        # always keep at least two segments so that there is somewhere to write
+        # while the oldest is being sent
+        self.maxSegments = max(2, maxBytes // segmentBytes)
+
+        if not os.path.isdir(spoolDir):
+            os.makedirs(spoolDir)
+
+        # the open segments, oldest first. The last one is the one being written.
+        self.segments = []
+        self.nextSegmentNumber = 0
+
+        # counters
+        self.pendingCount = 0
+        self.droppedCount = 0
+
+        # True if the segments have changed since they were last flushed
+        self.dirty = False
+
+        # the (segment, next read offset) of each record returned by the last peek
+        self.peeked = []
+
+        # pick up anything left from a previous run
+        for fileName in sorted(os.listdir(spoolDir)):
+            if not (fileName.startswith(SPOOL_SEGMENT_PREFIX) and fileName.endswith(SPOOL_SEGMENT_SUFFIX)):
+                continue
+            path = os.path.join(spoolDir, fileName)
+            try:
+                number = int(fileName[len(SPOOL_SEGMENT_PREFIX):-len(SPOOL_SEGMENT_SUFFIX)])
+                segment = SensorSpoolSegment(path, segmentBytes, False)
+            except (ValueError, IOError, OSError, mmap.error):
+                print ("Discarding bad spool segment", path)
+                os.remove(path)
+                continue
+            self.segments.append(segment)
+            self.pendingCount += segment.getPending()
+            self.nextSegmentNumber = max(self.nextSegmentNumber, number + 1)
+
+        if (len(self.segments) == 0):
+            self.__newSegment()
+        else:
+            # the cap may have been reduced since the segments were written
+            self.__evictSegments()
+
+    def append(self, topic, payload):
+        ''' adds a record to the end of the spool, evicting the oldest segment if necessary '''
+        self.peeked = []
+        if not self.segments[-1].append(topic, payload):
+            # the write segment is full
+            self.segments[-1].flush()
+            self.__newSegment()
+            if not self.segments[-1].append(topic, payload):
+                raise ValueError('record too large for spool segment')
+        self.pendingCount += 1
+        self.dirty = True
+
+    def peek(self, maxCount):
+        ''' returns up to maxCount (topic, payload) records, oldest first, without
+        removing them. Call commit once they have been sent. '''
+        records = []
+        self.peeked = []
+        for segment in self.segments:
+            for topic, payload, nextOffset in segment.peek(maxCount - len(records)):
+                records.append((topic, payload))
+                self.peeked.append((segment, nextOffset))
+            if (len(records) >= maxCount):
+                break
+        return records
+
+    def commit(self, count):
+        ''' removes the first count records returned by the last peek '''
+        consumed = {}
+        for segment, nextOffset in self.peeked[:count]:
+            records, offset = consumed.get(segment, (0, 0))
+            consumed[segment] = (records + 1, nextOffset)
+        self.peeked = []
+
+        for segment, (records, offset) in consumed.items():
+            if segment in self.segments:
+                segment.consume(records, offset)
+                self.pendingCount -= records
+                self.dirty = True
+
+        # delete segments that have been completely sent, apart from the write segment
+        while (len(self.segments) > 1) and (self.segments[0].getPending() == 0):
+            self.__deleteSegment(self.segments.pop(0))
+
+    def flush(self):
+        ''' makes sure everything written so far is on disk. Does nothing if
+        the spool hasn't changed since the last flush. '''
+        if not self.dirty:
+            return
+        for segment in self.segments:
+            segment.flush()
+        self.dirty = False
+
+    def close(self):
+        for segment in self.segments:
+            segment.flush()
+            segment.close()
+        self.segments = []
+
+    def getCount(self):
+        ''' returns the number of records waiting to be sent '''
+        return self.pendingCount
+
+    def getDroppedCount(self):
+        ''' returns the number of unsent records discarded because the spool was full '''
+        return self.droppedCount
+
+    def __newSegment(self):
+        path = os.path.join(self.spoolDir, '%s%08d%s' % (SPOOL_SEGMENT_PREFIX,
+                            self.nextSegmentNumber, SPOOL_SEGMENT_SUFFIX))
+        self.nextSegmentNumber += 1
+        self.segments.append(SensorSpoolSegment(path, self.segmentBytes, True))
+        self.__evictSegments()
+
+    def __evictSegments(self):
+        # evict the oldest segments if over the size cap
+        while (len(self.segments) > self.maxSegments):
+            segment = self.segments.pop(0)
+            self.droppedCount += segment.getPending()
+            self.pendingCount -= segment.getPending()
+            self.__deleteSegment(segment)
+
+    def __deleteSegment(self, segment):
+        segment.close()
+        os.remove(segment.getPath())
+
+
+class SensorSpoolSegment():
+    ''' One memory mapped spool segment file '''
+
+    def __init__(self, path, size, create):
+        self.path = path
+
+        if create:
+            with open(path, 'wb') as segmentFile:
+                segmentFile.truncate(size)
+
+        with open(path, 'r+b') as segmentFile:
+            if (os.fstat(segmentFile.fileno()).st_size < SPOOL_HEADER.size):
+                raise ValueError('spool segment too short')
+            # the mapping stays valid after the file is closed
+            self.map = mmap.mmap(segmentFile.fileno(), 0)
+
+        if create:
+            self.writeOffset = SPOOL_HEADER.size
+            self.readOffset = SPOOL_HEADER.size
+            self.recordCount = 0
+            self.readCount = 0
+            self.__writeHeader()
+        else:
+            (magic, version, self.writeOffset, self.readOffset, self.recordCount,
+                self.readCount) = SPOOL_HEADER.unpack_from(self.map)
+            if (magic != SPOOL_MAGIC) or (version != SPOOL_VERSION):
+                self.map.close()
+                raise ValueError('not a spool segment')
+            if not (SPOOL_HEADER.size <= self.readOffset <= self.writeOffset <= len(self.map)):
+                self.map.close()
+                raise ValueError('spool segment header corrupt')
+
+    def getPath(self):
+        return self.path
+
+    def getPending(self):
+        return self.recordCount - self.readCount
+
+    def append(self, topic, payload):
+        # returns False if there isn't room for the record
+        end = self.writeOffset + SPOOL_RECORD_HEADER.size + len(topic) + len(payload)
+        if (end > len(self.map)):
+            return False
+        SPOOL_RECORD_HEADER.pack_into(self.map, self.writeOffset, len(payload), len(topic))
+        start = self.writeOffset + SPOOL_RECORD_HEADER.size
+        self.map[start:start + len(topic)] = topic
+        self.map[start + len(topic):end] = bytes(payload)
+
+        # the header is updated last so a partly written record is never seen
+        self.writeOffset = end
+        self.recordCount += 1
+        self.__writeHeader()
+        return True
+
+    def peek(self, maxCount):
+        # returns up to maxCount (topic, payload, next offset) from the read offset
+        records = []
+        offset = self.readOffset
+        while (len(records) < maxCount) and (offset < self.writeOffset):
+            length, topicLength = SPOOL_RECORD_HEADER.unpack_from(self.map, offset)
+            start = offset + SPOOL_RECORD_HEADER.size
+            offset = start + topicLength + length
+            records.append((self.map[start:start + topicLength],
+                            self.map[start + topicLength:offset], offset))
+        return records
+
+    def consume(self, count, offset):
+        self.readOffset = offset
+        self.readCount += count
+        self.__writeHeader()
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+
+    def __writeHeader(self):
+        SPOOL_HEADER.pack_into(self.map, 0, SPOOL_MAGIC, SPOOL_VERSION, self.writeOffset,
+                            self.readOffset, self.recordCount, self.readCount)
@@ -0,0 +1,241 @@
+#!/usr/bin/python
+"""
+////////////////////////////////////////////////////////////////////////////
+//
+//  This file is part of RTMQTT
+//
+//  Copyright (c) 2015-2016, richards-tech, LLC
+//
+//  Permission is hereby granted, free of charge, to any person obtaining a copy of
+//  this software and associated documentation files (the "Software"), to deal in
+//  the Software without restriction, including without limitation the rights to use,
+//  copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+//  Software, and to permit persons to whom the Software is furnished to do so,
+//  subject to the following conditions:
+//
+//  The above copyright notice and this permission notice shall be included in all
+//  copies or substantial portions of the Software.
+//
+//  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+//  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+//  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+//  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+//  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+//  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+# Adaptive control of a video stream's operating point. The controller watches
+# how the MQTT client is coping with the stream's topic and, when the link is
+# saturated (frames being dropped or persistently queued), steps down to a
+# cheaper operating point. After a run of intervals with spare capacity it
+# tries the next better point again. If that immediately saturates the link,
+# the wait before the next attempt is doubled so the stream doesn't oscillate.
+#
+# An operating point is (rate fraction, JPEG quality, scale divisor). The rate
+# fraction is applied by frame decimation (see wantFrame). How quality and
+# scale are applied is up to the camera script - picamera can encode at the
+# required quality and size directly while UVC frames can be re-encoded with
+# recodeJpeg if PIL is available. A quality of None means the camera's own
+# quality, so the best point costs nothing extra.
+
+import io
+import json
+import time
+
+import SensorJSON
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# operating points, best first
+
+VIDEO_CONTROL_LEVELS = ((1.0, None, 1),
+                        (1.0, 70, 1),
+                        (0.5, 70, 1),
+                        (0.5, 60, 2),
+                        (0.25, 60, 2),
+                        (0.25, 50, 4),
+                        (0.1, 50, 4))
+
+# operating points that only use frame decimation
+
+VIDEO_CONTROL_RATE_LEVELS = ((1.0, None, 1),
+                             (0.5, None, 1),
+                             (0.25, None, 1),
+                             (0.1, None, 1))
+
+VIDEO_CONTROL_INTERVAL = 2.0                # measurement interval in seconds
+VIDEO_CONTROL_HOLD = 3                      # clean intervals needed before stepping up
+VIDEO_CONTROL_MAX_HOLD = 48                 # the longest the hold can back off to
+VIDEO_CONTROL_SATURATED_DEPTH = 1.0         # mean queued frames that means the link is full
+VIDEO_CONTROL_IDLE_DEPTH = 0.25             # mean queued frames that means there is headroom
+
+def canRecode():
+    ''' returns True if recodeJpeg is available '''
+    return Image != None
+
+def recodeJpeg(frame, quality, scale):
+    ''' re-encodes a JPEG frame at quality, reduced in size by scale. Returns
+    (jpeg, width, height). Scaling uses the JPEG decoder's own reduced size
+    decoding so is cheap. '''
+    image = Image.open(io.BytesIO(frame))
+    if (scale > 1):
+        width, height = image.size
+        size = (max(1, width // scale), max(1, height // scale))
+        image.draft('RGB', size)
+        if (image.size != size):
+            image = image.resize(size)
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=quality)
+    return output.getvalue(), image.size[0], image.size[1]
+
+class SensorVideoControl():
+    ''' Adapts a video stream's frame rate, JPEG quality and size to the link '''
+
+    def __init__(self, client, videoTopic, statusTopic, deviceID, width, height, rate,
+                 levels=VIDEO_CONTROL_LEVELS, adaptive=True):
+        self.client = client
+        self.videoTopic = videoTopic
+        self.statusTopic = statusTopic
+        self.deviceID = deviceID
+        self.width = width
+        self.height = height
+        self.rate = rate
+        self.levels = levels
+        self.adaptive = adaptive
+
+        # only the latest status is of any interest
+        client.setTopicLimit(statusTopic, 1)
+
+        self.level = 0
+        self.hold = VIDEO_CONTROL_HOLD
+        self.cleanIntervals = 0
+        self.steppedUp = False
+
+        # the measurement for the current interval
+        now = time.time()
+        self.intervalStart = now
+        self.depthTotal = 0
+        self.depthSamples = 0
+        self.lastPublished = client.getTopicPublishedCount(videoTopic)
+        self.lastDropped = client.getTopicDroppedCount(videoTopic)
+
+        # the last measurement, reported on the status topic
+        self.sentRate = 0.0
+        self.dropped = 0
+
+        # the time of the last frame passed by wantFrame
+        self.lastFrameTime = 0
+
+    def update(self):
+        ''' should be called regularly (eg after each frame). Returns True if the
+        operating point has changed. '''
+        self.depthTotal += self.client.getTopicQueueDepth(self.videoTopic)
+        self.depthSamples += 1
+
+        now = time.time()
+        elapsed = now - self.intervalStart
+        if (elapsed < VIDEO_CONTROL_INTERVAL):
+            return False
+
+        published = self.client.getTopicPublishedCount(self.videoTopic)
+        dropped = self.client.getTopicDroppedCount(self.videoTopic)
+        meanDepth = float(self.depthTotal) / self.depthSamples
+        self.sentRate = (published - self.lastPublished) / elapsed
+        self.dropped = dropped - self.lastDropped
+
+        self.intervalStart = now
+        self.depthTotal = 0
+        self.depthSamples = 0
+        self.lastPublished = published
+        self.lastDropped = dropped
+
+        changed = False
+        if self.adaptive:
+            changed = self.__control(meanDepth)
+        self.publishStatus()
+        return changed
+
+    def __control(self, meanDepth):
+        if (self.dropped > 0) or (meanDepth >= VIDEO_CONTROL_SATURATED_DEPTH):
+            # the link is full
+            if self.steppedUp:
+                # the last step up didn't fit so wait longer before trying again
+                self.hold = min(self.hold * 2, VIDEO_CONTROL_MAX_HOLD)
+            self.steppedUp = False
+            self.cleanIntervals = 0
+            if (self.level < len(self.levels) - 1):
+                self.level += 1
+                return True
+            return False
+
+        if self.steppedUp:
+            # the step up has survived an interval
+            self.steppedUp = False
+            self.cleanIntervals = 0
+            return False
+
+        if (meanDepth >= VIDEO_CONTROL_IDLE_DEPTH):
+            # coping but without much to spare
+            self.cleanIntervals = 0
+            return False
+
+        self.cleanIntervals += 1
+        if (self.cleanIntervals >= self.hold):
+            self.cleanIntervals = 0
+            if (self.level == 0):
+                # there is nothing better to try so the backoff can start again
+                self.hold = VIDEO_CONTROL_HOLD
+                return False
+            self.level -= 1
+            self.steppedUp = True
+            return True
+        return False
+
+    def wantFrame(self, timestamp):
+        ''' returns True if a frame captured at timestamp should be sent at the
+        current rate. Frames in between are skipped. '''
+        fraction = self.levels[self.level][0]
+        if (fraction >= 1.0):
+            return True
+        # allow some jitter in the frame times
+        if ((timestamp - self.lastFrameTime) < 0.9 / (self.rate * fraction)):
+            return False
+        self.lastFrameTime = timestamp
+        return True
+
+    def getLevel(self):
+        return self.level
+
+    def getQuality(self):
+        return self.levels[self.level][1]
+
+    def getScale(self):
+        return self.levels[self.level][2]
+
+    def getRate(self):
+        ''' returns the current frame rate (rounded to a whole number) '''
+        return max(1, int(round(self.rate * self.levels[self.level][0])))
+
+    def getWidth(self):
+        return self.width // self.getScale()
+
+    def getHeight(self):
+        return self.height // self.getScale()
+
+    def publishStatus(self):
+        ''' publishes the operating point and the last measurement (retained) '''
+        statusDict = {}
+        statusDict[SensorJSON.TIMESTAMP] = time.time()
+        statusDict[SensorJSON.DEVICEID] = self.deviceID
+        statusDict[SensorJSON.TOPIC] = self.statusTopic
+        statusDict[SensorJSON.VIDEO_LEVEL] = self.level
+        statusDict[SensorJSON.VIDEO_WIDTH] = self.getWidth()
+        statusDict[SensorJSON.VIDEO_HEIGHT] = self.getHeight()
+        statusDict[SensorJSON.VIDEO_RATE] = self.getRate()
+        statusDict[SensorJSON.VIDEO_QUALITY] = self.getQuality()
+        statusDict[SensorJSON.VIDEO_SENT_RATE] = round(self.sentRate, 1)
+        statusDict[SensorJSON.VIDEO_DROPPED] = self.dropped
+        self.client.publish(self.statusTopic, json.dumps(statusDict), retain=True)